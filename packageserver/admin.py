@@ -1,11 +1,210 @@
 # Imports #
 
+import operator
+
 from django.contrib import admin
+from django.contrib.admin.filterspecs import FilterSpec
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, MAX_SHOW_ALL_ALLOWED
+from django.core.paginator import InvalidPage, Paginator
+from django.db import connection
+from django.db.models import Q
 
 from models import *
+from commonjs import _related
+import platforms
+
+# Constants #
+
+"""
+Unfiltered changelists of tables with more rows than this show an estimated
+count rather than counting every row.
+"""
+ESTIMATE_THRESHOLD = 10000
+
+"""
+Sorts after any character a prefix search is likely to be followed by. See
+prefix_search().
+"""
+PREFIX_END = u"\uffff"
+
+# Counts #
+
+def estimated_count(model):
+    """Estimate the number of rows of a table without scanning it, from the
+    statistics of the database where it keeps any, or else from the highest
+    id, which overestimates by the number of deleted rows.
+    """
+    engine = connection.settings_dict['ENGINE']
+    table = model._meta.db_table
+    cursor = connection.cursor()
+    if engine.endswith('postgresql_psycopg2') or engine.endswith('postgresql'):
+        cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s",[table])
+    elif engine.endswith('mysql'):
+        cursor.execute("SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",[table])
+    else:
+        cursor.execute("SELECT MAX(%s) FROM %s" %(connection.ops.quote_name(model._meta.pk.column),connection.ops.quote_name(table)))
+    row = cursor.fetchone()
+    return row and row[0] and int(row[0]) or 0
+
+class EstimatedCountPaginator(Paginator):
+    """Count an unfiltered queryset of a large table from estimated_count()."""
+    def _get_count(self):
+        if self._count is None:
+            query = self.object_list.query
+            if not query.where and not query.having:
+                estimate = estimated_count(self.object_list.model)
+                if estimate > ESTIMATE_THRESHOLD:
+                    self._count = estimate
+                    return self._count
+            self._count = self.object_list.count()
+        return self._count
+    count = property(_get_count)
+
+# Searches #
+
+def prefix_search(qs,fields,query):
+    """Filter a queryset to the rows with one of the fields starting with
+    each word of the query. The fields hold case folded keys (see
+    models.KeyField), and the prefix is matched as a range of them rather
+    than with istartswith: SQLite does not answer a LIKE with an ESCAPE
+    clause or a bound pattern from an index.
+    """
+    for word in query.lower().split():
+        qs = qs.filter(reduce(operator.or_,[Q(**{'%s__gte' %field: word,'%s__lt' %field: word + PREFIX_END}) for field in fields]))
+    return qs
+
+# Change Lists #
+
+class ScalableChangeList(ChangeList):
+    """A changelist that estimates the count of large tables, loads the many
+    to many relations shown in list_display for the whole page at once,
+    filters packages on their platform masks and searches search_fields by
+    prefix. See ScalableAdmin.
+    """
+    def get_query_set(self):
+        # Platform parameters are not field lookups, so they are kept out of
+        # the filter() made by ChangeList, as is the search.
+        platform = {}
+        for kind,field,relation,model in platforms.KINDS:
+            if kind in self.params: platform[kind] = [self.params.pop(kind)]
+        query,self.query = self.query,''
+        try:
+            qs = super(ScalableChangeList,self).get_query_set()
+        finally:
+            for kind,names in platform.items(): self.params[kind] = names[0]
+            self.query = query
+        if platform: qs = platforms.compatible(qs,**platform)
+        if query: qs = prefix_search(qs,self.search_fields,query)
+        return qs
+
+    def get_results(self,request):
+        paginator = EstimatedCountPaginator(self.query_set,self.list_per_page)
+        result_count = paginator.count
+        if not self.query_set.query.where: full_result_count = result_count
+        else: full_result_count = EstimatedCountPaginator(self.root_query_set,self.list_per_page).count
+
+        can_show_all = result_count <= MAX_SHOW_ALL_ALLOWED
+        multi_page = result_count > self.list_per_page
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.query_set._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num + 1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
+
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = self.model_admin.load_related(list(result_list))
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+class PlatformFilterSpec(FilterSpec):
+    """Filter packages on the platforms they run on, given by the os_mask,
+    cpu_mask or engine_mask in list_filter. The filter tests the mask on the
+    package row rather than joining through the requirement tables.
+    """
+    def __init__(self,f,request,params,model,model_admin):
+        super(PlatformFilterSpec,self).__init__(f,request,params,model,model_admin)
+        for kind,field,relation,vocabulary in platforms.KINDS:
+            if field == f.name: break
+        self.kind = kind
+        self.vocabulary = vocabulary
+        self.lookup_val = request.GET.get(kind,None)
+        self.lookup_choices = list(vocabulary.objects.order_by('title').values_list('name','title'))
+
+    def has_output(self):
+        return len(self.lookup_choices) > 0
+
+    def title(self):
+        return "%s compatibility" %self.vocabulary._meta.verbose_name
+
+    def choices(self,cl):
+        yield {'selected': self.lookup_val is None,'query_string': cl.get_query_string({},[self.kind]),'display': "All"}
+        for name,title in self.lookup_choices:
+            yield {'selected': self.lookup_val == name,'query_string': cl.get_query_string({self.kind: name}),'display': title}
+
+# ChangeList only falls through to the specs registered after the catch-all
+# AllValuesFilterSpec if they are first.
+FilterSpec.filter_specs.insert(0,(lambda f: f.model is Package and f.name in ('os_mask','cpu_mask','engine_mask'),PlatformFilterSpec))
 
 # Model Admin #
 
+class ScalableAdmin(admin.ModelAdmin):
+    """Admin for tables too large to count or to list in a select widget.
+    Name the many to many relations to show on the changelist in
+    related_display. The search_fields are searched by prefix, and should be
+    KeyFields or other indexed, case folded columns.
+    """
+    related_display = ()
+    list_per_page = 50
+
+    def get_changelist(self,request,**kwargs):
+        return ScalableChangeList
+
+    def load_related(self,objects):
+        """Load the related_display relations of a page of objects with one
+        query each, as a list of names on _<relation>.
+        """
+        ids = [obj.pk for obj in objects]
+        for name,fields in self.related_display:
+            related = ids and _related(ids,self.model,name,fields) or {}
+            for obj in objects:
+                setattr(obj,'_%s' %name,[" ".join([unicode(value) for value in row if value]) for row in related.get(obj.pk,[])])
+        return objects
+
+class ContactAdmin(ScalableAdmin):
+    list_display = ('first_name','last_name','email','website','maintained_count','contributed_count')
+    search_fields = ('last_name_key','first_name_key','email_key')
+
+class DependencyInline(admin.TabularInline):
+    model = Dependency
+    fk_name = 'from_package'
+    raw_id_fields = ('to_package',)
+    extra = 1
+
+class PackageAdmin(ScalableAdmin):
+    list_display = ('name','title','version','maintainer_names','dependent_count','is_builtin')
+    list_filter = ('os_mask','cpu_mask','engine_mask','is_builtin')
+    search_fields = ('name_key','title_key')
+    ordering = ('name',)
+    related_display = (('maintainers',('first_name','last_name')),)
+    raw_id_fields = ('requirements','maintainers','contributors','licenses','repositories','directories','implements','scripts')
+    inlines = [DependencyInline]
+
+    def maintainer_names(self,package):
+        return ", ".join(getattr(package,'_maintainers',()))
+    maintainer_names.short_description = "Maintainers"
+
+class Package_VersionAdmin(ScalableAdmin):
+    list_display = ('package','number','document_modified')
+    list_select_related = True
+    search_fields = ('package__name_key',)
+    raw_id_fields = ('package',)
+
+admin.site.register(Contact,ContactAdmin)
 admin.site.register(Cpu)
 admin.site.register(Directory)
 admin.site.register(JavaScript_Engine)
@@ -15,4 +214,5 @@ admin.site.register(Repo)
 admin.site.register(Script)
 admin.site.register(Specification)
 admin.site.register(System_Requirement)
-admin.site.register(Package)
+admin.site.register(Package,PackageAdmin)
+admin.site.register(Package_Version,Package_VersionAdmin)
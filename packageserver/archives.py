@@ -0,0 +1,170 @@
+"""
+Content-addressed storage of package archives.
+
+An uploaded archive is copied from the request to disk in fixed size chunks,
+and its sha256 and md5 digests are updated with each chunk, so an archive is
+never held in memory whatever its size. The file is written under a temporary
+name and then renamed to its sha256 digest, so readers never see a partial
+file and identical uploads are stored once.
+
+Downloads are served from the file by the web server when
+PACKAGE_ARCHIVE_SENDFILE names a sendfile header, or otherwise streamed in
+chunks. Single byte ranges are honored so that interrupted downloads can be
+resumed.
+"""
+
+# Imports #
+
+import os
+import re
+import tempfile
+from datetime import datetime
+from hashlib import md5, sha256
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.conf import settings
+from django.utils.datastructures import SortedDict
+
+from models import *
+from bulk import bulk_update
+from changes import record
+from documents import refresh_documents, stored_fields
+from schema import PACKAGE
+
+# Constants #
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Exceptions #
+
+class IncompleteUpload(Exception):
+    """The request body ended before the declared Content-Length."""
+
+# Storage #
+
+def root():
+    """The directory that holds the archives."""
+    return settings.PACKAGE_ARCHIVE_ROOT
+
+def relative_path(sha256):
+    """The path of an archive below the root. Archives are spread over two
+    levels of directories so that no one directory grows too large.
+    """
+    return os.path.join(sha256[:2],sha256[2:4],sha256)
+
+def path(archive):
+    """The absolute path of an archive file."""
+    return os.path.join(root(),relative_path(archive.sha256))
+
+def store(stream,length):
+    """Copy length bytes of stream to the archive store, computing the
+    checksums as the data goes by. Returns the Archive, which already exists
+    if the same content was uploaded before.
+    """
+    if not os.path.isdir(root()): os.makedirs(root())
+    # The temporary file is made in the root so the rename below stays on
+    # one file system.
+    descriptor,temporary = tempfile.mkstemp(prefix='.upload-',dir=root())
+    sha,md = sha256(),md5()
+    size = 0
+    try:
+        f = os.fdopen(descriptor,'wb')
+        try:
+            while size < length:
+                chunk = stream.read(min(CHUNK_SIZE,length - size))
+                if not chunk: raise IncompleteUpload("Expected %s bytes, received %s." %(length,size))
+                sha.update(chunk)
+                md.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        finally:
+            f.close()
+
+        digest = sha.hexdigest()
+        destination = os.path.join(root(),relative_path(digest))
+        if os.path.exists(destination):
+            os.remove(temporary)
+        else:
+            if not os.path.isdir(os.path.dirname(destination)): os.makedirs(os.path.dirname(destination))
+            os.chmod(temporary,0o644)
+            os.rename(temporary,destination)
+    except:
+        if os.path.exists(temporary): os.remove(temporary)
+        raise
+
+    archive,created = Archive.objects.get_or_create(sha256=digest,defaults={'md5': md.hexdigest(),'size': size})
+    return archive
+
+def attach(version,archive):
+    """Make archive the archive of a package version that has none, and add
+    its checksums to the stored document of the version. Returns False, and
+    changes nothing, if the version already has an archive.
+    """
+    if not Package_Version.objects.filter(pk=version.pk,archive__isnull=True).update(archive=archive): return False
+    version.archive = archive
+    if version.number == version.package.version:
+        refresh_documents([version.package_id])
+    elif version.document:
+        # The documents of earlier versions are not rendered again, so the
+        # checksums are added to the stored one.
+        data = json.loads(version.document,object_pairs_hook=SortedDict)
+        data['checksums'] = archive.checksums()
+        fields = stored_fields(PACKAGE.encode(data),datetime.now())
+        bulk_update(Package_Version,('document','document_gzip','document_etag','document_modified'),[fields + (version.pk,)])
+        record([(version.package.name,version.number)])
+    return True
+
+# Serving #
+
+def parse_range(header,size):
+    """Parse a Range header against a file of the given size. Returns an
+    inclusive (first, last) byte tuple, None when the whole file should be
+    sent (no header, or one this does not handle, such as several ranges),
+    or False when the range cannot be satisfied.
+    """
+    match = RANGE.match(header.strip())
+    if not match: return None
+    first,last = match.groups()
+    if not first and not last: return None
+    if not first:
+        # A suffix range: the last N bytes.
+        length = int(last)
+        if not length: return False
+        return max(size - length,0),size - 1
+    first = int(first)
+    if last: last = min(int(last),size - 1)
+    else: last = size - 1
+    if first >= size or first > last: return False
+    return first,last
+
+def read_range(filename,first,last):
+    """Generate the bytes from first to last, inclusive, of a file in
+    chunks.
+    """
+    f = open(filename,'rb')
+    try:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE,remaining))
+            if not chunk: break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def sendfile(archive):
+    """Get the (header, value) that has the web server send an archive, or 
+    None when Django serves archives itself. See PACKAGE_ARCHIVE_SENDFILE.
+    """
+    header = getattr(settings,'PACKAGE_ARCHIVE_SENDFILE',None)
+    if not header: return None
+    prefix = getattr(settings,'PACKAGE_ARCHIVE_SENDFILE_PREFIX',None)
+    if prefix: return header,"%s/%s" %(prefix.rstrip('/'),relative_path(archive.sha256).replace(os.sep,'/'))
+    return header,path(archive)
@@ -0,0 +1,119 @@
+"""
+Batched fetches of package documents.
+
+An installer resolving a build needs the descriptors of hundreds of packages,
+and fetching them one registry/<name> request at a time costs a round trip
+and a few queries each. Instead, registry/-/batch takes a list of package
+specs, each a name for the latest version or name@version for a given one,
+and answers with all of their documents in one response.
+
+The documents are the ones stored by documents.py, so the relations of the
+packages are not loaded at all unless a current document was never rendered,
+in which case the missing documents are rendered together by
+bulk_to_commonjs(). The specs are read in chunks of BATCH_CHUNK. A chunk
+reads only the versions it picks, whatever the history of the packages: one
+query for the ids of the packages named, one for all the name@version specs,
+matched on the (package, is_release, major, minor, patch, prerelease_key)
+index, and one for the latest version of each package named without a
+version, which is the first row of the same index. The stored text is copied
+into the response as is, never parsed.
+"""
+
+# Imports #
+
+import operator
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+
+from models import Package, Package_Version
+from documents import refresh_documents
+from schema import NAME
+import semver
+
+# Constants #
+
+"""
+The most specs in one batch.
+"""
+MAX_BATCH = 1000
+
+"""
+Specs read per chunk. A streamed response writes the documents of a chunk
+before it reads the next.
+"""
+BATCH_CHUNK = 100
+
+# Functions #
+
+def parse_spec(spec):
+    """Parse a "name" or "name@version" spec into a (name, version key)
+    tuple, where the key is None for the latest version. See semver.key().
+    Raises ValueError if the spec is malformed.
+    """
+    name,separator,version = spec.strip().partition('@')
+    if not NAME.match(name): raise ValueError("Invalid package name: %r" %spec)
+    if not separator: return name,None
+    return name,semver.key(*semver.parse(version))
+
+def parse_specs(specs):
+    """Parse a list of specs into (spec, name, version key) tuples, in order
+    and without repeats. Raises ValueError if any spec is malformed or there
+    are more than MAX_BATCH.
+    """
+    parsed = []
+    seen = set()
+    for spec in specs:
+        if not isinstance(spec,basestring): raise ValueError("Packages must be given as strings: %r" %(spec,))
+        spec = spec.strip()
+        if spec in seen: continue
+        seen.add(spec)
+        parsed.append((spec,) + parse_spec(spec))
+    if len(parsed) > MAX_BATCH: raise ValueError("At most %s packages may be fetched at once." %MAX_BATCH)
+    return parsed
+
+def _fetch_chunk(specs):
+    """Get a list of the (spec, name, version, document) tuples of a chunk of
+    parsed specs. See fetch_documents().
+    """
+    packages = Package.objects.filter(name__in=list(set([name for spec,name,key in specs])))
+    database = packages.db
+    ids = dict(packages.values_list('name','pk'))
+    versions = Package_Version.objects.using(database)
+    fields = ('pk','package','number','document_etag','document')
+
+    # (package id, version key) to the row of each version picked, where the
+    # key is None for the latest.
+    picked = {}
+    exact = set([(ids[name],key) for spec,name,key in specs if key is not None and name in ids])
+    if exact:
+        query = reduce(operator.or_,[Q(package=pk,major=major,minor=minor,patch=patch,is_release=is_release,prerelease_key=prerelease_key) for pk,(major,minor,patch,is_release,prerelease_key) in exact])
+        for row in versions.filter(query).values_list('major','minor','patch','is_release','prerelease_key',*fields):
+            picked[(row[6],(row[0],row[1],row[2],bool(row[3]),row[4]))] = row[5:]
+    for pk in set([ids[name] for spec,name,key in specs if key is None and name in ids]):
+        rows = list(versions.filter(package=pk).order_by('-is_release','-major','-minor','-patch','-prerelease_key').values_list(*fields)[:1])
+        if rows: picked[(pk,None)] = rows[0]
+
+    stale = set([package for pk,package,number,etag,document in picked.values() if etag is None])
+    if stale:
+        refresh_documents(stale)
+        # The new documents are only on the primary until they reach the
+        # replicas.
+        pks = [pk for pk,package,number,etag,document in picked.values() if package in stale]
+        documents = dict(Package_Version.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=pks).values_list('pk','document'))
+        for key,(pk,package,number,etag,document) in picked.items():
+            if pk in documents: picked[key] = (pk,package,number,etag,documents[pk])
+    results = []
+    for spec,name,key in specs:
+        row = name in ids and picked.get((ids[name],key))
+        results.append((spec,name,row and row[2] or None,row and row[4] or None))
+    return results
+
+def fetch_documents(specs,chunk=BATCH_CHUNK):
+    """Generate a (spec, name, version, document) tuple for each of a list of
+    parsed specs, in order, where version is the number of the version
+    picked and document is its stored JSON text. Both are None when the
+    package or version does not exist. See parse_specs().
+    """
+    for start in range(0,len(specs),chunk):
+        for item in _fetch_chunk(specs[start:start + chunk]): yield item
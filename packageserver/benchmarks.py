@@ -0,0 +1,499 @@
+"""
+Synthetic registry data and timing helpers for the benchmark commands.
+
+Benchmarks run against a throwaway test database, never the real one. See
+test_database().
+
+The synthetic registry is generated from a seed, so two runs with the same
+size and seed benchmark the same data and their results can be compared.
+"""
+
+# Imports #
+
+import base64
+import httplib
+import os
+import random
+import threading
+import time
+from multiprocessing import Pool
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.db import connection, connections
+from django.utils.datastructures import SortedDict
+
+from models import *
+from bulk import bulk_insert
+from documents import deferred
+from importer import Importer
+from schema import Array, Object, PACKAGE_FIELDS
+
+# Constants #
+
+WORDS = (
+    "async","browser","cache","cli","color","config","crypto","css","date","db",
+    "dom","events","file","fs","http","json","lint","log","math","mock","net",
+    "parse","path","promise","query","router","server","shell","sql","stream",
+    "string","template","test","time","url","util","validate","web","xml","zip",
+)
+
+LICENSES = ("MIT","BSD","GPLv2","GPLv3","LGPL","Apache-2.0","MPL","ISC")
+
+OPERATING_SYSTEMS = ("linux","macos","windows","freebsd","solaris","aix")
+
+CPUS = ("x86","x86_64","arm","mips","ppc","sparc")
+
+ENGINES = ("node","rhino","v8","spidermonkey","narwhal","jsc","flusspferd")
+
+"""
+The kinds of request made by a load test, with their default shares of the
+traffic. See traffic().
+"""
+TRAFFIC_MIX = (
+    ('fetch',70),
+    ('versions',8),
+    ('catalog',1),
+    ('search',10),
+    ('browse',5),
+    ('batch',5),
+    ('publish',1),
+)
+
+"""
+Statuses of requests that succeeded.
+"""
+SUCCESS = (200,201,304)
+
+"""
+Packages per batch request, and bytes per archive published, in a load test.
+"""
+LOAD_BATCH_SIZE = 50
+LOAD_ARCHIVE_SIZE = 16 * 1024
+
+"""
+The username and password of the user load tests publish as.
+"""
+LOAD_PUBLISHER = ("load-publisher","load-publisher")
+
+# Classes #
+
+class test_database(object):
+    """Create a test database for the duration of a with block and destroy
+    it afterwards, the same way the test runner does. Databases with a 
+    TEST_MIRROR, such as the replicas, are pointed at the test database.
+    """
+    def __init__(self,verbosity=0,name=None):
+        self.verbosity = verbosity
+        # The file of an SQLite test database, which is otherwise kept in 
+        # memory and so only visible to the thread that created it.
+        self.test_name = name
+
+    def __enter__(self):
+        self.name = connection.settings_dict['NAME']
+        self.previous_test_name = connection.settings_dict['TEST_NAME']
+        if self.test_name: connection.settings_dict['TEST_NAME'] = self.test_name
+        self.mirrors = [(alias,connections[alias].settings_dict['NAME']) for alias in connections if connections[alias].settings_dict['TEST_MIRROR']]
+        connection.creation.create_test_db(self.verbosity,autoclobber=True)
+        for alias,name in self.mirrors:
+            connections[alias].close()
+            connections[alias].settings_dict['NAME'] = connections[connections[alias].settings_dict['TEST_MIRROR']].settings_dict['NAME']
+        return self
+
+    def __exit__(self,*args):
+        for alias,name in self.mirrors:
+            connections[alias].close()
+            connections[alias].settings_dict['NAME'] = name
+        connection.creation.destroy_test_db(self.name,self.verbosity)
+        connection.settings_dict['TEST_NAME'] = self.previous_test_name
+
+# Functions #
+
+def timed(function,repeat=5):
+    """Call function repeat times. Returns the fastest time in milliseconds
+    and the number of queries issued by one call.
+    """
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        function()
+        times.append((time.time() - start) * 1000)
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    connection.queries = []
+    try:
+        function()
+        queries = len(connection.queries)
+    finally:
+        settings.DEBUG = debug
+    return min(times),queries
+
+def dependency_graph(depth,width,fanout,prefix="graph",seed=0):
+    """Create a layered dependency graph below a single root package. Each of
+    the depth levels holds width packages, and every package depends on
+    fanout packages of the next level down. Returns the root package.
+    """
+    random.seed(seed)
+    through = Package.dependencies.through
+    requirements = System_Requirement.objects.create()
+    with deferred():
+        def create(name):
+            return Package.objects.create(title=name,name=name,version="1.0.0",description="The %s package." %name,requirements=requirements)
+        root = create("%s-root" %prefix)
+        above = [root]
+        for level in range(depth):
+            below = [create("%s-%s-%s" %(prefix,level,i)) for i in range(width)]
+            for package in above:
+                targets = package is root and below or random.sample(below,min(fanout,width))
+                for target in targets: through.objects.create(from_package=package,to_package=target)
+            above = below
+    return root
+
+def skewed(population,count):
+    """Pick up to count distinct items of population, favoring the front of
+    it the way a few popular packages and people account for most of the
+    references in a real registry.
+    """
+    count = min(count,len(population))
+    picked = set()
+    while len(picked) < count:
+        picked.add(population[min(int(random.paretovariate(1.2)) - 1,len(population) - 1)])
+    return list(picked)
+
+def version_number():
+    """A random version number, now and then a pre-release."""
+    number = "%s.%s.%s" %(random.randint(0,5),random.randint(0,20),random.randint(0,30))
+    if random.random() < 0.1: number += "-beta%s" %random.randint(1,5)
+    return number
+
+def ordering(version):
+    """The sort key of a Package_Version. See Package_VersionManager."""
+    return (version.is_release,version.major,version.minor,version.patch,version.prerelease_key)
+
+def synthetic_descriptors(count,seed=0):
+    """Generate count package.json descriptors. Packages only depend on ones
+    generated before them, so the dependency graph has no cycles, and the
+    number of contributors, licenses, dependencies and platform names per
+    package vary the way they do in a real registry.
+    """
+    random.seed(seed)
+    people = ["Person %s <person%s@example.com>" %(i,i) for i in range(max(count // 5,10))]
+    names = []
+    for i in range(count):
+        name = "%s-%s-%s" %(random.choice(WORDS),random.choice(WORDS),i)
+        descriptor = {
+            "name": name,
+            "version": version_number(),
+            "description": "A %s library for %s." %(" ".join(random.sample(WORDS,3)),random.choice(WORDS)),
+            "keywords": random.sample(WORDS,random.randint(0,6)),
+            "maintainers": skewed(people,random.randint(1,2)),
+            "contributors": skewed(people,random.randint(0,6)),
+            "licenses": [{"type": license,"url": "http://example.com/licenses/%s" %license} for license in skewed(LICENSES,random.choice((1,1,1,2)))],
+            "repositories": [{"type": "git","url": "http://example.com/%s.git" %name}],
+            "dependencies": dict([(dependency,"1.0.0") for dependency in skewed(names,random.randint(0,8))]),
+            "directories": {"lib": "lib"},
+        }
+        if random.random() < 0.3: descriptor['os'] = random.sample(OPERATING_SYSTEMS,random.randint(1,3))
+        if random.random() < 0.2: descriptor['cpu'] = random.sample(CPUS,random.randint(1,3))
+        if random.random() < 0.5: descriptor['engine'] = random.sample(ENGINES,random.randint(1,3))
+        names.append(name)
+        yield descriptor
+
+def synthetic_registry(count,seed=0,batch_size=500,history=5):
+    """Fill the database with a synthetic registry of count packages, each
+    with up to history earlier versions. Returns the names of the packages.
+    """
+    importer = Importer()
+    batch = []
+    for descriptor in synthetic_descriptors(count,seed):
+        batch.append((descriptor['name'],descriptor))
+        if len(batch) >= batch_size:
+            importer.import_batch(batch)
+            batch = []
+    if batch: importer.import_batch(batch)
+    importer.finish()
+
+    # The earlier versions sort below the current one, as they would in a 
+    # real registry.
+    random.seed(seed)
+    versions = []
+    for pk,current in Package.objects.values_list('pk','version'):
+        latest = Package_Version(number=current)
+        latest.parse_number()
+        for number in set([version_number() for i in range(random.randint(0,history))]):
+            version = Package_Version(package_id=pk,number=number)
+            version.parse_number()
+            if ordering(version) < ordering(latest): versions.append(version)
+    for start in range(0,len(versions),batch_size):
+        bulk_insert(Package_Version,versions[start:start+batch_size])
+    return list(Package.objects.order_by('pk').values_list('name',flat=True))
+
+def percentile(values,fraction):
+    """The value below which the given fraction of the sorted values lie."""
+    if not values: return None
+    return values[min(int(len(values) * fraction),len(values) - 1)]
+
+def _send(host,port,method,path,body=None,headers=None):
+    """Make a request on a connection of its own, as install tools do. body
+    is the request body, or for uploads the number of random bytes to send,
+    so that no two uploads are the same. Returns the seconds taken and the
+    status, which is 0 if the request failed outright.
+    """
+    # A unicode path would make httplib decode a binary body to join them.
+    if isinstance(path,unicode): path = path.encode('utf-8')
+    headers = dict(headers or {},**{'Accept-Encoding': 'gzip'})
+    if isinstance(body,(int,long)):
+        body = os.urandom(body)
+        headers['Content-Type'] = 'application/octet-stream'
+    elif body is not None:
+        headers['Content-Type'] = 'application/json'
+    start = time.time()
+    try:
+        http = httplib.HTTPConnection(host,port,timeout=60)
+        http.request(method,path,body,headers)
+        response = http.getresponse()
+        response.read()
+        status = response.status
+        http.close()
+    except Exception:
+        status = 0
+    return time.time() - start,status
+
+def _client(args):
+    """Make requests of a traffic mix to a server on several threads. Runs in
+    the worker processes of mixed_load(). Returns a list of (kind, seconds,
+    status) tuples.
+    """
+    host,port,traffic,threads,requests,seed,first,clients = args
+    total = sum([weight for kind,weight,choices in traffic])
+    results = []
+    lock = threading.Lock()
+    def fetch(index):
+        chooser = random.Random(seed * 1000 + index)
+        uploads = {}
+        mine = []
+        for i in range(requests):
+            point = chooser.uniform(0,total)
+            for kind,weight,choices in traffic:
+                point -= weight
+                if point < 0: break
+            if choices[0][0] == 'PUT':
+                # An upload is only accepted once, so each client works
+                # through a share of the uploads of its own.
+                share = uploads.setdefault(kind,choices[first + index::clients])
+                request = share and share.pop() or chooser.choice(choices)
+            else:
+                request = chooser.choice(choices)
+            mine.append((kind,) + _send(host,port,*request))
+        lock.acquire()
+        results.extend(mine)
+        lock.release()
+    workers = [threading.Thread(target=fetch,args=(i,)) for i in range(threads)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+    return results
+
+def mixed_load(host,port,traffic,clients=32,requests=20,processes=4,seed=0):
+    """Have clients concurrent clients each make requests requests drawn from
+    a traffic mix, a list of (kind, weight, requests) tuples where each
+    request is a (method, path, body, headers) tuple (see traffic()). Each
+    PUT request is made once, until the clients run out of them. The clients run
+    in processes of their own so that they do not compete with the server
+    for the interpreter lock. Returns the elapsed seconds and a list of
+    (kind, seconds, status) tuples.
+    """
+    processes = max(1,min(processes,clients))
+    shares = [clients // processes + (i < clients % processes and 1 or 0) for i in range(processes)]
+    pool = Pool(processes)
+    try:
+        start = time.time()
+        firsts = [sum(shares[:i]) for i in range(processes)]
+        batches = pool.map(_client,[(host,port,traffic,threads,requests,seed + i,firsts[i],clients) for i,threads in enumerate(shares) if threads])
+        elapsed = time.time() - start
+    finally:
+        pool.terminate()
+    return elapsed,[result for batch in batches for result in batch]
+
+def http_load(host,port,paths,clients=32,requests=20,processes=4,seed=0):
+    """Have clients concurrent clients each make requests GET requests for
+    paths chosen at random. See mixed_load(). Returns the elapsed seconds
+    and a sorted list of latencies in seconds, and the number of failed
+    requests.
+    """
+    traffic = [('get',1,[('GET',path,None,None) for path in paths])]
+    elapsed,results = mixed_load(host,port,traffic,clients,requests,processes,seed)
+    latencies = sorted([seconds for kind,seconds,status in results])
+    failures = len([status for kind,seconds,status in results if status not in SUCCESS])
+    return elapsed,latencies,failures
+
+def parse_mix(text):
+    """Parse a traffic mix given as comma separated kind=weight pairs, such
+    as "fetch=90,search=9,publish=1", into a list of (kind, weight) tuples.
+    A kind given without a weight gets its default one from TRAFFIC_MIX.
+    Raises ValueError for an unknown kind or a bad weight.
+    """
+    defaults = dict(TRAFFIC_MIX)
+    mix = []
+    for pair in text.split(','):
+        if not pair.strip(): continue
+        kind,separator,weight = pair.partition('=')
+        kind = kind.strip()
+        if kind not in defaults: raise ValueError("Unknown kind of request: %r" %kind)
+        if not separator:
+            weight = defaults[kind]
+        else:
+            try:
+                weight = int(weight)
+            except ValueError:
+                raise ValueError("The weight of %s must be a number: %r" %(kind,weight))
+        if weight < 0: raise ValueError("The weight of %s must not be negative." %kind)
+        if weight: mix.append((kind,weight))
+    if not mix: raise ValueError("The traffic mix is empty.")
+    return mix
+
+def load_publisher():
+    """Make sure the user that load tests publish as exists with permission
+    to upload archives. Returns its username and password.
+    """
+    username,password = LOAD_PUBLISHER
+    if not User.objects.filter(username=username).exists():
+        user = User.objects.create_user(username,"%s@example.com" %username,password)
+        user.user_permissions.add(Permission.objects.get(content_type__app_label='packageserver',codename='change_package'))
+    return username,password
+
+def traffic(names,mix=TRAFFIC_MIX,count=200,seed=0):
+    """Build up to count requests of each kind in a traffic mix for a
+    synthetic registry of the given package names, as the (kind, weight,
+    requests) tuples taken by mixed_load(). Packages are picked with
+    skewed(), so a few popular ones get most of the reads. Publishes upload
+    an archive, as a user made to publish with, to each of the versions
+    that have none, in random order.
+    """
+    random.seed(seed)
+    built = []
+    for kind,weight in mix:
+        if kind == 'fetch':
+            requests = [('GET',"/registry/%s/" %name,None,None) for name in skewed(names,count)]
+        elif kind == 'versions':
+            requests = [('GET',"/registry/%s/versions/" %name,None,None) for name in skewed(names,count)]
+        elif kind == 'catalog':
+            requests = [('GET',"/registry/",None,None)]
+        elif kind == 'search':
+            requests = [('GET',"/registry/-/search/?q=%s" %"+".join(random.sample(WORDS,random.randint(1,2))),None,None) for i in range(count)]
+        elif kind == 'browse':
+            requests = [('GET',"/registry/-/browse/?sort=%s&limit=50" %sort,None,None) for sort in ('name','updated')]
+        elif kind == 'batch':
+            requests = [('POST',"/registry/-/batch/",json.dumps(skewed(names,LOAD_BATCH_SIZE)),None) for i in range(min(count,20))]
+        elif kind == 'publish':
+            headers = {'Authorization': "Basic %s" %base64.b64encode("%s:%s" %load_publisher())}
+            versions = list(Package_Version.objects.filter(archive__isnull=True).values_list('package__name','number'))
+            random.shuffle(versions)
+            requests = [('PUT',"/registry/%s/%s/archive/" %version,LOAD_ARCHIVE_SIZE,headers) for version in versions]
+        else:
+            raise ValueError("Unknown kind of request: %r" %kind)
+        if requests: built.append((kind,weight,requests))
+    return built
+
+def load_report(elapsed,results):
+    """Summarize the results of mixed_load(), by kind of request, the most
+    made first, and then for all of them, as (kind, requests, requests per
+    second, p50, p95 and p99 latency in milliseconds, error rate) tuples.
+    """
+    kinds = {}
+    for kind,seconds,status in results: kinds.setdefault(kind,[]).append((seconds,status))
+    kinds = sorted(kinds.items(),key=lambda item: (-len(item[1]),item[0]))
+    kinds.append(('all',[(seconds,status) for kind,seconds,status in results]))
+    rows = []
+    for kind,measured in kinds:
+        latencies = sorted([seconds for seconds,status in measured])
+        errors = len([status for seconds,status in measured if status not in SUCCESS])
+        rows.append((
+            kind,
+            len(measured),
+            len(measured) / elapsed,
+            (percentile(latencies,0.5) or 0) * 1000,
+            (percentile(latencies,0.95) or 0) * 1000,
+            (percentile(latencies,0.99) or 0) * 1000,
+            measured and float(errors) / len(measured) or 0.0,
+        ))
+    return rows
+
+def sorted_document(data,kind=PACKAGE_FIELDS):
+    """Rebuild plain document data as SortedDicts in schema order, the way
+    documents were built for json.dumps() before schema.py.
+    """
+    if isinstance(kind,Object):
+        return SortedDict([(key,sorted_document(data[key],field)) for key,field,required in kind.fields if data.get(key) is not None])
+    if isinstance(kind,Array):
+        return [sorted_document(entry,kind.item) for entry in data]
+    return data
+
+def concatenated_document(data):
+    """Write a document by formatting and appending strings, the way the
+    to_commonjs() methods of Contact, License, Repo and Directory did before
+    schema.py. Nothing is escaped. Kept as the baseline of
+    encoding_throughput().
+    """
+    js = '{"name": "%s","version": "%s","description": "%s"' %(data['name'],data['version'],data['description'])
+    if data.get('keywords'): js += ',"keywords": [%s]' %",".join(['"%s"' %word for word in data['keywords']])
+    for relation in ('maintainers','contributors'):
+        js += ',"%s": [' %relation
+        for i,person in enumerate(data[relation]):
+            if i: js += ","
+            js += '{"name": "%s"' %person['name']
+            if person.get('email'): js += ',"email": "%s"' %person['email']
+            if person.get('web'): js += ',"web": "%s"' %person['web']
+            js += "}"
+        js += "]"
+    js += ',"licenses": ['
+    for i,license in enumerate(data['licenses']):
+        if i: js += ","
+        js += '{"type": "%s","url": "%s"}' %(license['type'],license['url'])
+    js += '],"repositories": ['
+    for i,repo in enumerate(data['repositories']):
+        if i: js += ","
+        js += '{"type": "%s","url": "%s"' %(repo['type'],repo['url'])
+        if repo.get('path'): js += ',"path": "%s"' %repo['path']
+        js += "}"
+    js += '],"dependencies": {'
+    for i,(name,version) in enumerate(data['dependencies'].items()):
+        if i: js += ","
+        js += '"%s": "%s"' %(name,version)
+    js += "}"
+    for key in ('os','cpu','engine','implements'):
+        if data.get(key): js += ',"%s": [%s]' %(key,",".join(['"%s"' %value for value in data[key]]))
+    for key in ('scripts','directories'):
+        if data.get(key): js += ',"%s": {%s}' %(key,",".join(['"%s": "%s"' %item for item in data[key].items()]))
+    for key in ('main','homepage'):
+        if data.get(key): js += ',"%s": "%s"' %(key,data[key])
+    js += "}"
+    return js
+
+def encoding_throughput(documents,seconds=1.0):
+    """Measure how many of the given document data each way of writing them
+    encodes per second, and the validator checks per second. Returns a
+    SortedDict of method to documents per second.
+    """
+    from schema import DESCRIPTOR, PACKAGE
+    methods = SortedDict()
+    methods['concatenation'] = concatenated_document
+    methods['sorted_dict_json_dumps'] = lambda data: json.dumps(sorted_document(data))
+    methods['sorted_dict_json_dumps_pretty'] = lambda data: json.dumps(sorted_document(data),indent=2)
+    methods['schema_compact'] = PACKAGE.encode
+    methods['schema_pretty'] = lambda data: PACKAGE.encode(data,True)
+    methods['schema_validate'] = DESCRIPTOR.validate
+
+    results = SortedDict()
+    for method,function in methods.items():
+        count = 0
+        start = time.time()
+        while time.time() - start < seconds:
+            for data in documents: function(data)
+            count += len(documents)
+        results[method] = round(count / (time.time() - start))
+    return results
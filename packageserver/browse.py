@@ -0,0 +1,118 @@
+"""
+Keyset pagination of the package list.
+
+Paging with OFFSET has the database read and throw away every row before the
+page, so each page is slower than the one before it. registry/-/browse instead
+starts each page after the key of the last row of the previous one, in one of
+two orders: by name, or newest first by (updated, id). Both are read from an
+index (the unique index on name, and the index on updated and id created in
+sql/package.sql), so a page costs the same however far along it is.
+
+Clients are handed the position as an opaque cursor: the sort and the key of
+the last row, in URL safe base64. The platform (see platforms.py) and license
+filters are tested on the rows as the index yields them. The license filter
+is an EXISTS against the intermediary table rather than a join, so that the
+order still comes from the index.
+"""
+
+# Imports #
+
+import base64
+from datetime import datetime
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.db import connection
+
+from models import License, Package
+from platforms import compatible
+
+# Constants #
+
+SORTS = ('name','updated')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Cursors #
+
+class CursorError(ValueError):
+    """A cursor that was not made by encode_cursor()."""
+
+def encode_cursor(sort,key):
+    """Make the cursor of the position after the row with the given key in
+    an order.
+    """
+    values = [isinstance(value,datetime) and value.isoformat() or value for value in key]
+    return base64.urlsafe_b64encode(json.dumps([sort] + values,separators=(',',':'))).rstrip('=')
+
+def decode_cursor(cursor):
+    """Get the (sort, key) of a cursor. Raises CursorError if it is not
+    valid.
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4)))
+        sort,values = data[0],data[1:]
+        if sort == 'name' and len(values) == 1:
+            return sort,(unicode(values[0]),)
+        if sort == 'updated' and len(values) == 2:
+            format = '.' in values[0] and '%Y-%m-%dT%H:%M:%S.%f' or '%Y-%m-%dT%H:%M:%S'
+            return sort,(datetime.strptime(values[0],format),int(values[1]))
+    except (TypeError,ValueError,IndexError,UnicodeError):
+        pass
+    raise CursorError("Invalid cursor: %r" %cursor)
+
+# Functions #
+
+def licensed(packages,abbreviations):
+    """Filter a Package queryset down to the packages released under any of
+    the licenses with the given abbreviations.
+    """
+    ids = list(License.objects.filter(abbreviation__in=abbreviations).values_list('pk',flat=True))
+    if not ids: return packages.none()
+    qn = connection.ops.quote_name
+    field = Package._meta.get_field('licenses')
+    where = "EXISTS (SELECT 1 FROM %s WHERE %s = %s.%s AND %s IN (%s))" %(
+        qn(field.m2m_db_table()),
+        qn(field.m2m_column_name()),
+        qn(Package._meta.db_table),
+        qn(Package._meta.pk.column),
+        qn(field.m2m_reverse_name()),
+        ",".join(["%s"] * len(ids)),
+    )
+    return packages.extra(where=[where],params=ids)
+
+def browse(sort='name',cursor=None,limit=DEFAULT_LIMIT,platform=None,licenses=()):
+    """Get a page of up to limit packages in an order, after the position of
+    a cursor, as a list of (name, version, title, description, updated)
+    tuples, and the cursor of the next page, or None if this is the last.
+    The order of a cursor takes the place of sort. platform is a dictionary
+    of the os, cpu and engine names given to platforms.compatible(), and
+    licenses a list of license abbreviations.
+    """
+    if cursor: sort,key = decode_cursor(cursor)
+    else: key = None
+    if sort not in SORTS: raise CursorError("Invalid sort: %r" %sort)
+
+    packages = Package.objects.all()
+    if platform: packages = compatible(packages,**platform)
+    if licenses: packages = licensed(packages,licenses)
+    if sort == 'name':
+        packages = packages.order_by('name')
+        if key: packages = packages.filter(name__gt=key[0])
+    else:
+        packages = packages.order_by('-updated','-id')
+        # The bound on updated alone starts the index range; the exclude
+        # skips the rows of the same time already served.
+        if key: packages = packages.filter(updated__lte=key[0]).exclude(updated=key[0],id__gte=key[1])
+
+    rows = list(packages.values_list('id','name','version','title','description','updated')[:limit + 1])
+    following = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        if sort == 'name': following = encode_cursor(sort,(last[1],))
+        else: following = encode_cursor(sort,(last[5],last[0]))
+    return [row[1:] for row in rows[:limit]],following
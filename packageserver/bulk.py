@@ -0,0 +1,109 @@
+"""
+Bulk database operations.
+
+Django has no bulk insert, so creating many rows through the ORM costs a
+statement (and with autocommit, a transaction) per row. These helpers build
+the statements from the model metadata and send all the rows with a single
+executemany(). They bypass save() and the model signals, so callers are
+responsible for anything those would have done.
+"""
+
+# Imports #
+
+from django.db import connection, transaction
+from django.db.models import AutoField
+
+# Functions #
+
+def bulk_insert(model,objects):
+    """Insert model instances with a single executemany(). The ids of the
+    new rows are not set on the instances.
+    """
+    if not objects: return
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.local_fields if not isinstance(f,AutoField)]
+    sql = "INSERT INTO %s (%s) VALUES (%s)" %(
+        qn(model._meta.db_table),
+        ",".join([qn(f.column) for f in fields]),
+        ",".join(["%s"] * len(fields)),
+    )
+    rows = [[f.get_db_prep_save(f.pre_save(obj,True),connection=connection) for f in fields] for obj in objects]
+    connection.cursor().executemany(sql,rows)
+    transaction.commit_unless_managed()
+
+def bulk_relate(model,name,pairs):
+    """Insert (owner id, related id) rows into the intermediary table of the
+    many to many field name of model with a single executemany().
+    """
+    pairs = list(set(pairs))
+    if not pairs: return
+    qn = connection.ops.quote_name
+    field = model._meta.get_field(name)
+    sql = "INSERT INTO %s (%s,%s) VALUES (%%s,%%s)" %(
+        qn(field.m2m_db_table()),
+        qn(field.m2m_column_name()),
+        qn(field.m2m_reverse_name()),
+    )
+    connection.cursor().executemany(sql,pairs)
+    transaction.commit_unless_managed()
+
+def bulk_update(model,fields,rows):
+    """Update the given fields of many rows with a single executemany().
+    Each row is a sequence of the new field values followed by the primary
+    key of the row.
+    """
+    if not rows: return
+    qn = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in fields]
+    sql = "UPDATE %s SET %s WHERE %s = %%s" %(
+        qn(model._meta.db_table),
+        ",".join(["%s = %%s" %qn(f.column) for f in fields]),
+        qn(model._meta.pk.column),
+    )
+    rows = [[f.get_db_prep_save(value,connection=connection) for f,value in zip(fields,row[:-1])] + [row[-1]] for row in rows]
+    connection.cursor().executemany(sql,rows)
+    transaction.commit_unless_managed()
+
+def bulk_delete(model,fields,rows):
+    """Delete the rows matching each of the given sequences of field values
+    with a single executemany(). Related rows are not collected, so this 
+    must only be used for models that nothing refers to.
+    """
+    if not rows: return
+    qn = connection.ops.quote_name
+    sql = "DELETE FROM %s WHERE %s" %(
+        qn(model._meta.db_table),
+        " AND ".join(["%s = %%s" %qn(model._meta.get_field(name).column) for name in fields]),
+    )
+    connection.cursor().executemany(sql,[list(row) for row in rows])
+    transaction.commit_unless_managed()
+
+def bulk_increment(model,keys,fields,rows):
+    """Add amounts to the counter fields of the rows matching the given key 
+    fields, creating the rows that do not exist yet, with one executemany() 
+    to create and one to add. Each row is a sequence of the key values 
+    followed by the amounts to add to each field. The database adds to the 
+    stored counts, so writers in other processes never overwrite each 
+    other's counts. Key fields must be unique together.
+    """
+    if not rows: return
+    qn = connection.ops.quote_name
+    engine = connection.settings_dict['ENGINE']
+    table = qn(model._meta.db_table)
+    key_fields = [model._meta.get_field(name) for name in keys]
+    rows = [[f.get_db_prep_save(value,connection=connection) for f,value in zip(key_fields,row)] + list(row[len(key_fields):]) for row in rows]
+    keys = [qn(f.column) for f in key_fields]
+    fields = [qn(model._meta.get_field(name).column) for name in fields]
+    columns = "%s (%s) VALUES (%s)" %(table,",".join(keys + fields),",".join(["%s"] * len(keys) + ["0"] * len(fields)))
+    if engine.endswith('sqlite3'): insert = "INSERT OR IGNORE INTO %s" %columns
+    elif engine.endswith('mysql'): insert = "INSERT IGNORE INTO %s" %columns
+    else: insert = "INSERT INTO %s ON CONFLICT DO NOTHING" %columns
+    update = "UPDATE %s SET %s WHERE %s" %(
+        table,
+        ",".join(["%s = %s + %%s" %(column,column) for column in fields]),
+        " AND ".join(["%s = %%s" %column for column in keys]),
+    )
+    cursor = connection.cursor()
+    cursor.executemany(insert,[row[:len(keys)] for row in rows])
+    cursor.executemany(update,[row[len(keys):] + row[:len(keys)] for row in rows])
+    transaction.commit_unless_managed()
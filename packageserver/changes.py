@@ -0,0 +1,63 @@
+"""
+The changes feed.
+
+Mirrors used to download the whole registry on every sync. Instead, every time
+the document of a package version is stored or a version is deleted, a Change
+is recorded with the next sequence number, replacing any earlier change to the
+same version. A mirror remembers the last sequence number it has seen and asks
+only for what came after it, so a sync costs work in proportion to what has
+changed rather than to the size of the registry.
+"""
+
+# Imports #
+
+from datetime import datetime
+
+from django.db.models import signals
+
+from models import *
+from bulk import bulk_delete, bulk_insert
+from documents import documents_refreshed
+
+# Constants #
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Functions #
+
+def record(versions,deleted=False):
+    """Record changes to the given (package name, version) pairs."""
+    versions = list(set(versions))
+    created = datetime.now()
+    bulk_delete(Change,('package_name','version'),versions)
+    bulk_insert(Change,[Change(package_name=name,version=version,deleted=deleted,created=created) for name,version in versions])
+
+def changes_since(seq,limit=DEFAULT_LIMIT):
+    """Get up to limit changes made after the sequence number seq, oldest 
+    first, as a list of (seq, package name, version, deleted) tuples, and 
+    whether there are more changes after them.
+    """
+    limit = max(1,min(limit,MAX_LIMIT))
+    rows = list(Change.objects.filter(id__gt=seq).order_by('id').values_list('id','package_name','version','deleted')[:limit + 1])
+    return rows[:limit],len(rows) > limit
+
+# Handlers #
+
+def versions_refreshed(sender,versions,**kwargs):
+    """Record the versions whose documents were stored."""
+    record([(name,version) for pk,name,version in versions])
+
+def version_deleting(sender,instance,**kwargs):
+    """Remember the package name, which may be gone after the delete."""
+    instance._package_name = instance.package.name
+
+def version_deleted(sender,instance,**kwargs):
+    """Record a deleted version, including those of a deleted package."""
+    record([(instance._package_name,instance.number)],deleted=True)
+
+# Connections #
+
+documents_refreshed.connect(versions_refreshed,dispatch_uid='packageserver.changes.refreshed')
+signals.pre_delete.connect(version_deleting,sender=Package_Version,dispatch_uid='packageserver.changes.deleting')
+signals.post_delete.connect(version_deleted,sender=Package_Version,dispatch_uid='packageserver.changes.deleted')
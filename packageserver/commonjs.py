@@ -0,0 +1,150 @@
+"""
+Bulk conversion of packages to CommonJS package.json documents.
+
+Package.to_commonjs() is convenient for a single package, but it walks each
+relation one package at a time. The functions here load the same data for any
+number of packages using a fixed number of queries: one for the packages
+themselves and one per relation, regardless of how many packages are passed
+in. The documents are written by the compiled encoder of schema.PACKAGE.
+
+See http://wiki.commonjs.org/wiki/Packages/1.1
+"""
+
+# Imports #
+
+from django.utils.datastructures import SortedDict
+
+from models import Dependency, Package, Package_Version, System_Requirement
+from instrumentation import phase
+from schema import PACKAGE
+
+# Functions #
+
+def split_keywords(keywords):
+    """Split the free-form keywords text of a package into a list. Keywords
+    may be separated by commas or whitespace and may be quoted.
+    """
+    if not keywords: return []
+    words = []
+    for word in keywords.replace(',',' ').split():
+        word = word.strip('"\'')
+        if word and word not in words: words.append(word)
+    return words
+
+def _contact(first_name,last_name,email,website):
+    """Build a CommonJS maintainer or contributor hash."""
+    person = {'name': ("%s %s" %(first_name,last_name)).strip()}
+    if email: person['email'] = email
+    if website: person['web'] = website
+    return person
+
+def _related(ids,model,name,fields):
+    """Load the many to many relation ``name`` of model for all of the given 
+    ids in one query, returning a dictionary of id to a list of value tuples.
+    The query is made against the intermediary table, so ids without related 
+    rows are simply absent.
+    """
+    field = model._meta.get_field(name)
+    source = field.m2m_field_name()
+    target = field.m2m_reverse_field_name()
+    rows = field.rel.through.objects.filter(**{'%s__in' %source: ids})
+    rows = rows.values_list(source,*['%s__%s' %(target,f) for f in fields])
+    related = {}
+    for row in rows:
+        related.setdefault(row[0],[]).append(row[1:])
+    return related
+
+@phase('serialize')
+def bulk_to_commonjs_data(packages):
+    """Convert many packages to CommonJS data structures at once.
+
+    ``packages`` may be a queryset or any iterable of Package instances.
+    Returns a SortedDict of package id to package data, in the order the
+    packages were given. The data are plain dictionaries; schema.PACKAGE 
+    gives the order of their keys.
+    """
+    packages = list(packages)
+    ids = [p.pk for p in packages]
+    if not ids: return SortedDict()
+
+    maintainers = _related(ids,Package,'maintainers',('first_name','last_name','email','website'))
+    contributors = _related(ids,Package,'contributors',('first_name','last_name','email','website'))
+    licenses = _related(ids,Package,'licenses',('abbreviation','url'))
+    repositories = _related(ids,Package,'repositories',('type','url','path'))
+    dependencies = {}
+    for pk,name,version_range in Dependency.objects.filter(from_package__in=ids).values_list('from_package','to_package__name','version_range'):
+        dependencies.setdefault(pk,[]).append((name,version_range))
+    implements = _related(ids,Package,'implements',('name',))
+    scripts = _related(ids,Package,'scripts',('name','path'))
+    directories = _related(ids,Package,'directories',('name','path'))
+
+    requirement_ids = set([p.requirements_id for p in packages if p.requirements_id])
+    systems = _related(requirement_ids,System_Requirement,'os',('name',))
+    cpu = _related(requirement_ids,System_Requirement,'cpu',('name',))
+    engines = _related(requirement_ids,System_Requirement,'engines',('name',))
+
+    # The checksums of the archives of the current versions.
+    current = set([(p.pk,p.version) for p in packages])
+    checksums = {}
+    rows = Package_Version.objects.filter(package__in=ids,archive__isnull=False)
+    for pk,number,md5,sha256 in rows.values_list('package','number','archive__md5','archive__sha256'):
+        if (pk,number) in current: checksums[pk] = {'md5': md5,'sha256': sha256}
+
+    documents = SortedDict()
+    for package in packages:
+        pk = package.pk
+        data = {'name': package.name,'version': package.version,'description': package.description}
+        keywords = split_keywords(package.keywords)
+        if keywords: data['keywords'] = keywords
+
+        data['maintainers'] = [_contact(*row) for row in maintainers.get(pk,[])]
+        data['contributors'] = [_contact(*row) for row in contributors.get(pk,[])]
+
+        if package.bug_email or package.bug_url:
+            bugs = {}
+            if package.bug_email: bugs['mail'] = package.bug_email
+            if package.bug_url: bugs['web'] = package.bug_url
+            data['bugs'] = bugs
+
+        data['licenses'] = [{'type': row[0],'url': row[1]} for row in licenses.get(pk,[])]
+
+        data['repositories'] = []
+        for row in repositories.get(pk,[]):
+            repo = {'type': row[0],'url': row[1]}
+            if row[2]: repo['path'] = row[2]
+            data['repositories'].append(repo)
+
+        data['dependencies'] = SortedDict([(row[0],row[1]) for row in dependencies.get(pk,[])])
+
+        if pk in implements: data['implements'] = [row[0] for row in implements[pk]]
+
+        requirement = package.requirements_id
+        if requirement in systems: data['os'] = [row[0] for row in systems[requirement]]
+        if requirement in cpu: data['cpu'] = [row[0] for row in cpu[requirement]]
+        if requirement in engines: data['engine'] = [row[0] for row in engines[requirement]]
+
+        if pk in scripts: data['scripts'] = SortedDict([(row[0],row[1]) for row in scripts[pk]])
+
+        dirs = SortedDict([(row[0],row[1]) for row in directories.get(pk,[])])
+        if package.directories_lib: dirs['lib'] = package.directories_lib
+        if dirs: data['directories'] = dirs
+
+        if package.main: data['main'] = package.main
+        if package.website: data['homepage'] = package.website
+        if package.is_builtin: data['builtin'] = True
+        if pk in checksums: data['checksums'] = checksums[pk]
+
+        documents[pk] = data
+
+    return documents
+
+@phase('serialize')
+def bulk_to_commonjs(packages,pretty=False):
+    """Convert many packages to package.json documents at once. Returns a
+    SortedDict of package id to JSON text, compact or indented. See 
+    bulk_to_commonjs_data().
+    """
+    documents = SortedDict()
+    for pk,data in bulk_to_commonjs_data(packages).items():
+        documents[pk] = PACKAGE.encode(data,pretty)
+    return documents
@@ -0,0 +1,167 @@
+"""
+The maintainer directory.
+
+Contacts are linked to packages through the maintainers and contributors
+intermediary tables, whose indexes lead with the package. To answer "what
+does this person own" from an index, sql/package.sql indexes both tables by
+(contact_id, package_id), and a person's packages are read a page at a time
+in the order of that index, as for dependents.py.
+
+How many packages each contact maintains and contributes to is stored on the
+contact as maintained_count and contributed_count. When either relation
+changes, the counts of the contacts involved are recomputed by the database
+from the intermediary tables, one UPDATE per relation, rather than adjusted,
+so they are right however the changes interleave.
+
+A contact is found by its normalized email address (see models.Contact),
+which is unique. merge_duplicates() folds together the contacts of a
+database from before that was so.
+"""
+
+# Imports #
+
+from django.db import connection, transaction
+from django.db.models import signals
+
+from models import Contact, Package, normalize_email
+from documents import refresh_documents, schedule
+from resolver import MAX_PARAMETERS
+
+# Constants #
+
+"""
+The relations of Package to Contact, each with the count kept on Contact.
+"""
+RELATIONS = (
+    ('maintainers','maintained_count'),
+    ('contributors','contributed_count'),
+)
+
+# Functions #
+
+def update_counts(ids):
+    """Recompute the package counts of the given contacts."""
+    ids = list(set(ids or []))
+    if not ids: return
+    qn = connection.ops.quote_name
+    table = qn(Contact._meta.db_table)
+    cursor = connection.cursor()
+    for relation,count in RELATIONS:
+        field = Package._meta.get_field(relation)
+        for start in range(0,len(ids),MAX_PARAMETERS):
+            chunk = ids[start:start + MAX_PARAMETERS]
+            cursor.execute("UPDATE %s SET %s = (SELECT COUNT(*) FROM %s WHERE %s = %s.%s) WHERE %s IN (%s)" %(
+                table,
+                qn(Contact._meta.get_field(count).column),
+                qn(field.m2m_db_table()),
+                qn(field.m2m_reverse_name()),
+                table,
+                qn(Contact._meta.pk.column),
+                qn(Contact._meta.pk.column),
+                ",".join(["%s"] * len(chunk)),
+            ),chunk)
+    transaction.commit_unless_managed()
+
+def get_contact(email):
+    """Get the contact with an email address, in any case, or None."""
+    key = normalize_email(email)
+    if not key: return None
+    rows = Contact.objects.filter(email_key=key)[:1]
+    return rows and rows[0] or None
+
+def contacts_page(after=None,limit=100):
+    """Get a page of up to limit contacts with an email address, in order
+    of their normalized address, after the address after. Returns the
+    contacts and whether more follow.
+    """
+    contacts = Contact.objects.filter(email_key__isnull=False).order_by('email_key')
+    if after: contacts = contacts.filter(email_key__gt=normalize_email(after))
+    contacts = list(contacts[:limit + 1])
+    return contacts[:limit],len(contacts) > limit
+
+def packages_page(contact,relation='maintainers',after=None,limit=100):
+    """Get a page of up to limit (id, name, version) tuples of the packages
+    a contact maintains or contributes to, as relation says, in order of
+    id, after the id after. Returns the rows and whether more follow.
+    """
+    through = Package._meta.get_field(relation).rel.through
+    rows = through.objects.filter(contact=contact)
+    if after: rows = rows.filter(package__gt=after)
+    rows = list(rows.order_by('package').values_list('package','package__name','package__version')[:limit + 1])
+    return rows[:limit],len(rows) > limit
+
+def merge_duplicates():
+    """Fold contacts with the same normalized email address into the oldest
+    of them, moving their packages over, and store the normalized address of
+    every contact. The documents of the packages moved are rendered again.
+    Returns the number of contacts removed.
+    """
+    groups = {}
+    for pk,email in Contact.objects.filter(email__isnull=False).order_by('pk').values_list('pk','email'):
+        key = normalize_email(email)
+        if key: groups.setdefault(key,[]).append(pk)
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    removed = []
+    packages = set()
+    for key,ids in groups.items():
+        kept,duplicates = ids[0],ids[1:]
+        for relation,count in RELATIONS:
+            field = Package._meta.get_field(relation)
+            through = field.rel.through
+            owned = set(through.objects.filter(contact=kept).values_list('package',flat=True))
+            moved = set(through.objects.filter(contact__in=duplicates).values_list('package',flat=True)) - owned
+            through.objects.filter(contact__in=duplicates).delete()
+            cursor.executemany("INSERT INTO %s (%s,%s) VALUES (%%s,%%s)" %(
+                qn(field.m2m_db_table()),
+                qn(field.m2m_column_name()),
+                qn(field.m2m_reverse_name()),
+            ),[(package,kept) for package in moved])
+            packages.update(moved)
+        removed.extend(duplicates)
+    for start in range(0,len(removed),MAX_PARAMETERS):
+        Contact.objects.filter(pk__in=removed[start:start + MAX_PARAMETERS]).delete()
+    cursor.executemany("UPDATE %s SET %s = %%s WHERE %s = %%s" %(
+        qn(Contact._meta.db_table),
+        qn(Contact._meta.get_field('email_key').column),
+        qn(Contact._meta.pk.column),
+    ),[(key,ids[0]) for key,ids in groups.items()])
+    transaction.commit_unless_managed()
+    update_counts([ids[0] for ids in groups.values()])
+    packages = list(packages)
+    for start in range(0,len(packages),MAX_PARAMETERS):
+        refresh_documents(packages[start:start + MAX_PARAMETERS])
+    return len(removed)
+
+# Handlers #
+
+def relation_changed(sender,instance,action,reverse,model,pk_set,**kwargs):
+    """Count the packages of the contacts added to or removed from a
+    relation, from either side. From the contact side the contact is the
+    instance.
+    """
+    if reverse:
+        if action in ('post_add','post_remove','post_clear'): schedule(update_counts,[instance.pk])
+    elif action == 'pre_clear':
+        instance._contact_ids = list(sender.objects.filter(package=instance).values_list('contact',flat=True))
+    elif action == 'post_clear':
+        schedule(update_counts,getattr(instance,'_contact_ids',()))
+    elif action in ('post_add','post_remove'):
+        schedule(update_counts,pk_set)
+
+def package_deleting(sender,instance,**kwargs):
+    """Remember the contacts of a package about to be deleted."""
+    ids = set()
+    for relation,count in RELATIONS:
+        ids.update(getattr(instance,relation).values_list('pk',flat=True))
+    instance._contact_ids = ids
+
+def package_deleted(sender,instance,**kwargs):
+    schedule(update_counts,getattr(instance,'_contact_ids',()))
+
+# Connections #
+
+for relation,count in RELATIONS:
+    signals.m2m_changed.connect(relation_changed,sender=getattr(Package,relation).through,dispatch_uid='packageserver.contacts.%s' %relation)
+signals.pre_delete.connect(package_deleting,sender=Package,dispatch_uid='packageserver.contacts.deleting')
+signals.post_delete.connect(package_deleted,sender=Package,dispatch_uid='packageserver.contacts.deleted')
@@ -0,0 +1,91 @@
+"""
+Database connection handling.
+
+With a single SQLite file, readers and the writer contend for the same lock.
+Besides sending reads to replicas (see routers.py):
+
+1. SQLite connections run in WAL mode, so that readers never block the writer
+or each other, with the pragmas in SQLITE_PRAGMAS. Replica connections are
+read only.
+
+2. With PERSISTENT_DATABASE_CONNECTIONS, connections are kept open across
+requests rather than reopened (and their pragmas reapplied) on every request.
+A connection to an SQLite file that has been replaced since it was opened, as
+by the sync_replicas command, is closed when the next request starts so that
+the request sees the new file.
+"""
+
+# Imports #
+
+import os
+
+from django.conf import settings
+from django.core import signals
+from django.db import close_connection, connections, transaction
+from django.db.backends.signals import connection_created
+
+# Constants #
+
+"""
+Pragmas run on every new SQLite connection, in order. Override them with the
+SQLITE_PRAGMAS setting.
+"""
+SQLITE_PRAGMAS = (
+    # Readers see a snapshot and do not block the writer.
+    ('journal_mode','WAL'),
+    # In WAL mode a commit is durable once the WAL is synced at checkpoint.
+    ('synchronous','NORMAL'),
+    # A negative size is in KiB: 64 MB of page cache per connection.
+    ('cache_size','-65536'),
+    ('temp_store','MEMORY'),
+    ('mmap_size','268435456'),
+)
+
+# Handlers #
+
+def sqlite_file_id(name):
+    """Identify an SQLite database file, or None if it is in memory or does
+    not exist yet.
+    """
+    if name == ':memory:' or not os.path.exists(name): return None
+    stat = os.stat(name)
+    return stat.st_dev,stat.st_ino
+
+def configure_connection(sender,connection,**kwargs):
+    """Apply the SQLite pragmas to a new connection and open replicas read
+    only.
+    """
+    if not connection.settings_dict['ENGINE'].endswith('sqlite3'): return
+    cursor = connection.connection.cursor()
+    for name,value in getattr(settings,'SQLITE_PRAGMAS',SQLITE_PRAGMAS):
+        cursor.execute("PRAGMA %s = %s" %(name,value))
+    if connection.alias in getattr(settings,'REPLICA_DATABASES',()):
+        cursor.execute("PRAGMA query_only = 1")
+    cursor.close()
+    connection._file_id = sqlite_file_id(connection.settings_dict['NAME'])
+
+def release_connections(**kwargs):
+    """End the work of a request on every connection, keeping them open. 
+    Connections under transaction management, as in a test case, are left 
+    as they are.
+    """
+    for connection in connections.all():
+        if connection.connection is None or transaction.is_managed(using=connection.alias): continue
+        connection._rollback()
+
+def check_connections(**kwargs):
+    """Close the open connections to SQLite files that have been replaced 
+    since they were opened, before a request uses them.
+    """
+    for connection in connections.all():
+        if connection.connection is None or not connection.settings_dict['ENGINE'].endswith('sqlite3'): continue
+        if getattr(connection,'_file_id',None) != sqlite_file_id(connection.settings_dict['NAME']):
+            connection.close()
+
+# Connections #
+
+connection_created.connect(configure_connection,dispatch_uid='packageserver.databases.created')
+if getattr(settings,'PERSISTENT_DATABASE_CONNECTIONS',False):
+    signals.request_finished.disconnect(close_connection)
+    signals.request_finished.connect(release_connections,dispatch_uid='packageserver.databases.finished')
+    signals.request_started.connect(check_connections,dispatch_uid='packageserver.databases.started')
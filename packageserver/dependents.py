@@ -0,0 +1,133 @@
+"""
+The reverse dependency index.
+
+The packages that depend on a package directly are read from the dependency
+table from the side of the package depended on, a page at a time in the
+order of the index created in sql/package.sql. How many packages depend on a package
+directly, and through any chain of dependencies, are stored on the package
+as dependent_count and transitive_dependent_count.
+
+Adding or removing the edge A -> B can only change the dependents of B and
+of the packages B depends on, directly or not, so when the relation changes
+only those packages are counted again. Each is counted by walking up its
+dependents breadth first. The dependents of every package reached are loaded
+once per update, a level at a time, so the packages updated together share
+the work, and the walk is in memory after the first.
+"""
+
+# Imports #
+
+from django.db.models import signals
+
+from models import Dependency, Package
+from bulk import bulk_update
+from documents import being_deleted, schedule
+from resolver import MAX_PARAMETERS, Resolver
+
+# Classes #
+
+class DependentWalker(object):
+    """Find the transitive dependents of packages, the mirror of Resolver.
+
+        walker = DependentWalker()
+        ids = walker.dependents(package.pk)
+    """
+    def __init__(self):
+        # Package id to a list of the ids of its direct dependents, for the
+        # packages loaded so far.
+        self.edges = {}
+
+    def load(self,ids):
+        """Load the direct dependents of the given packages, skipping any
+        that are already loaded.
+        """
+        ids = [pk for pk in ids if pk not in self.edges]
+        for pk in ids: self.edges[pk] = []
+        for start in range(0,len(ids),MAX_PARAMETERS):
+            rows = Dependency.objects.filter(to_package__in=ids[start:start+MAX_PARAMETERS]).values_list('to_package','from_package')
+            for target,source in rows:
+                self.edges[target].append(source)
+
+    def dependents(self,root):
+        """Get the set of ids of the packages that depend on root, directly
+        or not. A package in a cycle is not its own dependent.
+        """
+        seen = set([root])
+        frontier = [root]
+        while frontier:
+            self.load(frontier)
+            level = []
+            for pk in frontier:
+                for source in self.edges[pk]:
+                    if source not in seen:
+                        seen.add(source)
+                        level.append(source)
+            frontier = level
+        seen.discard(root)
+        return seen
+
+# Functions #
+
+def affected(ids):
+    """Get the ids of the packages whose dependents change when an edge to
+    any of the given packages is added or removed: the packages and their
+    transitive dependencies.
+    """
+    resolver = Resolver()
+    ids = set(ids)
+    for pk in list(ids):
+        for level in resolver.walk(pk): ids.update(level)
+    return ids
+
+def update_counts(ids):
+    """Count the dependents of the packages whose dependents may have changed
+    because edges to the given packages were added or removed.
+    """
+    ids = list(ids or [])
+    if not ids: return
+    walker = DependentWalker()
+    rows = []
+    for pk in affected(ids):
+        transitive = walker.dependents(pk)
+        rows.append((len(walker.edges[pk]),len(transitive),pk))
+    bulk_update(Package,('dependent_count','transitive_dependent_count'),rows)
+
+def dependents_page(package,after=None,limit=100):
+    """Get a page of up to limit (id, name, version) tuples of the packages
+    that depend on package directly, in order of id, after the id after.
+    Returns the rows and whether more follow.
+
+    Pages are read in order of the index on the dependency table rather than
+    by name, so a page costs the same however many dependents there are.
+    """
+    rows = Dependency.objects.filter(to_package=package)
+    if after: rows = rows.filter(from_package__gt=after)
+    rows = list(rows.order_by('from_package').values_list('from_package','from_package__name','from_package__version')[:limit + 1])
+    return rows[:limit],len(rows) > limit
+
+# Handlers #
+
+def dependency_changed(sender,instance,**kwargs):
+    """Count the dependents again when a dependency is saved or deleted.
+    Within a deferred() block the packages are counted together when the
+    block exits. The edges of a package being deleted are left to
+    package_deleted.
+    """
+    if being_deleted(instance.from_package_id) or being_deleted(instance.to_package_id): return
+    schedule(update_counts,[instance.to_package_id])
+
+def package_deleting(sender,instance,**kwargs):
+    """Remember the dependencies of a package about to be deleted, whose
+    dependents lose it and the packages that depend on it.
+    """
+    instance._dependency_ids = list(instance.dependencies.values_list('pk',flat=True))
+
+def package_deleted(sender,instance,**kwargs):
+    update_counts(getattr(instance,'_dependency_ids',()))
+
+# Connections #
+
+signals.post_save.connect(dependency_changed,sender=Dependency,dispatch_uid='packageserver.dependents.changed')
+signals.post_delete.connect(dependency_changed,sender=Dependency,dispatch_uid='packageserver.dependents.changed')
+signals.pre_delete.connect(package_deleting,sender=Package,dispatch_uid='packageserver.dependents.deleting')
+signals.post_delete.connect(package_deleted,sender=Package,dispatch_uid='packageserver.dependents.deleted')
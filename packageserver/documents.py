@@ -0,0 +1,250 @@
+"""
+Materialized package.json documents.
+
+Almost all registry traffic reads package descriptors, which change rarely. 
+Rather than rebuilding a descriptor on every request, the Package_Version of 
+the current version of each package stores its rendered document along with a 
+gzip compressed copy. The signal handlers below regenerate the stored 
+documents whenever a package, one of its relations, or a row it refers to is 
+saved, changed or deleted. Documents of earlier versions are left as they 
+were when those versions were current.
+"""
+
+# Imports #
+
+import base64
+import gzip
+import threading
+from cStringIO import StringIO
+from datetime import datetime
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from django.db.models import signals
+from django.dispatch import Signal
+from django.utils.datastructures import SortedDict
+
+from models import *
+from bulk import bulk_insert, bulk_update
+from commonjs import bulk_to_commonjs
+from instrumentation import phase
+
+# Constants #
+
+"""
+Lookups from Package to each model whose rows are embedded in a package 
+document.
+"""
+RELATED_LOOKUPS = {
+    Contact: ('maintainers','contributors'),
+    Cpu: ('requirements__cpu',),
+    Directory: ('directories',),
+    JavaScript_Engine: ('requirements__engines',),
+    License: ('licenses',),
+    Operating_System: ('requirements__os',),
+    Repo: ('repositories',),
+    Script: ('scripts',),
+    Specification: ('implements',),
+    System_Requirement: ('requirements',),
+}
+
+# Signals #
+
+"""
+Sent after documents are stored, with a list of (package id, package name, 
+version) tuples.
+"""
+documents_refreshed = Signal(providing_args=["versions"])
+
+# Deferral #
+
+_local = threading.local()
+
+class deferred(object):
+    """Hold the document refreshes, and other work scheduled with 
+    schedule(), triggered inside a with block and make them all at once, in 
+    bulk, when the block exits. Use this when creating or changing many 
+    packages so that each document is rendered only once.
+
+        with deferred():
+            ...
+    """
+    def __enter__(self):
+        if not hasattr(_local,'pending'): _local.pending = []
+        _local.pending.append(SortedDict())
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        pending = _local.pending.pop()
+        if exc_type is None:
+            for function,ids in pending.items(): schedule(function,ids)
+
+def schedule(function,ids):
+    """Call function with the given package ids now, or with all of the ids 
+    given to it when the innermost deferred() block exits.
+    """
+    pending = getattr(_local,'pending',None)
+    if pending: pending[-1].setdefault(function,set()).update(ids)
+    else: function(ids)
+
+def schedule_refresh(ids):
+    """Refresh the documents of the given packages now, or when the 
+    innermost deferred() block exits.
+    """
+    schedule(refresh_documents,ids)
+
+def being_deleted(pk):
+    """Indicates the package is being deleted in this thread. The rows that 
+    refer to it are deleted first, and the handlers of the package take care 
+    of them.
+    """
+    return pk in getattr(_local,'deleting',())
+
+# Functions #
+
+@phase('compress')
+def compress(document):
+    """Gzip a document. Documents are compressed once when they are stored 
+    rather than on every response, so the best compression is used.
+    """
+    buffer = StringIO()
+    zfile = gzip.GzipFile(mode='wb',compresslevel=9,fileobj=buffer)
+    zfile.write(document)
+    zfile.close()
+    return buffer.getvalue()
+
+def stored_fields(document,modified):
+    """Get the (document, document_gzip, document_etag, document_modified) 
+    values to store for a rendered document.
+    """
+    return document,base64.b64encode(compress(document)),md5(document).hexdigest(),modified
+
+def package_ids(model,pks):
+    """Get the ids of the packages whose documents embed the given rows of 
+    model. For Package itself this is simply the given ids.
+    """
+    pks = list(pks or [])
+    if not pks: return set()
+    if model is Package: return set(pks)
+    ids = set()
+    for lookup in RELATED_LOOKUPS.get(model,()):
+        ids.update(Package.objects.filter(**{'%s__in' %lookup: pks}).values_list('pk',flat=True))
+    return ids
+
+def dependent_ids(pks):
+    """Get the ids of packages that list any of the given packages as a 
+    dependency, and so embed their name and the range of their versions 
+    accepted.
+    """
+    pks = list(pks or [])
+    if not pks: return set()
+    return set(Package.objects.filter(dependencies__in=pks).values_list('pk',flat=True))
+
+def affected_ids(model,pks):
+    """Get the ids of the packages whose documents embed the given rows of 
+    model, including the packages that depend on them when model is Package.
+    """
+    ids = package_ids(model,pks)
+    if model is Package: ids.update(dependent_ids(pks))
+    return ids
+
+def refresh_documents(ids):
+    """Render and store the documents of the current versions of the given 
+    packages, creating the version rows as needed. Rows are matched on the 
+    parsed version, as they are unique, so a version respelled (as "1.0" or 
+    "v1.0.0" for "1.0.0") takes the new spelling. The packages are marked 
+    updated, since whatever changed their documents changed them. Returns a 
+    dictionary of package id to the new document.
+    """
+    ids = list(ids)
+    if not ids: return {}
+    modified = datetime.now()
+    packages = list(Package.objects.filter(pk__in=ids))
+    documents = bulk_to_commonjs(packages)
+    rows = Package_Version.objects.filter(package__in=ids).values_list('package','major','minor','patch','prerelease_key','pk')
+    existing = dict([(row[:5],row[5]) for row in rows])
+
+    updates = []
+    inserts = []
+    for package in packages:
+        document = documents[package.pk]
+        fields = stored_fields(document,modified)
+        version = Package_Version(package=package,number=package.version)
+        version.parse_number()
+        pk = existing.get((package.pk,version.major,version.minor,version.patch,version.prerelease_key))
+        if pk:
+            updates.append((package.version,) + fields + (pk,))
+        else:
+            version.document,version.document_gzip,version.document_etag,version.document_modified = fields
+            inserts.append(version)
+    bulk_update(Package_Version,('number','document','document_gzip','document_etag','document_modified'),updates)
+    bulk_insert(Package_Version,inserts)
+    # An update() rather than save() sends no signals, so this does not
+    # trigger another refresh.
+    Package.objects.filter(pk__in=ids).update(updated=modified)
+
+    documents_refreshed.send(sender=Package_Version,versions=[(p.pk,p.name,p.version) for p in packages])
+    return documents
+
+# Handlers #
+
+def row_saved(sender,instance,**kwargs):
+    """Refresh the documents that embed a saved row."""
+    schedule_refresh(affected_ids(sender,[instance.pk]))
+
+def row_deleting(sender,instance,**kwargs):
+    """Remember the documents that embed a row about to be deleted. The 
+    relation rows are gone by the time post_delete is sent.
+    """
+    instance._document_ids = affected_ids(sender,[instance.pk])
+    if sender is Package:
+        instance._document_ids.discard(instance.pk)
+        if not hasattr(_local,'deleting'): _local.deleting = set()
+        _local.deleting.add(instance.pk)
+
+def row_deleted(sender,instance,**kwargs):
+    """Refresh the documents that embedded a deleted row."""
+    if sender is Package: getattr(_local,'deleting',set()).discard(instance.pk)
+    schedule_refresh(getattr(instance,'_document_ids',()))
+
+def dependency_changed(sender,instance,**kwargs):
+    """Refresh the document of a package when one of its dependencies is 
+    added, changed or removed, unless the packages at either end are being 
+    deleted.
+    """
+    if being_deleted(instance.from_package_id) or being_deleted(instance.to_package_id): return
+    schedule_refresh([instance.from_package_id])
+
+def relation_changed(sender,instance,action,reverse,model,pk_set,**kwargs):
+    """Refresh documents when rows are added to or removed from a many to 
+    many relation of Package or System_Requirement, from either side. When 
+    changed from the reverse side it is the rows in pk_set that change.
+    """
+    if action == 'pre_clear':
+        if reverse: instance._document_ids = affected_ids(instance.__class__,[instance.pk])
+        else: instance._document_ids = package_ids(instance.__class__,[instance.pk])
+    elif action == 'post_clear':
+        schedule_refresh(getattr(instance,'_document_ids',()))
+    elif action in ('post_add','post_remove'):
+        if reverse: schedule_refresh(package_ids(model,pk_set))
+        else: schedule_refresh(package_ids(instance.__class__,[instance.pk]))
+
+# Connections #
+
+for model in [Package] + list(RELATED_LOOKUPS):
+    uid = 'packageserver.documents.%s' %model.__name__
+    signals.post_save.connect(row_saved,sender=model,dispatch_uid=uid)
+    signals.pre_delete.connect(row_deleting,sender=model,dispatch_uid=uid)
+    signals.post_delete.connect(row_deleted,sender=model,dispatch_uid=uid)
+
+signals.post_save.connect(dependency_changed,sender=Dependency,dispatch_uid='packageserver.documents.Dependency')
+signals.post_delete.connect(dependency_changed,sender=Dependency,dispatch_uid='packageserver.documents.Dependency')
+
+for model in (Package,System_Requirement):
+    for field in model._meta.many_to_many:
+        if not field.rel.through._meta.auto_created: continue
+        uid = 'packageserver.documents.%s.%s' %(model.__name__,field.name)
+        signals.m2m_changed.connect(relation_changed,sender=field.rel.through,dispatch_uid=uid)
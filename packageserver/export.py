@@ -0,0 +1,197 @@
+"""
+Static export of the registry.
+
+The registry can be published as plain files, served by the web server
+without Django, under a directory laid out like the registry URLs:
+
+    registry/<name>/package.json                  the current version
+    registry/<name>/<version>/package.json        every version
+    registry/<name>/<version>/package.json.gz     gzip copies of each
+
+The documents are the ones already stored by documents.py, so exporting is
+mostly copying. Packages are split into batches that are written across a
+pool of processes, each with its own database connection.
+
+The sequence number of the last change included is kept in a watermark file
+in the directory. Later exports ask the changes feed (see changes.py) for the
+versions stored or deleted since, and write only those packages again. Every
+file is written under a temporary name and renamed into place, so a reader
+never sees a partly written file. For nginx:
+
+    location /registry/ {
+        root /path/to/export;
+        index package.json;
+        gzip_static on;
+        default_type application/json;
+    }
+"""
+
+# Imports #
+
+import base64
+import os
+import tempfile
+from multiprocessing import Pool
+
+from django.db import connections
+from django.db.models import F, Max
+
+from models import *
+from documents import refresh_documents
+
+# Constants #
+
+WATERMARK = ".watermark"
+
+DOCUMENT = "package.json"
+
+"""
+Packages written by one task of the pool.
+"""
+BATCH_SIZE = 200
+
+# Files #
+
+def write_atomic(filename,content):
+    """Write content to a file, replacing it at once. The temporary file is
+    made in the same directory so the rename stays on one file system.
+    """
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Made by another process in the meantime.
+            if not os.path.isdir(directory): raise
+    descriptor,temporary = tempfile.mkstemp(prefix='.export-',dir=directory)
+    try:
+        f = os.fdopen(descriptor,'wb')
+        try:
+            f.write(content)
+        finally:
+            f.close()
+        os.chmod(temporary,0o644)
+        os.rename(temporary,filename)
+    except:
+        if os.path.exists(temporary): os.remove(temporary)
+        raise
+
+def remove(filename):
+    """Remove a file if it exists."""
+    if os.path.exists(filename): os.remove(filename)
+
+def document_path(directory,name,version=None):
+    """The path of the exported document of a package version, or of the
+    current version of the package when version is None.
+    """
+    if version is None: return os.path.join(directory,'registry',name,DOCUMENT)
+    return os.path.join(directory,'registry',name,version,DOCUMENT)
+
+def read_watermark(directory):
+    """The sequence number of the last change exported to directory, or None
+    if nothing has been exported there.
+    """
+    try:
+        f = open(os.path.join(directory,WATERMARK))
+    except IOError:
+        return None
+    try:
+        return int(f.read().strip())
+    finally:
+        f.close()
+
+def write_watermark(directory,seq):
+    write_atomic(os.path.join(directory,WATERMARK),"%s\n" %seq)
+
+# Export #
+
+def export_packages(args):
+    """Write the documents of a batch of packages. Runs in the processes of
+    the pool. The batch is a list of (name, versions, deleted) tuples, where
+    versions are the numbers to write, or None for every version, and deleted
+    are the numbers whose files are removed. The current version is always
+    written. Returns the number of files written.
+    """
+    directory,batch = args
+    names = [name for name,versions,deleted in batch]
+    rows = Package_Version.objects.filter(package__name__in=names).exclude(document=None)
+    rows = rows.order_by('package__name','-is_release','-major','-minor','-patch','-prerelease_key')
+    documents = {}
+    for name,number,document,document_gzip in rows.values_list('package__name','number','document','document_gzip').iterator():
+        documents.setdefault(name,[]).append((number,document,document_gzip))
+
+    written = 0
+    for name,versions,deleted in batch:
+        for number in deleted:
+            remove(document_path(directory,name,number) + '.gz')
+            remove(document_path(directory,name,number))
+        found = documents.get(name,[])
+        if not found:
+            remove(document_path(directory,name))
+            continue
+        for i,(number,document,document_gzip) in enumerate(found):
+            document = document.encode('utf-8')
+            compressed = base64.b64decode(document_gzip)
+            if versions is None or number in versions:
+                # The copy is written first, so a version never has a newer
+                # document beside an older gzip copy for long.
+                write_atomic(document_path(directory,name,number) + '.gz',compressed)
+                write_atomic(document_path(directory,name,number),document)
+                written += 2
+            if i == 0:
+                write_atomic(document_path(directory,name) + '.gz',compressed)
+                write_atomic(document_path(directory,name),document)
+                written += 2
+    return written
+
+def pending_packages(seq):
+    """Get the (name, versions, deleted) work of every package changed after
+    the sequence number seq, or of every package when seq is None.
+    """
+    if seq is None:
+        return [(name,None,()) for name in Package.objects.order_by('name').values_list('name',flat=True).iterator()]
+    work = {}
+    for id,name,version,deleted in Change.objects.filter(id__gt=seq).order_by('id').values_list('id','package_name','version','deleted').iterator():
+        versions,removed = work.setdefault(name,(set(),set()))
+        if deleted:
+            removed.add(version)
+            versions.discard(version)
+        else:
+            versions.add(version)
+            removed.discard(version)
+    return [(name,versions,removed) for name,(versions,removed) in sorted(work.items())]
+
+def export(directory,processes=None,full=False,batch_size=BATCH_SIZE):
+    """Export the registry to directory, writing only the packages changed
+    since the last export unless full is true. Returns the number of
+    packages exported and of files written.
+
+    With processes of 0 the export is made in this process.
+    """
+    # Packages whose current documents were never rendered are rendered now,
+    # which records them as changes.
+    current = Package_Version.objects.exclude(document=None).filter(number=F('package__version')).values('package')
+    refresh_documents(Package.objects.exclude(pk__in=current).values_list('pk',flat=True))
+
+    if full: previous = None
+    else: previous = read_watermark(directory)
+    # Taken before reading the work, so that changes made during the export
+    # are exported again next time rather than missed.
+    seq = Change.objects.aggregate(seq=Max('id'))['seq'] or 0
+    work = pending_packages(previous)
+    batches = [(directory,work[start:start + batch_size]) for start in range(0,len(work),batch_size)]
+
+    if processes == 0:
+        written = sum(map(export_packages,batches))
+    else:
+        # The processes open connections of their own rather than share the
+        # ones of this process.
+        for connection in connections.all(): connection.close()
+        pool = Pool(processes)
+        try:
+            written = sum(pool.map(export_packages,batches))
+        finally:
+            pool.terminate()
+
+    write_watermark(directory,seq)
+    return len(work),written
@@ -0,0 +1,367 @@
+"""
+High-throughput import of package.json descriptors.
+
+Creating packages one at a time through the ORM costs a transaction per row
+and a get-or-create round trip for every contact, license, repository and
+platform name. The Importer instead:
+
+1. Parses descriptor files in parallel across a process pool.
+
+2. Resolves Contact, License, Repo, Directory, Script, Specification, Cpu,
+Operating_System, JavaScript_Engine and System_Requirement rows through
+in-memory caches that are loaded once, creating only the rows it has not seen.
+
+3. Inserts packages and their relations with one executemany() per table per
+batch, inside one transaction per batch. The documents, search index and
+changes feed of each batch are then brought up to date in bulk, since the
+inserts bypass the signal handlers that would normally do it.
+
+Dependencies are linked once every batch is in, so a package may depend on one
+that appears later in the import.
+
+A batch the database refuses is rolled back and recorded as an error against
+each of its descriptors, and the rows it added to the caches are forgotten,
+so that the import goes on with the next batch.
+"""
+
+# Imports #
+
+import re
+from multiprocessing import Pool
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.db import DatabaseError, transaction
+
+from models import *
+from bulk import bulk_insert, bulk_relate
+from dependents import update_counts
+from documents import deferred, refresh_documents
+from schema import DESCRIPTOR
+import contacts
+import search
+
+# Constants #
+
+PERSON = re.compile(r'^\s*([^<(]*?)\s*(?:<([^>]*)>)?\s*(?:\(([^)]*)\))?\s*$')
+
+# Parsing #
+
+def parse_file(path):
+    """Load a descriptor file. Runs in the worker processes, so it must not
+    touch the database. Returns a (path, data, error) tuple.
+    """
+    try:
+        f = open(path)
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+    except (IOError,ValueError) as e:
+        return path,None,str(e)
+    if not isinstance(data,dict): return path,None,"Not a JSON object."
+    return path,data,None
+
+def parse_files(paths,processes=None,chunksize=32):
+    """Parse descriptor files across a pool of processes, yielding a (path,
+    data, error) tuple for each in the order given.
+    """
+    pool = Pool(processes)
+    try:
+        for result in pool.imap(parse_file,paths,chunksize):
+            yield result
+    finally:
+        pool.terminate()
+
+def parse_person(person):
+    """Get the (first name, last name, email, website) of a maintainer or
+    contributor given as a hash or as a "Name <email> (url)" string.
+    """
+    if isinstance(person,dict):
+        name,email,web = person.get('name',""),person.get('email'),person.get('web') or person.get('url')
+    else:
+        name,email,web = PERSON.match(unicode(person)).groups()
+    parts = (name or "").split(None,1)
+    first = parts and parts[0] or ""
+    last = len(parts) > 1 and parts[1] or ""
+    return first[:128],last[:128],email or None,web or None
+
+def as_list(value):
+    """Descriptors often give a single value where a list is expected."""
+    if value is None: return []
+    if isinstance(value,(list,tuple)): return list(value)
+    return [value]
+
+# Classes #
+
+class Lookup(object):
+    """An in-memory cache of the rows of a lookup table, keyed by a function
+    of their field values. All existing rows are loaded with one query when
+    the cache is created; rows it has not seen are created on demand.
+    """
+    def __init__(self,model,key,fields):
+        self.model = model
+        self.key = key
+        self.fields = fields
+        self.ids = {}
+        # The keys of the rows created since the last commit().
+        self.created = []
+        for row in model.objects.values('pk',*fields):
+            self.ids.setdefault(key(row),row['pk'])
+
+    def get(self,**values):
+        """Get the id of the row with the given values, creating it if need
+        be.
+        """
+        key = self.key(values)
+        if key not in self.ids:
+            self.ids[key] = self.model.objects.create(**values).pk
+            self.created.append(key)
+        return self.ids[key]
+
+    def commit(self):
+        """Keep the rows created so far."""
+        self.created = []
+
+    def rollback(self):
+        """Forget the rows created since the last commit(), which were
+        rolled back.
+        """
+        for key in self.created: del self.ids[key]
+        self.created = []
+
+def _contact_key(row):
+    """Contacts with an email address are the same person whatever name they
+    go by; the rest are matched by name.
+    """
+    email = normalize_email(row.get('email'))
+    if email: return email
+    return (row['first_name'].lower(),row['last_name'].lower())
+
+class Importer(object):
+    """Import package descriptors in batches.
+
+        importer = Importer()
+        for batch in batches:
+            importer.import_batch(batch)
+        importer.finish()
+    """
+    def __init__(self):
+        self.contacts = Lookup(Contact,_contact_key,('first_name','last_name','email','website'))
+        self.licenses = Lookup(License,lambda row: (row['abbreviation'],row['url']),('title','abbreviation','url'))
+        self.repos = Lookup(Repo,lambda row: (row['type'],row['url'],row['path'] or None),('type','url','path'))
+        self.directories = Lookup(Directory,lambda row: (row['name'],row['path']),('name','path'))
+        self.scripts = Lookup(Script,lambda row: (row['name'],row['path']),('name','path'))
+        self.specifications = Lookup(Specification,lambda row: row['name'],('title','name'))
+        self.systems = Lookup(Operating_System,lambda row: row['name'],('title','name'))
+        self.cpus = Lookup(Cpu,lambda row: row['name'],('title','name'))
+        self.engines = Lookup(JavaScript_Engine,lambda row: row['name'],('title','name'))
+        self.lookups = (self.contacts,self.licenses,self.repos,self.directories,self.scripts,self.specifications,self.systems,self.cpus,self.engines)
+        # Specifications are unique by title as well as name, and one the
+        # registry already has may be named by its title.
+        self.specification_titles = dict(Specification.objects.values_list('title','pk'))
+        self.names = set(Package.objects.values_list('name',flat=True))
+        self.titles = set(Package.objects.values_list('title',flat=True))
+        # Requirement sets to the id of a System_Requirement row with them.
+        self.requirements = {}
+        # Package name to a list of the (name, version range) tuples of its
+        # dependencies, linked by link_dependencies().
+        self.dependencies = {}
+        # The (collection, key) of each entry added to the sets and
+        # dictionaries above by the current batch.
+        self.added = []
+        self.imported = 0
+        self.errors = []
+
+    def add(self,collection,key,value=None):
+        """Add a key to one of the caches of the Importer, to be forgotten
+        if the batch is rolled back.
+        """
+        if isinstance(collection,set): collection.add(key)
+        else: collection[key] = value
+        self.added.append((collection,key))
+
+    def title(self,name,title=None):
+        """Get a title for a new package that no other package has: its own
+        title, or else its name, or else its name numbered.
+        """
+        for candidate in (title,name):
+            if candidate and candidate[:128] not in self.titles: return candidate[:128]
+        number = 2
+        while "%s (%s)" %(name,number) in self.titles: number += 1
+        return "%s (%s)" %(name,number)
+
+    def requirement(self,os,cpu,engines):
+        """Get the id of a System_Requirement row for the given sets of names.
+        Packages with the same requirements share a row.
+        """
+        key = (frozenset(os),frozenset(cpu),frozenset(engines))
+        if key not in self.requirements:
+            requirement = System_Requirement.objects.create()
+            bulk_relate(System_Requirement,'os',[(requirement.pk,self.systems.get(title=name,name=name)) for name in os])
+            bulk_relate(System_Requirement,'cpu',[(requirement.pk,self.cpus.get(title=name,name=name)) for name in cpu])
+            bulk_relate(System_Requirement,'engines',[(requirement.pk,self.engines.get(title=name,name=name)) for name in engines])
+            self.add(self.requirements,key,requirement.pk)
+        return self.requirements[key]
+
+    def specification(self,spec):
+        """Get the id of the Specification with the given name, or else with
+        the given title, creating it if need be.
+        """
+        spec = unicode(spec)
+        if spec not in self.specifications.ids and spec in self.specification_titles: return self.specification_titles[spec]
+        return self.specifications.get(title=spec,name=spec)
+
+    def build(self,data):
+        """Build an unsaved Package from a descriptor, along with a dictionary
+        of relation name to the ids of its related rows.
+        """
+        errors = DESCRIPTOR.validate(data)
+        if errors: raise ValueError(" ".join(errors))
+        name = data['name']
+        version = data['version']
+        if name in self.names: raise ValueError("Package %s already exists." %name)
+
+        bugs = data.get('bugs') or {}
+        if isinstance(bugs,basestring): bugs = {'web': bugs}
+        directories = dict(data.get('directories') or {})
+
+        package = Package(
+            name=name,
+            title=self.title(name,data.get('title')),
+            version=version,
+            description=data.get('description') or "",
+            keywords=", ".join([unicode(word) for word in as_list(data.get('keywords'))]) or None,
+            main=data.get('main'),
+            directories_lib=directories.pop('lib',None),
+            bug_url=bugs.get('web') or bugs.get('url'),
+            bug_email=bugs.get('mail') or bugs.get('email'),
+            website=data.get('homepage'),
+            is_builtin=bool(data.get('builtin')),
+            requirements_id=self.requirement(
+                [unicode(n) for n in as_list(data.get('os'))],
+                [unicode(n) for n in as_list(data.get('cpu'))],
+                [unicode(n) for n in as_list(data.get('engine') or data.get('engines'))],
+            ),
+        )
+
+        related = {'maintainers': [],'contributors': []}
+        for relation in ('maintainers','contributors'):
+            for person in as_list(data.get(relation)):
+                first,last,email,web = parse_person(person)
+                related[relation].append(self.contacts.get(first_name=first,last_name=last,email=email,website=web))
+
+        related['licenses'] = []
+        for license in as_list(data.get('licenses') or data.get('license')):
+            if not isinstance(license,dict): license = {'type': license}
+            kind = unicode(license.get('type') or "")[:64]
+            related['licenses'].append(self.licenses.get(title=kind,abbreviation=kind,url=license.get('url') or ""))
+
+        related['repositories'] = []
+        for repo in as_list(data.get('repositories') or data.get('repository')):
+            if not isinstance(repo,dict): repo = {'url': repo}
+            related['repositories'].append(self.repos.get(type=repo.get('type') or "git",url=repo.get('url') or "",path=repo.get('path') or None))
+
+        related['directories'] = [self.directories.get(name=key,path=path) for key,path in directories.items()]
+        related['scripts'] = [self.scripts.get(name=key,path=path) for key,path in (data.get('scripts') or {}).items()]
+        related['implements'] = [self.specification(spec) for spec in as_list(data.get('implements'))]
+
+        dependencies = data.get('dependencies') or {}
+        if isinstance(dependencies,dict): self.add(self.dependencies,package.name,[(key,version_range or "*") for key,version_range in dependencies.items()])
+
+        self.add(self.names,package.name)
+        self.add(self.titles,package.title)
+        return package,related
+
+    def import_batch(self,descriptors):
+        """Import a list of (path, descriptor) tuples in one transaction.
+        Returns the number of packages imported. If the database refuses the
+        batch, none of it is imported and the error is recorded against each
+        of the descriptors not already in error.
+        """
+        errors = len(self.errors)
+        try:
+            imported = self._import_batch(descriptors)
+        except DatabaseError as e:
+            self._rollback()
+            failed = set([path for path,error in self.errors[errors:]])
+            self.errors.extend([(path,"Not imported: %s" %e) for path,data in descriptors if path not in failed])
+            return 0
+        for lookup in self.lookups: lookup.commit()
+        self.added = []
+        self.imported += imported
+        return imported
+
+    def _rollback(self):
+        """Forget the cached rows of a batch that was rolled back."""
+        for lookup in self.lookups: lookup.rollback()
+        for collection,key in reversed(self.added):
+            if isinstance(collection,set): collection.discard(key)
+            else: collection.pop(key,None)
+        self.added = []
+
+    @transaction.commit_on_success
+    def _import_batch(self,descriptors):
+        with deferred():
+            ids = self._insert(descriptors)
+        refresh_documents(ids)
+        search.index_packages(ids)
+        return len(ids)
+
+    def _insert(self,descriptors):
+        """Insert the packages of a batch and their relations. Returns the
+        ids of the new packages.
+        """
+        built = []
+        for path,data in descriptors:
+            try:
+                built.append(self.build(data))
+            except (ValueError,TypeError,AttributeError) as e:
+                self.errors.append((path,str(e)))
+        if not built: return []
+
+        bulk_insert(Package,[package for package,related in built])
+        ids = dict(Package.objects.filter(name__in=[package.name for package,related in built]).values_list('name','pk'))
+
+        for relation in ('maintainers','contributors','licenses','repositories','directories','scripts','implements'):
+            bulk_relate(Package,relation,[(ids[package.name],pk) for package,related in built for pk in related[relation]])
+        # bulk_relate() sends no signals, so the package counts of the
+        # contacts are brought up to date here.
+        contacts.update_counts([pk for package,related in built for relation in ('maintainers','contributors') for pk in related[relation]])
+        return ids.values()
+
+    def link_dependencies(self):
+        """Link the imported packages to the dependencies named in their
+        descriptors. Dependencies that are not in the registry are skipped.
+        Returns the ids of the packages that were linked.
+        """
+        names = set(self.dependencies)
+        for targets in self.dependencies.values(): names.update([target for target,version_range in targets])
+        ids = {}
+        names = list(names)
+        for start in range(0,len(names),500):
+            ids.update(Package.objects.filter(name__in=names[start:start+500]).values_list('name','pk'))
+        edges = [
+            Dependency(from_package_id=ids[name],to_package_id=ids[target],version_range=version_range)
+            for name,targets in self.dependencies.items() for target,version_range in targets
+            if name in ids and target in ids and target != name
+        ]
+        bulk_insert(Dependency,edges)
+        # bulk_insert() sends no signals, so the dependent counts are brought
+        # up to date here.
+        update_counts(set([edge.to_package_id for edge in edges]))
+        linked = set([edge.from_package_id for edge in edges])
+        self.dependencies = {}
+        return linked
+
+    @transaction.commit_on_success
+    def finish(self):
+        """Link dependencies and refresh the documents of the packages that
+        now list them.
+        """
+        linked = list(self.link_dependencies())
+        for start in range(0,len(linked),500):
+            refresh_documents(linked[start:start+500])
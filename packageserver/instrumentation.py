@@ -0,0 +1,235 @@
+"""
+Per-request performance instrumentation.
+
+While a request is measured (see middleware.TimingMiddleware) the queries it
+issues and the time spent in them are counted by a thin wrapper around the
+database cursors, and functions decorated with phase() add their time to a
+named phase, such as serialize or compress. The middleware reports these in a
+Server-Timing header.
+
+The latency of every request is also added to a histogram kept per view, and
+render() writes the histograms and counters in the Prometheus text format for
+the /metrics endpoint. Recording a request is a few additions under a lock;
+all the formatting happens when the metrics are scraped. The metrics are kept
+per process, as Prometheus expects of each scraped target.
+"""
+
+# Imports #
+
+import bisect
+import threading
+import time
+
+from django.db import connections
+from django.utils.datastructures import SortedDict
+
+# Constants #
+
+"""
+Upper bounds, in seconds, of the latency histogram buckets. The last bucket
+(+Inf) is implied.
+"""
+BUCKETS = (0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0)
+
+# Request Statistics #
+
+_local = threading.local()
+
+class Stats(object):
+    """The measurements of one request."""
+    def __init__(self):
+        self.start = time.time()
+        self.queries = 0
+        self.db = 0.0
+        self.phases = SortedDict()
+
+    def add_phase(self,name,seconds):
+        self.phases[name] = self.phases.get(name,0.0) + seconds
+
+def start():
+    """Start measuring a request in this thread. Returns its Stats."""
+    _local.stats = Stats()
+    return _local.stats
+
+def resume(stats):
+    """Go on measuring a request in this thread, as when its streamed body
+    is read after the response has been returned.
+    """
+    _local.stats = stats
+
+def stop():
+    """Stop measuring the request in this thread. Returns its Stats, or None
+    if it was not being measured.
+    """
+    stats = getattr(_local,'stats',None)
+    _local.stats = None
+    return stats
+
+def current():
+    """The Stats of the request being measured in this thread, or None."""
+    return getattr(_local,'stats',None)
+
+class phase(object):
+    """Decorate a function to add the time spent in it to a named phase of
+    the current request. Nested calls to the same phase are counted once.
+
+        @phase('serialize')
+        def bulk_to_commonjs(packages):
+            ...
+    """
+    def __init__(self,name):
+        self.name = name
+
+    def __call__(self,function):
+        name = self.name
+        def measured(*args,**kwargs):
+            stats = current()
+            if stats is None or name in getattr(_local,'active',()):
+                return function(*args,**kwargs)
+            active = _local.active = getattr(_local,'active',set())
+            active.add(name)
+            start = time.time()
+            try:
+                return function(*args,**kwargs)
+            finally:
+                stats.add_phase(name,time.time() - start)
+                active.discard(name)
+        measured.__name__ = function.__name__
+        measured.__doc__ = function.__doc__
+        measured.__module__ = function.__module__
+        return measured
+
+# Database #
+
+class CursorTimingWrapper(object):
+    """Count and time the statements of a cursor, like Django's
+    CursorDebugWrapper, but only into the Stats of the current request.
+    """
+    def __init__(self,cursor,stats):
+        self.cursor = cursor
+        self.stats = stats
+
+    def execute(self,sql,params=()):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql,params)
+        finally:
+            self.stats.queries += 1
+            self.stats.db += time.time() - start
+
+    def executemany(self,sql,param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql,param_list)
+        finally:
+            self.stats.queries += 1
+            self.stats.db += time.time() - start
+
+    def __getattr__(self,attr):
+        return getattr(self.cursor,attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+def _measured(cursor):
+    """Wrap the cursor() method of a database wrapper class."""
+    def measured_cursor(self):
+        stats = current()
+        if stats is None: return cursor(self)
+        return CursorTimingWrapper(cursor(self),stats)
+    return measured_cursor
+
+def instrument_connections():
+    """Wrap the cursors of every database connection while a request is
+    measured. The wrapper classes are patched rather than the connections,
+    since each thread has its own connection objects. Safe to call more than
+    once.
+    """
+    for connection in connections.all():
+        cls = connection.__class__
+        if cls.__dict__.get('_instrumented'): continue
+        cls.cursor = _measured(cls.cursor)
+        cls._instrumented = True
+
+# Aggregates #
+
+class Histogram(object):
+    """Cumulative request latency of one view."""
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.queries = 0
+        self.db = 0.0
+
+    def observe(self,stats,seconds):
+        self.counts[bisect.bisect_left(BUCKETS,seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.queries += stats.queries
+        self.db += stats.db
+
+_lock = threading.Lock()
+
+# View name to its Histogram.
+_histograms = {}
+
+def record(view,stats,seconds):
+    """Add a finished request to the histogram of its view."""
+    _lock.acquire()
+    try:
+        if view not in _histograms: _histograms[view] = Histogram()
+        _histograms[view].observe(stats,seconds)
+    finally:
+        _lock.release()
+
+def reset():
+    """Forget every recorded request."""
+    _lock.acquire()
+    try:
+        _histograms.clear()
+    finally:
+        _lock.release()
+
+def server_timing(stats,seconds):
+    """Format the Server-Timing header of a request. Phases may overlap:
+    the time of a serialize phase includes the queries it made.
+    """
+    entries = ['db;dur=%.2f;desc="%s queries"' %(stats.db * 1000,stats.queries)]
+    for name,value in stats.phases.items():
+        entries.append('%s;dur=%.2f' %(name,value * 1000))
+    entries.append('total;dur=%.2f' %(seconds * 1000))
+    return ", ".join(entries)
+
+def render():
+    """Write the recorded metrics in the Prometheus text exposition format."""
+    _lock.acquire()
+    try:
+        histograms = [(view,list(h.counts),h.sum,h.count,h.queries,h.db) for view,h in sorted(_histograms.items())]
+    finally:
+        _lock.release()
+
+    lines = [
+        "# HELP registry_request_duration_seconds Time taken to respond to a request.",
+        "# TYPE registry_request_duration_seconds histogram",
+    ]
+    for view,counts,total,count,queries,db in histograms:
+        cumulative = 0
+        for bound,n in zip([repr(b) for b in BUCKETS] + ["+Inf"],counts):
+            cumulative += n
+            lines.append('registry_request_duration_seconds_bucket{view="%s",le="%s"} %s' %(view,bound,cumulative))
+        lines.append('registry_request_duration_seconds_sum{view="%s"} %r' %(view,total))
+        lines.append('registry_request_duration_seconds_count{view="%s"} %s' %(view,count))
+    lines.extend([
+        "# HELP registry_db_queries_total Database queries issued by requests.",
+        "# TYPE registry_db_queries_total counter",
+    ])
+    for view,counts,total,count,queries,db in histograms:
+        lines.append('registry_db_queries_total{view="%s"} %s' %(view,queries))
+    lines.extend([
+        "# HELP registry_db_seconds_total Time requests spent in database queries.",
+        "# TYPE registry_db_seconds_total counter",
+    ])
+    for view,counts,total,count,queries,db in histograms:
+        lines.append('registry_db_seconds_total{view="%s"} %r' %(view,db))
+    return "\n".join(lines) + "\n"
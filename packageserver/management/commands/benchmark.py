@@ -0,0 +1,103 @@
+"""
+Benchmark the main registry operations against a synthetic registry.
+
+    ./manage.py benchmark --packages=5000 --output=results.json
+
+The timings and query counts are written as JSON so that runs can be compared
+over time. See benchmarks.py.
+"""
+
+# Imports #
+
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+from optparse import make_option
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+import django
+from django.core.management.base import BaseCommand
+from django.test.client import Client
+from django.utils.datastructures import SortedDict
+
+from fwp.packageserver.benchmarks import WORDS, synthetic_registry, test_database, timed
+from fwp.packageserver.commonjs import bulk_to_commonjs
+from fwp.packageserver.models import Package, Package_Version
+from fwp.packageserver.resolver import Resolver
+from fwp.packageserver import search
+
+# Command #
+
+class Command(BaseCommand):
+    help = "Time descriptor serialization, version lookup, search and dependency resolution against a synthetic registry."
+    option_list = BaseCommand.option_list + (
+        make_option('--packages',type='int',default=2000,help="Packages in the synthetic registry."),
+        make_option('--seed',type='int',default=0,help="Seed of the synthetic registry."),
+        make_option('--repeat',type='int',default=5,help="Times each operation is repeated. The fastest time is reported."),
+        make_option('--output',default=None,help="File the JSON results are written to. Defaults to standard output."),
+    )
+
+    def handle(self,*args,**options):
+        with test_database():
+            start = time.time()
+            names = synthetic_registry(options['packages'],options['seed'])
+            generated = time.time() - start
+            versions = Package_Version.objects.count()
+            results = self.run(names,options['seed'],options['repeat'])
+
+        data = SortedDict()
+        data['created'] = datetime.now().isoformat()
+        data['python'] = platform.python_version()
+        data['django'] = django.get_version()
+        data['packages'] = len(names)
+        data['versions'] = versions
+        data['seed'] = options['seed']
+        data['repeat'] = options['repeat']
+        data['generate_seconds'] = round(generated,2)
+        data['results'] = results
+
+        output = json.dumps(data,indent=2)
+        if options['output']:
+            f = open(options['output'],'w')
+            try:
+                f.write(output)
+            finally:
+                f.close()
+        else:
+            self.stdout.write(output + "\n")
+        for name,result in results.items():
+            sys.stderr.write("%-24s %10.2f ms %6s queries\n" %(name,result['ms'],result['queries']))
+
+    def run(self,names,seed,repeat):
+        """Time each operation. Returns a SortedDict of operation name to its
+        fastest time in milliseconds and query count.
+        """
+        random.seed(seed)
+        sample = random.sample(names,min(100,len(names)))
+        name = sample[0]
+        # Packages only depend on those generated before them, so the last 
+        # one can reach the most of the graph.
+        root = Package.objects.order_by('-pk')[0]
+        client = Client()
+
+        operations = SortedDict()
+        operations['serialize_one'] = lambda: Package.objects.get(name=name).to_commonjs()
+        operations['serialize_100'] = lambda: bulk_to_commonjs(Package.objects.filter(name__in=sample))
+        operations['latest_version'] = lambda: Package_Version.objects.latest_version(name)
+        operations['version_list'] = lambda: list(Package_Version.objects.for_package(name).values_list('number',flat=True))
+        operations['package_view'] = lambda: client.get('/registry/%s/' %name,HTTP_ACCEPT_ENCODING='gzip')
+        operations['search_one_term'] = lambda: search.search(WORDS[0])
+        operations['search_two_terms'] = lambda: search.search("%s %s" %(WORDS[1],WORDS[2]))
+        operations['resolve'] = lambda: Resolver().resolve(root)
+
+        results = SortedDict()
+        for operation,function in operations.items():
+            ms,queries = timed(function,repeat)
+            results[operation] = SortedDict([('ms',round(ms,3)),('queries',queries)])
+        return results
@@ -0,0 +1,75 @@
+"""
+Compare throughput and latency of the registry read path under concurrent
+clients, served by one worker at a time (the sync path) and by a thread pool.
+
+    ./manage.py benchmark_concurrency --packages=2000 --clients=64 --threads=1,4,32
+
+Each row serves package documents, version lists and the catalog from a
+synthetic registry to the same load. See server.py and benchmarks.py.
+"""
+
+# Imports #
+
+import os
+import random
+import shutil
+import tempfile
+import threading
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from fwp.packageserver.benchmarks import http_load, percentile, synthetic_registry, test_database
+from fwp.packageserver.server import make_server
+from fwp.packageserver import stats
+
+# Command #
+
+class Command(BaseCommand):
+    help = "Measure throughput and p99 latency of the read path with one worker against a pool of threads."
+    option_list = BaseCommand.option_list + (
+        make_option('--packages',type='int',default=1000,help="Packages in the synthetic registry."),
+        make_option('--clients',type='int',default=64,help="Concurrent clients."),
+        make_option('--requests',type='int',default=20,help="Requests made by each client."),
+        make_option('--threads',default="1,32",help="Comma separated worker thread counts to compare. 1 is the sync path."),
+        make_option('--processes',type='int',default=4,help="Processes the clients run in."),
+        make_option('--port',type='int',default=8765,help="Port the server listens on."),
+    )
+
+    def handle(self,*args,**options):
+        directory = tempfile.mkdtemp()
+        try:
+            # The workers are threads with connections of their own, so the
+            # database must be a file rather than in memory.
+            with test_database(name=os.path.join(directory,"benchmark.db")):
+                names = synthetic_registry(options['packages'])
+                random.seed(0)
+                sample = random.sample(names,min(200,len(names)))
+                paths = ["/registry/%s/" %name for name in sample] * 8
+                paths += ["/registry/%s/versions/" %name for name in sample] * 2
+                paths += ["/registry/"]
+
+                self.stdout.write("%8s %8s %10s %10s %10s %8s\n" %("threads","clients","req/s","p50 ms","p99 ms","errors"))
+                for threads in [int(n) for n in options['threads'].split(',')]:
+                    self.run(threads,paths,options)
+                stats.flush()
+        finally:
+            shutil.rmtree(directory)
+
+    def run(self,threads,paths,options):
+        server = make_server('127.0.0.1',options['port'],threads)
+        serving = threading.Thread(target=server.serve_forever)
+        serving.daemon = True
+        serving.start()
+        try:
+            elapsed,latencies,failures = http_load('127.0.0.1',options['port'],paths,options['clients'],options['requests'],options['processes'])
+        finally:
+            server.stop()
+        self.stdout.write("%8s %8s %10.1f %10.1f %10.1f %8s\n" %(
+            threads,
+            options['clients'],
+            len(latencies) / elapsed,
+            percentile(latencies,0.5) * 1000,
+            percentile(latencies,0.99) * 1000,
+            failures,
+        ))
@@ -0,0 +1,45 @@
+"""
+Measure the throughput of writing and validating package.json documents.
+
+    ./manage.py benchmark_encoding --packages=500
+
+The documents of a synthetic registry are written by string concatenation,
+the way the to_commonjs() methods once did, by json.dumps() of SortedDicts,
+and by the compiled encoder of schema.py, and checked by its validator. See
+benchmarks.encoding_throughput().
+"""
+
+# Imports #
+
+import sys
+from optparse import make_option
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.core.management.base import BaseCommand
+
+from fwp.packageserver.benchmarks import encoding_throughput, synthetic_registry, test_database
+from fwp.packageserver.commonjs import bulk_to_commonjs_data
+from fwp.packageserver.models import Package
+
+# Command #
+
+class Command(BaseCommand):
+    help = "Measure documents per second written and validated by each encoder."
+    option_list = BaseCommand.option_list + (
+        make_option('--packages',type='int',default=500,help="Packages in the synthetic registry."),
+        make_option('--seed',type='int',default=0,help="Seed of the synthetic registry."),
+        make_option('--seconds',type='float',default=2.0,help="Time spent on each encoder."),
+    )
+
+    def handle(self,*args,**options):
+        with test_database():
+            synthetic_registry(options['packages'],options['seed'])
+            documents = bulk_to_commonjs_data(Package.objects.all()).values()
+        results = encoding_throughput(documents,options['seconds'])
+        self.stdout.write(json.dumps(results,indent=2) + "\n")
+        for method,rate in results.items():
+            sys.stderr.write("%-32s %10.0f documents/second\n" %(method,rate))
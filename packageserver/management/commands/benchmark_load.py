@@ -0,0 +1,82 @@
+"""
+Load test the whole registry stack with a mix of traffic.
+
+    ./manage.py benchmark_load --packages=2000 --clients=64 --mix=fetch=80,search=15,publish=5
+
+A synthetic registry is served from a thread pool (see server.py) through the
+full Django stack, URL routing, middleware, sessions and authentication
+included, to clients running in processes of their own on the same machine.
+The clients replay a weighted mix of package document fetches, version
+lists, the catalog, searches, browsing, batched fetches and archive uploads,
+and the throughput, latency percentiles and error rate are reported for each
+kind of request. Everything runs locally against a throwaway database, so no
+network access is needed. See benchmarks.py.
+"""
+
+# Imports #
+
+import os
+import shutil
+import tempfile
+import threading
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fwp.packageserver.benchmarks import TRAFFIC_MIX, load_report, mixed_load, parse_mix, synthetic_registry, test_database, traffic
+from fwp.packageserver.server import make_server
+from fwp.packageserver import stats
+
+# Command #
+
+class Command(BaseCommand):
+    help = "Measure throughput, latency percentiles and errors of the registry under a mix of traffic."
+    option_list = BaseCommand.option_list + (
+        make_option('--packages',type='int',default=1000,help="Packages in the synthetic registry."),
+        make_option('--history',type='int',default=3,help="Most earlier versions of each package."),
+        make_option('--mix',default=",".join(["%s=%s" %pair for pair in TRAFFIC_MIX]),help="Comma separated kind=weight pairs of the traffic. Kinds: %s." %", ".join([kind for kind,weight in TRAFFIC_MIX])),
+        make_option('--clients',type='int',default=32,help="Concurrent clients."),
+        make_option('--requests',type='int',default=50,help="Requests made by each client."),
+        make_option('--processes',type='int',default=4,help="Processes the clients run in."),
+        make_option('--threads',type='int',default=32,help="Worker threads of the server."),
+        make_option('--seed',type='int',default=0,help="Seed of the synthetic registry and the traffic."),
+        make_option('--port',type='int',default=8766,help="Port the server listens on."),
+    )
+
+    def handle(self,*args,**options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        directory = tempfile.mkdtemp()
+        archive_root = settings.PACKAGE_ARCHIVE_ROOT
+        settings.PACKAGE_ARCHIVE_ROOT = os.path.join(directory,"archives")
+        try:
+            # The workers are threads with connections of their own, so the
+            # database must be a file rather than in memory.
+            with test_database(name=os.path.join(directory,"benchmark.db")):
+                names = synthetic_registry(options['packages'],options['seed'],history=options['history'])
+                requests = traffic(names,mix,seed=options['seed'])
+                elapsed,results = self.run(requests,options)
+                # Count the requests into the throwaway database, not the
+                # real one on the way out.
+                stats.flush()
+        finally:
+            settings.PACKAGE_ARCHIVE_ROOT = archive_root
+            shutil.rmtree(directory)
+
+        self.stdout.write("%10s %8s %10s %10s %10s %10s %8s\n" %("kind","requests","req/s","p50 ms","p95 ms","p99 ms","errors"))
+        for kind,count,rate,p50,p95,p99,errors in load_report(elapsed,results):
+            self.stdout.write("%10s %8s %10.1f %10.1f %10.1f %10.1f %7.2f%%\n" %(kind,count,rate,p50,p95,p99,errors * 100))
+
+    def run(self,requests,options):
+        server = make_server('127.0.0.1',options['port'],options['threads'])
+        serving = threading.Thread(target=server.serve_forever)
+        serving.daemon = True
+        serving.start()
+        try:
+            return mixed_load('127.0.0.1',options['port'],requests,options['clients'],options['requests'],options['processes'],options['seed'])
+        finally:
+            server.stop()
@@ -0,0 +1,35 @@
+"""
+Measure how dependency resolution scales with the size of the graph.
+
+    ./manage.py benchmark_resolver --depths=10,50,100 --width=20 --fanout=3
+"""
+
+# Imports #
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from fwp.packageserver.benchmarks import dependency_graph, test_database, timed
+from fwp.packageserver.resolver import Resolver
+
+# Command #
+
+class Command(BaseCommand):
+    help = "Time the resolution of synthetic dependency graphs of increasing depth."
+    option_list = BaseCommand.option_list + (
+        make_option('--depths',default="10,50,100",help="Comma separated depths of the graphs to resolve."),
+        make_option('--width',type='int',default=20,help="Packages per level."),
+        make_option('--fanout',type='int',default=3,help="Dependencies per package."),
+        make_option('--repeat',type='int',default=5,help="Times each resolution is repeated."),
+    )
+
+    def handle(self,*args,**options):
+        depths = [int(depth) for depth in options['depths'].split(',')]
+        with test_database():
+            self.stdout.write("%8s %8s %8s %10s\n" %("depth","nodes","queries","ms"))
+            for depth in depths:
+                root = dependency_graph(depth,options['width'],options['fanout'],prefix="depth%s" %depth)
+                ms,queries = timed(lambda: Resolver().resolve(root),options['repeat'])
+                nodes = depth * options['width'] + 1
+                self.stdout.write("%8s %8s %8s %10.1f\n" %(depth,nodes,queries,ms))
@@ -0,0 +1,34 @@
+"""
+Export the registry as static files.
+
+    ./manage.py export_registry path/to/export [--full] [--processes=4]
+
+Only the packages changed since the last export to the directory are written
+again unless --full is given. See export.py.
+"""
+
+# Imports #
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fwp.packageserver.export import export
+
+# Command #
+
+class Command(BaseCommand):
+    help = "Export the package documents of the registry as static files."
+    args = "<directory>"
+    option_list = BaseCommand.option_list + (
+        make_option('--full',action='store_true',default=False,help="Export every package, not only those changed since the last export."),
+        make_option('--processes',type='int',default=None,help="Processes used to write files. Defaults to one per CPU."),
+        make_option('--batch-size',type='int',default=200,help="Packages written by each task."),
+    )
+
+    def handle(self,directory=None,**options):
+        if not directory: raise CommandError("Give the directory to export to.")
+        start = time.time()
+        packages,written = export(directory,options['processes'],options['full'],options['batch_size'])
+        self.stdout.write("Exported %s packages (%s files) in %.1f seconds.\n" %(packages,written,time.time() - start))
@@ -0,0 +1,60 @@
+"""
+Import package.json descriptors in bulk.
+
+    ./manage.py import_packages path/to/descriptors [more paths...]
+
+Paths may be descriptor files or directories, which are searched for *.json
+files. See importer.py.
+"""
+
+# Imports #
+
+import os
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fwp.packageserver.importer import Importer, parse_files
+
+# Command #
+
+class Command(BaseCommand):
+    help = "Import package.json descriptors in bulk."
+    args = "<path path ...>"
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size',type='int',default=500,help="Packages inserted per transaction."),
+        make_option('--processes',type='int',default=None,help="Processes used to parse files. Defaults to one per CPU."),
+    )
+
+    def handle(self,*paths,**options):
+        if not paths: raise CommandError("Give at least one descriptor file or directory.")
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root,dirs,names in os.walk(path):
+                    files.extend([os.path.join(root,name) for name in sorted(names) if name.endswith('.json')])
+            else:
+                files.append(path)
+
+        importer = Importer()
+        start = time.time()
+        batch = []
+        for path,data,error in parse_files(files,options['processes']):
+            if error: importer.errors.append((path,error))
+            else: batch.append((path,data))
+            if len(batch) >= options['batch_size']:
+                self.import_batch(importer,batch,start)
+                batch = []
+        if batch: self.import_batch(importer,batch,start)
+        importer.finish()
+
+        elapsed = max(time.time() - start,0.001)
+        for path,error in importer.errors:
+            self.stderr.write("%s: %s\n" %(path,error))
+        self.stdout.write("Imported %s packages in %.1f seconds (%.0f packages/second), %s errors.\n" %(importer.imported,elapsed,importer.imported / elapsed,len(importer.errors)))
+
+    def import_batch(self,importer,batch,start):
+        importer.import_batch(batch)
+        elapsed = max(time.time() - start,0.001)
+        self.stdout.write("%s packages (%.0f packages/second)\n" %(importer.imported,importer.imported / elapsed))
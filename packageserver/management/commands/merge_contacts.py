@@ -0,0 +1,21 @@
+"""
+Fold together the contacts that share an email address, written in any case,
+and store the normalized address and package counts of every contact. New
+contacts are kept unique as they are saved, so this is only needed once for a
+database from before they were.
+"""
+
+# Imports #
+
+from django.core.management.base import NoArgsCommand
+
+from fwp.packageserver.contacts import merge_duplicates
+
+# Command #
+
+class Command(NoArgsCommand):
+    help = "Merge contacts with the same email address."
+
+    def handle_noargs(self,**options):
+        removed = merge_duplicates()
+        if int(options.get('verbosity',1)): self.stdout.write("Merged %s duplicate contacts.\n" %removed)
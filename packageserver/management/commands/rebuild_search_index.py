@@ -0,0 +1,19 @@
+"""
+Rebuild the package search index from scratch. The index is kept current as
+packages are saved, so this is only needed for packages that were loaded
+without going through the ORM.
+"""
+
+# Imports #
+
+from django.core.management.base import NoArgsCommand
+
+from fwp.packageserver.search import rebuild_index
+
+# Command #
+
+class Command(NoArgsCommand):
+    help = "Rebuild the package search index."
+
+    def handle_noargs(self,**options):
+        rebuild_index()
@@ -0,0 +1,39 @@
+"""
+Serve the registry from a pool of threads.
+
+    ./manage.py serve_registry [addrport] --threads=64
+
+See server.py.
+"""
+
+# Imports #
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fwp.packageserver.server import make_server
+
+# Command #
+
+class Command(BaseCommand):
+    help = "Serve the registry with a thread pool WSGI server."
+    args = "[optional address:port]"
+    option_list = BaseCommand.option_list + (
+        make_option('--threads',type='int',default=32,help="Worker threads, and so the most requests handled at once."),
+    )
+
+    def handle(self,addrport="127.0.0.1:8000",**options):
+        if ':' in addrport: host,port = addrport.rsplit(':',1)
+        else: host,port = "127.0.0.1",addrport
+        try:
+            port = int(port)
+        except ValueError:
+            raise CommandError("%r is not a valid port number." %port)
+
+        server = make_server(host,port,options['threads'])
+        self.stdout.write("Serving the registry at http://%s:%s/ with %s threads.\n" %(host,port,options['threads']))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,43 @@
+"""
+Refresh the local SQLite replicas from the primary database.
+
+    ./manage.py sync_replicas
+
+This stands in for real replication when developing with two SQLite files.
+Each replica is written with VACUUM INTO, which copies a consistent snapshot
+of the primary (write-ahead log included) without blocking its writers, and
+then replaces the old replica with one rename, so readers see either the old
+copy or the new one. Open replica connections notice the new file when their
+request finishes. See databases.py.
+"""
+
+# Imports #
+
+import os
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Command #
+
+class Command(NoArgsCommand):
+    help = "Copy the primary SQLite database over each of the REPLICA_DATABASES."
+
+    def handle_noargs(self,**options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if not primary.settings_dict['ENGINE'].endswith('sqlite3'):
+            raise CommandError("Only SQLite replicas can be synced; other databases replicate themselves.")
+
+        for alias in getattr(settings,'REPLICA_DATABASES',()):
+            name = connections[alias].settings_dict['NAME']
+            if name == primary.settings_dict['NAME']: continue
+            temporary = "%s.sync" %name
+            if os.path.exists(temporary): os.remove(temporary)
+            primary.cursor().execute("VACUUM INTO %s",[temporary])
+            os.rename(temporary,name)
+            # Replicas never write, so their log holds nothing of value, and 
+            # it belongs to the file that was replaced.
+            for suffix in ('-wal','-shm'):
+                if os.path.exists(name + suffix): os.remove(name + suffix)
+            self.stdout.write("Synced %s.\n" %alias)
@@ -0,0 +1,81 @@
+"""
+Middleware of the package server.
+"""
+
+# Imports #
+
+import time
+
+import instrumentation
+
+# Classes #
+
+class MeasuredBody(object):
+    """The streamed body of a response, such as the catalog, which is read
+    after the middleware is done with the response. The queries and phases
+    of each chunk are added to the Stats of the request, and the request is
+    recorded once the body has been read to the end or closed.
+    """
+    def __init__(self,body,stats,view):
+        self.body = body
+        self.stats = stats
+        self.view = view
+        self.iterator = None
+
+    def __iter__(self):
+        self.iterator = iter(self.body)
+        return self
+
+    def next(self):
+        instrumentation.resume(self.stats)
+        try:
+            return self.iterator.next()
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            instrumentation.stop()
+
+    def close(self):
+        if self.stats is None: return
+        if hasattr(self.body,'close'): self.body.close()
+        instrumentation.record(self.view,self.stats,time.time() - self.stats.start)
+        self.stats = None
+
+# Middleware #
+
+class TimingMiddleware(object):
+    """Measure each request and report its query count, database time and 
+    serialization phases in a Server-Timing header. The total time is added 
+    to the latency histogram of the view, served at /metrics. See 
+    instrumentation.py.
+
+    A streamed response is measured until its body has been sent. That is 
+    after its headers, so it has no Server-Timing header and is only 
+    reported at /metrics. See MeasuredBody.
+
+    Place this first in MIDDLEWARE_CLASSES so that the other middleware is 
+    included in the total.
+    """
+    def __init__(self):
+        instrumentation.instrument_connections()
+
+    def process_request(self,request):
+        instrumentation.start()
+
+    def process_view(self,request,view_func,view_args,view_kwargs):
+        request._timing_view = "%s.%s" %(view_func.__module__,view_func.__name__)
+
+    def process_response(self,request,response):
+        stats = instrumentation.stop()
+        if stats is None: return response
+        view = getattr(request,'_timing_view','unresolved')
+        # Django 1.2 has no flag for streamed responses; their content is
+        # the iterator they were made with rather than a list of strings.
+        if not response._is_string:
+            response._container = MeasuredBody(response._container,stats,view)
+            return response
+        seconds = time.time() - stats.start
+        response['Server-Timing'] = instrumentation.server_timing(stats,seconds)
+        instrumentation.record(view,stats,seconds)
+        return response
@@ -20,8 +20,11 @@ from a list of valid names.
 
 # Imports #
 
+from django.core.exceptions import ValidationError
 from django.db import models
 
+import semver
+
 # Choices #
 
 REPO_TYPES = (
@@ -30,19 +33,106 @@ REPO_TYPES = (
     ('svn','SVN'),
 )
 
+# Functions #
+
+def normalize_email(email):
+    """The form of an email address that contacts are told apart by, or None 
+    for no address. See Contact.email_key.
+    """
+    email = (email or "").strip().lower()
+    return email or None
+
+# Validators #
+
+def validate_version(value):
+    """Make sure a version string can be parsed. See semver.py."""
+    if not semver.is_valid(value):
+        raise ValidationError("%s is not a valid version. See http://semver.org/" %value)
+
+# Fields #
+
+class KeyField(models.CharField):
+    """A case folded copy of another field, indexed so that the admin can
+    search it by prefix. See admin.prefix_search(). Like auto_now, it is set
+    in pre_save(), so rows inserted by bulk.bulk_insert() get one too.
+    """
+    def __init__(self,source,*args,**kwargs):
+        self.source = source
+        kwargs.setdefault('db_index',True)
+        kwargs.setdefault('editable',False)
+        kwargs.setdefault('blank',True)
+        super(KeyField,self).__init__(*args,**kwargs)
+
+    def pre_save(self,model_instance,add):
+        value = (getattr(model_instance,self.source) or "").lower()
+        setattr(model_instance,self.attname,value)
+        return value
+
 # Models #
 
+class Platform(models.Model):
+    """Base for the platform vocabularies (Cpu, JavaScript_Engine and 
+    Operating_System). Each name is given its own bit so that a set of names 
+    can be stored as a bit mask. See Package.os_mask and platforms.py.
+    """
+    bit = models.PositiveSmallIntegerField(unique=True,blank=True,null=True,editable=False)
+
+    # Masks are stored in signed 64 bit columns.
+    MAX_BIT = 62
+
+    class Meta:
+        abstract = True
+
+    def save(self,*args,**kwargs):
+        """Give a new name the next free bit."""
+        if self.bit is None:
+            last = self.__class__.objects.aggregate(models.Max('bit'))['bit__max']
+            if last is None: self.bit = 0
+            else: self.bit = last + 1
+            if self.bit > self.MAX_BIT:
+                raise ValueError("No more than %s %s names may be defined." %(self.MAX_BIT + 1,self._meta.verbose_name))
+        super(Platform,self).save(*args,**kwargs)
+
+    @property
+    def mask(self):
+        return 1 << self.bit
+
 class Contact(models.Model):
-    """A contact person related to a package (maintainer, contributor)."""
+    """A contact person related to a package (maintainer, contributor).
+
+    A person is one contact however the case of their email address is 
+    written: email_key holds the normalized address and is unique. Contacts 
+    without an address are told apart by name only by the importer.
+    """
     first_name = models.CharField(max_length=128)
     last_name = models.CharField(max_length=128)
     website = models.URLField(blank=True,null=True)
     email = models.EmailField(blank=True,null=True)
+    email_key = models.CharField(max_length=75,unique=True,blank=True,null=True,editable=False)
+    first_name_key = KeyField('first_name',max_length=128)
+    last_name_key = KeyField('last_name',max_length=128)
+
+    """
+    The number of packages the contact maintains and contributes to, kept 
+    current by contacts.py so that the maintainer directory never counts.
+    """
+    maintained_count = models.PositiveIntegerField(default=0,editable=False)
+    contributed_count = models.PositiveIntegerField(default=0,editable=False)
 
     def __unicode__(self):
         return "%s %s" %(self.first_name,self.last_name)
 
-    def to_commonjs(self):
+    def clean(self):
+        """Make sure no other contact has the same email address."""
+        key = normalize_email(self.email)
+        if key and Contact.objects.filter(email_key=key).exclude(pk=self.pk).exists():
+            raise ValidationError("Another contact already has the email address %s." %self.email)
+
+    def save(self,*args,**kwargs):
+        self.email_key = normalize_email(self.email)
+        super(Contact,self).save(*args,**kwargs)
+
+    def to_commonjs(self,pretty=False):
         """Export the contact as canonical CommonJS maintainer or contributor info.
         Example:
         {
@@ -51,13 +141,11 @@ class Contact(models.Model):
             "web": "http://www.bblogmedia.com",
         }
         """
-        js = '{"name":"%s","' %(self.first_name,self.last_name)
-        if self.email: js += '"email": "%s"' %(self.email)
-        if self.website: js += '"web": "%s"' %(self.website)
-        js += "}"
-        return js
+        from commonjs import _contact
+        from schema import CONTACT
+        return CONTACT.encode(_contact(self.first_name,self.last_name,self.email,self.website),pretty)
 
-class Cpu(models.Model):
+class Cpu(Platform):
     """Maintain CPU requirements for the target system.
     From the CommonJS spec:
     
@@ -83,11 +171,14 @@ class Directory(models.Model):
     def __unicode__(self):
         return self.name
 
-    def to_commonjs(self):
-        """Convert the directory info to canonical CommonJS output."""
-        return '"%s": "%s",' %(self.name,self.path)
+    def to_commonjs(self,pretty=False):
+        """Convert the directory info to canonical CommonJS output, as an 
+        object of its one name and path.
+        """
+        from schema import DIRECTORIES
+        return DIRECTORIES.encode({self.name: self.path},pretty)
 
-class JavaScript_Engine(models.Model):
+class JavaScript_Engine(Platform):
     """Maintain supported JavaScript engines for the target system.
 
     From the CommonJS spec:
@@ -115,7 +206,7 @@ class License(models.Model):
     def __unicode__(self):
         return self.title
 
-    def to_commonjs(self):
+    def to_commonjs(self,pretty=False):
         """Export license info as canonical CommonJS.
         Example:
         {
@@ -123,9 +214,10 @@ class License(models.Model):
             "url": "http://www.example.com/licenses/gpl.html",
         }
         """
-        return '{"type": "%s","url": "%s"}' %(self.abbreviation,self.url)
+        from schema import LICENSE
+        return LICENSE.encode({'type': self.abbreviation,'url': self.url},pretty)
 
-class Operating_System(models.Model):
+class Operating_System(Platform):
     """Maintain operating system info for target system requirements.
     See Package.requirements.
 
@@ -158,21 +250,24 @@ class Repo(models.Model):
         if not self.path: return self.url
         return "%s/%s" %(self.url,self.path)
 
-    def to_commonjs(self):
+    def to_commonjs(self,pretty=False):
         """Export repo info as CommonJS."""
-        js = '{"type": "%s","url": "%s"' %(self.type,self.url)
-        if (self.path): js += ',"path": "%s"' %(self.path)
-        js += '}'
-        return js
+        from schema import REPO
+        return REPO.encode({'type': self.type,'url': self.url,'path': self.path or None},pretty)
 
 class Script(models.Model):
-    """Define scripts used by the package. See note at Package.scripts.
+    """Define scripts used by the package. See note at Package.scripts. 
+    Packages name their scripts alike, "test" or "install", with paths of 
+    their own, so a row is a (name, path) pair.
     """
-    name = models.CharField(max_length=64,unique=True,help_text="Common name of the script.")
+    name = models.CharField(max_length=64,help_text="Common name of the script.")
     path = models.CharField(max_length=256,help_text="File name or path of the script.")
 
+    class Meta:
+        unique_together = ('name','path')
+
     def __unicode__(self):
-        return self.title
+        return "%s: %s" %(self.name,self.path)
 
 class Specification(models.Model):
     """Connect a package with one or more specifications. Used by the 
@@ -213,7 +308,12 @@ class Package(models.Model):
     title = models.CharField(max_length=128,unique=True,help_text="Official title of the package.")
 
     name = models.CharField(max_length=128,unique=True,help_text='This must be a unique, lowercase alpha-numeric name without spaces. It may include "." or "_" or "-" characters.')
-    version = models.CharField(max_length=16,help_text='A version string conforming to the Semantic Versioning requirements at http://semver.org/')
+
+    # Searched by the admin. See KeyField.
+    name_key = KeyField('name',max_length=128)
+    title_key = KeyField('title',max_length=128)
+
+    version = models.CharField(max_length=16,validators=[validate_version],help_text='A version string conforming to the Semantic Versioning requirements at http://semver.org/')
     
     """
     "An Array of hashes each containing the details of a contributor. Format is 
@@ -281,8 +381,20 @@ class Package(models.Model):
 
     Also, based on the volume of info required for a Package, it may not 
     make sense for this to be self-referencing.
+
+    A dependency is directed, so the relation is not symmetrical: the 
+    packages that depend on a package are its "dependents". See resolver.py.
+    Each edge is a Dependency, which keeps the range of versions accepted; 
+    option groups are given in the range, separated by "||".
     """
-    dependencies = models.ManyToManyField('self',blank=True,null=True)
+    dependencies = models.ManyToManyField('self',symmetrical=False,through='Dependency',related_name="dependents",blank=True,null=True)
+
+    """
+    The number of packages that depend on this one directly, and through any 
+    chain of dependencies. These are kept in sync by dependents.py.
+    """
+    dependent_count = models.PositiveIntegerField(default=0,editable=False)
+    transitive_dependent_count = models.PositiveIntegerField(default=0,editable=False)
 
     """
     "An Array of string keywords to assist users searching for the package in 
@@ -337,6 +449,24 @@ class Package(models.Model):
     System_Requirement and the Cpu class for an example.
     """
     requirements = models.ForeignKey(System_Requirement)
+
+    """
+    The requirements above encoded as masks of Platform bits, so that 
+    compatibility is answered by one indexed scan of this table rather than 
+    a join through the requirement tables. A mask of zero means the package 
+    makes no assumptions. These are kept in sync by platforms.py.
+    """
+    os_mask = models.BigIntegerField(default=0,editable=False)
+    cpu_mask = models.BigIntegerField(default=0,editable=False)
+    engine_mask = models.BigIntegerField(default=0,editable=False)
+
+    """
+    When the package or anything in its document last changed: it is set 
+    whenever documents.refresh_documents() renders the document again, as 
+    well as on save. Newest first, with the id to break ties, it is one of 
+    the orders of the browse API. See browse.py.
+    """
+    updated = models.DateTimeField(auto_now=True,editable=False)
     
     """
     "Boolean value indicating the package is built in as a standard component 
@@ -376,86 +506,230 @@ class Package(models.Model):
     """
     "Hash of package checksums. This checksum is used by package manager tools 
     to verify the integrity of a package."
+
+    These are the checksums of the archive uploaded for a version, so they 
+    are kept with the version. See Package_Version.archive.
     """
-    #checksums = ?
+
+    """
+    The rendered package.json document and its gzip compressed form (base64 
+    encoded, since there is no binary field), with the validators used to 
+    answer conditional requests for it. These are regenerated whenever the 
+    package or any of its related rows change so that the registry views 
+    never have to walk the relations. See documents.py.
+    """
+    document = models.TextField(blank=True,null=True,editable=False)
+    document_gzip = models.TextField(blank=True,null=True,editable=False)
+    document_etag = models.CharField(max_length=32,blank=True,null=True,editable=False)
+    document_modified = models.DateTimeField(blank=True,null=True,editable=False)
 
     def __unicode__(self):
         return self.name
 
-    def to_commonjs(self):
+    def to_commonjs(self,pretty=False):
         """Convert the data canonical Common JS JSON worthy of a package.json 
         file. This is if we want to create a "true" package server that 
         supports Common JS.
+
+        This uses the same code path as commonjs.bulk_to_commonjs(), which 
+        should be preferred when converting more than one package.
         """
-        js = '{"name":"%s","version":"%s","description":"%s",' %(self.name,self.version,self.description)
-        if self.keywords: js += '"keywords": [%s],' %self.keywords
-
-        js += '"maintainers": ['
-        for Maintainer in self.maintainers:
-            js += Maintainer.to_commonjs()
-            js += ','
-        js += '],'
-
-        js += '"contributors": ['
-        for Contributor in self.contributors:
-            js += Contributor.to_commonjs()
-            js += ','
-        js += '],'
-
-        js += '"bugs": {"mail": "%s","web": "%s"},'
-
-        js += '"licenses": ['
-        for License in self.licenses:
-            js += License.to_commonjs()
-            js + ','
-        js += '],'
-
-        js += '"repositories": ['
-        for Repo in self.repositories:
-            js += Repo.to_commonjs()
-            js += ','
-        js += '],'
-
-        js += '"dependencies": {'
-        for Dependency in self.dependencies:
-            js += '"%s":"%s",' %(Dependency.name,Dependency.version)
-        js += '},'
-
-        if self.implements:
-            js += '"implements": [' 
-            for Spec in self.implements:
-                js += '"%s",' %Spec.name
-            js += '],'
-
-        if self.requirements:
-            if self.requirements.os:
-                js += '"os": ['
-                for r in self.requirements.os:
-                    js += '"%s",' %r.name
-                js += '],'
-            if self.requirements.cpu:
-                js += '"cpu": ['
-                for r in self.requirements.cpu:
-                    js += '"%s",' %r.name
-                js += '],'
-            if self.requirements.engines:
-                js += '"engine": ['
-                for r in self.requirements.engines:
-                    js += '"%s",' %r.name
-                js += '],'
-
-        if self.scripts:
-            js += '"scripts": {'
-            for Script in self.Scripts:
-                js += '"%s": "%s",' %(Script.name,Script.path)
-            js += '},' 
-
-        if self.directories:
-            js += '"scripts": {'
-            for Dir in self.Dir:
-                js += '"%s": "%s",' %(Dir.name,Dir.path)
-            js += '},' 
-
-        # This closes the JSON output.
-        js += '}'
+        from commonjs import bulk_to_commonjs
+        return bulk_to_commonjs([self],pretty)[self.pk]
 
+class Dependency(models.Model):
+    """A dependency of one package on another, with the range of versions of 
+    the other package that satisfy it, such as ">=1.2 <2 || 3.x". The table 
+    is the one Package.dependencies used before edges kept a range. See 
+    semver.py.
+    """
+    from_package = models.ForeignKey(Package,related_name="dependency_edges")
+    to_package = models.ForeignKey(Package,related_name="dependent_edges")
+    version_range = models.CharField(max_length=128,default="*",help_text="The versions that satisfy the dependency.")
+
+    class Meta:
+        db_table = 'packageserver_package_dependencies'
+        unique_together = (('from_package','to_package'),)
+        verbose_name_plural = "dependencies"
+
+    def __unicode__(self):
+        return "%s -> %s %s" %(self.from_package_id,self.to_package_id,self.version_range)
+
+    def get_range(self):
+        """The compiled Range of the dependency."""
+        return semver.compile_range(self.version_range)
+
+class Archive(models.Model):
+    """A package archive (tarball). Archives are stored once per distinct 
+    content under their sha256 digest, so identical uploads share a file and 
+    a row. See archives.py.
+    """
+    sha256 = models.CharField(max_length=64,unique=True)
+    md5 = models.CharField(max_length=32)
+    size = models.BigIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return self.sha256
+
+    def checksums(self):
+        """The CommonJS checksums hash of the archive."""
+        return {"md5": self.md5,"sha256": self.sha256}
+
+class Package_VersionManager(models.Manager):
+    """Version lookups that are answered by the (package, is_release, major, 
+    minor, patch, prerelease_key) index rather than by sorting version 
+    strings.
+    """
+    def for_package(self,package_name):
+        """All versions of a package, oldest first."""
+        return self.filter(package__name=package_name).order_by('major','minor','patch','is_release','prerelease_key')
+
+    def newest_first(self,package_name):
+        """All versions of a package, with releases ahead of pre-releases and 
+        newest first within each.
+        """
+        return self.filter(package__name=package_name).order_by('-is_release','-major','-minor','-patch','-prerelease_key')
+
+    def by_number(self,package_name,number):
+        """The version of a package with a version number, matched by its 
+        parsed components so that any spelling of it, such as "1.0" or 
+        "v1.0.0" for "1.0.0", finds it.
+        """
+        try:
+            major,minor,patch,prerelease = semver.parse(number)
+        except ValueError:
+            return self.none()
+        return self.filter(package__name=package_name,major=major,minor=minor,patch=patch,prerelease_key=semver.prerelease_key(prerelease))
+
+    def latest_version(self,package_name):
+        """Get the latest release of a package, or its latest pre-release if 
+        it has no releases. Returns None if the package has no versions.
+        """
+        rows = self.newest_first(package_name)[:1]
+        if rows: return rows[0]
+        return None
+
+class Package_Version(models.Model):
+    """A published version of a package.
+
+    The Package row holds the current (head) data of a package, and each 
+    version holds the package.json document as it was when that version was 
+    current. The parsed semver components are kept in their own columns so 
+    that the latest version, or the ordered list of versions, comes straight 
+    from an index. The pre-release tag is ordered by prerelease_key, which 
+    sorts as semver.org orders tags. See semver.py.
+
+    The document is stored alongside its gzip compressed form (base64 
+    encoded, since there is no binary field) and the validators used to 
+    answer conditional requests for it. The document of the current version 
+    is regenerated whenever the package or any of its related rows change so 
+    that the registry views never have to walk the relations. See 
+    documents.py.
+    """
+    package = models.ForeignKey(Package,related_name="versions")
+    number = models.CharField(max_length=16,validators=[validate_version],help_text="The version string.")
+    major = models.PositiveIntegerField(editable=False)
+    minor = models.PositiveIntegerField(editable=False)
+    patch = models.PositiveIntegerField(editable=False)
+    prerelease = models.CharField(max_length=16,blank=True,editable=False)
+    prerelease_key = models.CharField(max_length=64,blank=True,editable=False)
+    is_release = models.BooleanField(editable=False)
+
+    document = models.TextField(blank=True,null=True,editable=False)
+    document_gzip = models.TextField(blank=True,null=True,editable=False)
+    document_etag = models.CharField(max_length=32,blank=True,null=True,editable=False)
+    document_modified = models.DateTimeField(blank=True,null=True,editable=False)
+
+    archive = models.ForeignKey(Archive,related_name="versions",blank=True,null=True,editable=False)
+
+    objects = Package_VersionManager()
+
+    class Meta:
+        verbose_name = "Package Version"
+        verbose_name_plural = "Package Versions"
+        ordering = ('package','major','minor','patch','is_release','prerelease_key')
+        unique_together = (
+            ('package','number'),
+            ('package','is_release','major','minor','patch','prerelease_key'),
+        )
+
+    def __unicode__(self):
+        return "%s %s" %(self.package,self.number)
+
+    def parse_number(self):
+        """Set the version components from the version number."""
+        self.major,self.minor,self.patch,self.prerelease = semver.parse(self.number)
+        self.prerelease_key = semver.prerelease_key(self.prerelease)
+        self.is_release = not self.prerelease
+
+    def save(self,*args,**kwargs):
+        """Parse the version number into its components before saving."""
+        self.parse_number()
+        super(Package_Version,self).save(*args,**kwargs)
+
+class Search_Term(models.Model):
+    """A term of the search index, used when the database has no full-text 
+    index of its own. Each row holds the combined weight of a term within 
+    the name, title, keywords and description of a package. See search.py.
+    """
+    term = models.CharField(max_length=64)
+    package = models.ForeignKey(Package,related_name="search_terms")
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = "Search Term"
+        verbose_name_plural = "Search Terms"
+        unique_together = (('term','package'),)
+
+    def __unicode__(self):
+        return self.term
+
+class Change(models.Model):
+    """A change to a package version, used by mirrors to sync only what has 
+    changed. The id is the sequence number of the change. Only the latest 
+    change to each version is kept. See changes.py.
+    """
+    package_name = models.CharField(max_length=128)
+    version = models.CharField(max_length=16)
+    deleted = models.BooleanField(help_text="Indicates the version was deleted.")
+    created = models.DateTimeField()
+
+    class Meta:
+        ordering = ('id',)
+        unique_together = (('package_name','version'),)
+
+    def __unicode__(self):
+        return "%s %s %s" %(self.id,self.package_name,self.version)
+
+class Daily_Stat(models.Model):
+    """The number of times the document and the archive of a package version 
+    were served in a day. Counts are buffered in memory and added to these 
+    rollups in bulk. See stats.py.
+    """
+    package_name = models.CharField(max_length=128)
+    version = models.CharField(max_length=16)
+    day = models.DateField()
+    fetches = models.PositiveIntegerField(default=0,help_text="Times the package.json document was served.")
+    downloads = models.PositiveIntegerField(default=0,help_text="Times the archive was downloaded.")
+
+    class Meta:
+        ordering = ('package_name','day','version')
+        # Also the index for the days of a package.
+        unique_together = (('package_name','day','version'),)
+
+    def __unicode__(self):
+        return "%s %s %s" %(self.package_name,self.version,self.day)
+
+# Signals #
+
+# Keep the stored package.json documents, the search index, the changes feed, 
+# the platform masks and the dependent and contact package counts current, 
+# and configure the database connections.
+import documents
+import search
+import changes
+import platforms
+import dependents
+import contacts
+import databases
@@ -0,0 +1,124 @@
+"""
+Platform compatibility.
+
+Answering "which packages run on linux/x86_64 under node?" through the
+requirement tables takes a join through System_Requirement and three
+intermediary tables for every package. Instead, every Cpu, Operating_System
+and JavaScript_Engine name is given a bit (see Platform), and each package
+stores the names it requires as the masks os_mask, cpu_mask and engine_mask.
+The masks are recomputed whenever the documents of a package are refreshed,
+which already happens on any change to its requirements, so compatibility is
+a bitwise test against one indexed table.
+
+A package is compatible with a platform when, for each of os, cpu and engine,
+its mask is zero (it makes no assumptions) or shares a bit with the mask of
+the platform.
+"""
+
+# Imports #
+
+from django.db import connection
+from django.db.models import signals
+
+from models import *
+from bulk import bulk_update
+from documents import documents_refreshed
+
+# Constants #
+
+"""
+Each kind of requirement: its name, the mask field of Package, the many to 
+many field of System_Requirement and the vocabulary model.
+"""
+KINDS = (
+    ('os','os_mask','os',Operating_System),
+    ('cpu','cpu_mask','cpu',Cpu),
+    ('engine','engine_mask','engines',JavaScript_Engine),
+)
+
+# Bits #
+
+# Vocabulary model to a dictionary of name to bit.
+_bits = {}
+
+def bits(model):
+    """Get a dictionary of name to bit for a vocabulary model. The names are
+    cached until a row of the model is saved or deleted.
+    """
+    if model not in _bits:
+        _bits[model] = dict(model.objects.filter(bit__isnull=False).values_list('name','bit'))
+    return _bits[model]
+
+def mask(model,names):
+    """Encode a list of names as a mask. Unknown names are ignored, so a
+    platform no package has heard of has a mask of zero.
+    """
+    known = bits(model)
+    value = 0
+    for name in names:
+        if name in known: value |= 1 << known[name]
+    return value
+
+# Functions #
+
+def requirement_masks(requirement_ids):
+    """Get a dictionary of System_Requirement id to its (os, cpu, engine)
+    masks. One query per kind of requirement.
+    """
+    masks = dict([(pk,[0,0,0]) for pk in requirement_ids])
+    if not masks: return {}
+    for index,(kind,field,relation,model) in enumerate(KINDS):
+        m2m = System_Requirement._meta.get_field(relation)
+        source,target = m2m.m2m_field_name(),m2m.m2m_reverse_field_name()
+        rows = m2m.rel.through.objects.filter(**{'%s__in' %source: list(masks)})
+        for pk,bit in rows.values_list(source,'%s__bit' %target):
+            if bit is not None: masks[pk][index] |= 1 << bit
+    return dict([(pk,tuple(value)) for pk,value in masks.items()])
+
+def update_masks(ids):
+    """Recompute the stored masks of the given packages."""
+    ids = list(ids)
+    if not ids: return
+    packages = list(Package.objects.filter(pk__in=ids).values_list('pk','requirements','os_mask','cpu_mask','engine_mask'))
+    masks = requirement_masks(set([requirement for pk,requirement,os,cpu,engine in packages]))
+    rows = []
+    for pk,requirement,os,cpu,engine in packages:
+        value = masks.get(requirement,(0,0,0))
+        if value != (os,cpu,engine): rows.append(value + (pk,))
+    bulk_update(Package,('os_mask','cpu_mask','engine_mask'),rows)
+
+def compatible(packages=None,os=(),cpu=(),engine=()):
+    """Filter a Package queryset down to the packages that run on a platform
+    given as lists of os, cpu and engine names. A kind that is not given is
+    not filtered on.
+    """
+    if packages is None: packages = Package.objects.all()
+    qn = connection.ops.quote_name
+    wanted = {'os': os,'cpu': cpu,'engine': engine}
+    where = []
+    params = []
+    for kind,field,relation,model in KINDS:
+        if not wanted[kind]: continue
+        column = "%s.%s" %(qn(Package._meta.db_table),qn(field))
+        where.append("(%s = 0 OR (%s & %%s) != 0)" %(column,column))
+        params.append(mask(model,wanted[kind]))
+    if not where: return packages
+    return packages.extra(where=where,params=params)
+
+# Handlers #
+
+def documents_stored(sender,versions,**kwargs):
+    """Recompute the masks of the packages whose documents were refreshed."""
+    update_masks([pk for pk,name,version in versions])
+
+def vocabulary_changed(sender,**kwargs):
+    """Forget the cached bits of a vocabulary model."""
+    _bits.pop(sender,None)
+
+# Connections #
+
+documents_refreshed.connect(documents_stored,dispatch_uid='packageserver.platforms.refreshed')
+for kind,field,relation,model in KINDS:
+    uid = 'packageserver.platforms.%s' %model.__name__
+    signals.post_save.connect(vocabulary_changed,sender=model,dispatch_uid=uid)
+    signals.post_delete.connect(vocabulary_changed,sender=model,dispatch_uid=uid)
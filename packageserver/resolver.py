@@ -0,0 +1,176 @@
+"""
+Server-side resolution of transitive package dependencies.
+
+Rather than having clients fetch descriptors one at a time to find the
+dependencies of their dependencies, the registry walks Package.dependencies
+breadth first. Each level of the walk is loaded with one query against the
+intermediary table, so the number of queries grows with the depth of the graph
+rather than with the number of packages in it.
+
+Each edge keeps the range of versions it accepts, and the version given for a
+dependency is the best of its versions that every edge into it accepts, not
+its head version. The versions of the whole graph are loaded in one more
+query.
+"""
+
+# Imports #
+
+from django.utils.datastructures import SortedDict
+
+from models import Package, Package_Version
+import semver
+
+# Constants #
+
+"""
+The most ids given to a single IN clause. Older versions of SQLite allow at
+most 999 parameters per statement, so a very wide level is loaded in chunks.
+"""
+MAX_PARAMETERS = 500
+
+# Classes #
+
+class Resolver(object):
+    """Resolve the transitive dependencies of packages.
+
+    The edges of every package that has been expanded are remembered, so the
+    shared subgraphs of several packages resolved with the same Resolver are
+    only loaded once.
+
+        resolver = Resolver()
+        graph = resolver.resolve(package)
+    """
+    def __init__(self):
+        # Package id to a list of dependency ids, for expanded packages.
+        self.edges = {}
+        # Package id to a (name, version) tuple.
+        self.packages = {}
+        # (source id, target id) to the version range of the edge.
+        self.ranges = {}
+        # Package id to a sorted list of (version key, number) tuples.
+        self.versions = {}
+        self.queries = 0
+
+    def load(self,ids):
+        """Load the direct dependencies of the given packages, skipping any
+        that have already been expanded.
+        """
+        ids = [pk for pk in ids if pk not in self.edges]
+        for pk in ids: self.edges[pk] = []
+        through = Package.dependencies.through
+        for start in range(0,len(ids),MAX_PARAMETERS):
+            rows = through.objects.filter(from_package__in=ids[start:start+MAX_PARAMETERS])
+            rows = rows.values_list('from_package','to_package','to_package__name','to_package__version','version_range')
+            self.queries += 1
+            for source,target,name,version,version_range in rows:
+                self.edges[source].append(target)
+                self.packages[target] = (name,version)
+                self.ranges[(source,target)] = version_range
+
+    def load_versions(self,ids):
+        """Load the version keys of the given packages, skipping any that
+        have already been loaded.
+        """
+        ids = [pk for pk in ids if pk not in self.versions]
+        for pk in ids: self.versions[pk] = []
+        for start in range(0,len(ids),MAX_PARAMETERS):
+            rows = Package_Version.objects.filter(package__in=ids[start:start+MAX_PARAMETERS])
+            rows = rows.values_list('package','number','major','minor','patch','is_release','prerelease_key')
+            self.queries += 1
+            for pk,number,major,minor,patch,is_release,prerelease_key in rows:
+                self.versions[pk].append(((major,minor,patch,bool(is_release),prerelease_key),number))
+        for pk in ids: self.versions[pk].sort()
+
+    def pick(self,target,sources):
+        """Get the number of the best version of target that the edges from
+        each of the sources accept, or None if there is none. The first
+        range's option groups are preferred in order, as by Range.best().
+        Ranges that cannot be parsed accept every version.
+        """
+        ranges = []
+        for source in sources:
+            try:
+                ranges.append(semver.compile_range(self.ranges[(source,target)]))
+            except semver.RangeError:
+                pass
+        versions = self.versions.get(target,[])
+        if not ranges: return versions and versions[-1][1] or None
+        versions = [(key,number) for key,number in versions if all([version_range.match_key(key) for version_range in ranges[1:]])]
+        best = ranges[0].best([key for key,number in versions])
+        return best is not None and versions[best][1] or None
+
+    def walk(self,root):
+        """Expand the graph below root, one level at a time. Returns a list
+        of levels, each a list of the ids first reached at that depth.
+        """
+        levels = []
+        seen = set([root])
+        frontier = [root]
+        while frontier:
+            self.load(frontier)
+            level = []
+            for pk in frontier:
+                for target in self.edges[pk]:
+                    if target not in seen:
+                        seen.add(target)
+                        level.append(target)
+            if level: levels.append(level)
+            frontier = level
+        return levels
+
+    def cycles(self,root):
+        """Find the dependency cycles reachable from root. Each cycle is a
+        list of ids that starts and ends with the same package. The search
+        is iterative so that deep graphs do not hit the recursion limit.
+        """
+        cycles = []
+        state = {root: 1}
+        path = [root]
+        stack = [iter(self.edges.get(root,()))]
+        while stack:
+            for target in stack[-1]:
+                if state.get(target) == 1:
+                    cycles.append(path[path.index(target):] + [target])
+                elif target not in state:
+                    state[target] = 1
+                    path.append(target)
+                    stack.append(iter(self.edges.get(target,())))
+                    break
+            else:
+                state[path.pop()] = 2
+                stack.pop()
+        return cycles
+
+    def resolve(self,package):
+        """Resolve the complete dependency graph of a package. Returns a
+        dictionary suitable for JSON output with the direct dependencies of
+        every package in the graph and the ranges of versions they accept,
+        the packages first reached at each depth and any cycles found. The
+        version of the package itself is its head version; that of each
+        dependency is the best one the edges into it accept (see pick()), or
+        None if they accept none.
+        """
+        self.packages[package.pk] = (package.name,package.version)
+        levels = self.walk(package.pk)
+        name = lambda pk: self.packages[pk][0]
+        ids = [package.pk] + [pk for level in levels for pk in level]
+        self.load_versions(ids[1:])
+        sources = dict([(pk,[]) for pk in ids])
+        for pk in ids:
+            for target in self.edges.get(pk,()): sources[target].append(pk)
+
+        packages = SortedDict()
+        for pk in ids:
+            packages[name(pk)] = SortedDict([
+                ('version',pk == package.pk and package.version or self.pick(pk,sources[pk])),
+                ('dependencies',[name(target) for target in self.edges.get(pk,())]),
+                ('ranges',SortedDict([(name(target),self.ranges[(pk,target)]) for target in self.edges.get(pk,())])),
+            ])
+
+        graph = SortedDict()
+        graph['name'] = package.name
+        graph['version'] = package.version
+        graph['packages'] = packages
+        graph['levels'] = [[name(pk) for pk in level] for level in levels]
+        graph['cycles'] = [[name(pk) for pk in cycle] for cycle in self.cycles(package.pk)]
+        return graph
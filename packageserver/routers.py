@@ -0,0 +1,107 @@
+"""
+Read replica routing.
+
+Registry reads far outnumber writes. Views that only read (package documents,
+the catalog, search, ...) are wrapped in reads_from_replica, and the queries
+they make are sent to one of the REPLICA_DATABASES by the ReplicaRouter.
+Everything else, including all writes, the admin and publishing, uses the
+primary (default) database, so it always reads its own writes.
+
+A replica whose NAME is that of the primary, as a TEST_MIRROR is under test,
+is skipped in favor of the primary's own connection. So is an SQLite replica
+that is out of date, written less recently than the primary (see
+sync_replicas), so that reads never miss writes made since the last sync.
+
+This module is loaded while django.db is being imported, so it must not
+import anything from django.db at the top level. See databases.py for the
+handling of the connections themselves.
+"""
+
+# Imports #
+
+import os
+import random
+import threading
+
+from django.conf import settings
+from django.db.utils import DEFAULT_DB_ALIAS
+
+# Routing #
+
+_local = threading.local()
+
+def modified(name):
+    """The last time an SQLite database file or its write-ahead log was 
+    written, or None if there is no such file.
+    """
+    times = [os.path.getmtime(path) for path in (name,name + '-wal') if os.path.exists(path)]
+    return times and max(times) or None
+
+def replica_aliases():
+    """The aliases of the replicas that are separate from the primary and up
+    to date. An SQLite replica that has not been synced yet has no file, and
+    one older than the primary misses its latest writes; both are skipped.
+    """
+    from django.db import connections
+    aliases = []
+    for alias in getattr(settings,'REPLICA_DATABASES',()):
+        primary = connections[DEFAULT_DB_ALIAS].settings_dict
+        settings_dict = connections[alias].settings_dict
+        if settings_dict['NAME'] == primary['NAME']: continue
+        if settings_dict['ENGINE'].endswith('sqlite3'):
+            synced = modified(settings_dict['NAME'])
+            if synced is None: continue
+            if primary['ENGINE'].endswith('sqlite3') and synced < (modified(primary['NAME']) or 0): continue
+        aliases.append(alias)
+    return aliases
+
+def read_alias():
+    """The alias reads are sent to in this thread: the current replica, if
+    any, or else the primary.
+    """
+    return getattr(_local,'alias',None) or DEFAULT_DB_ALIAS
+
+class replica(object):
+    """Send the reads made inside a with block to a replica, picked once for
+    the block so that its reads see one consistent copy.
+
+        with replica():
+            ...
+    """
+    def __enter__(self):
+        aliases = replica_aliases()
+        self.previous = getattr(_local,'alias',None)
+        _local.alias = aliases and random.choice(aliases) or None
+        return self
+
+    def __exit__(self,*args):
+        _local.alias = self.previous
+
+def reads_from_replica(view):
+    """Decorate a view that only reads to have it read from a replica."""
+    def replicated(*args,**kwargs):
+        with replica():
+            return view(*args,**kwargs)
+    replicated.__name__ = view.__name__
+    replicated.__doc__ = view.__doc__
+    replicated.__module__ = view.__module__
+    return replicated
+
+# Routers #
+
+class ReplicaRouter(object):
+    """Route reads inside replica() to a replica and everything else to the
+    primary. Replicas are copies of the primary, so every relation is
+    allowed and tables are only created on the primary.
+    """
+    def db_for_read(self,model,**hints):
+        return read_alias()
+
+    def db_for_write(self,model,**hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self,obj1,obj2,**hints):
+        return True
+
+    def allow_syncdb(self,db,model):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,361 @@
+"""
+The package.json schema.
+
+The descriptor format is declared once below, as a tree of field types, and
+that declaration is compiled into functions: encoders that write a document
+in a single pass, with the keys of each object in schema order, and a
+validator for incoming descriptors. Compiling resolves every dispatch on
+field types ahead of time, so encoding a document is a walk over closures
+that join preformatted keys and escaped strings. Strings are escaped by the
+C accelerated function of the json module. Since the schema fixes the order
+of the keys, documents are built as plain dictionaries rather than
+SortedDicts, which cost more to build than the encoding itself.
+
+    PACKAGE.encode(data)                # compact
+    PACKAGE.encode(data,pretty=True)    # indented for people
+    DESCRIPTOR.validate(data)           # a list of error messages
+
+Keys that are not in the schema are left out of encoded documents and are
+not checked by the validator.
+
+See http://wiki.commonjs.org/wiki/Packages/1.1
+"""
+
+# Imports #
+
+import re
+
+try:
+    from json.encoder import encode_basestring_ascii
+except ImportError:
+    from django.utils.simplejson.encoder import encode_basestring_ascii
+
+import semver
+
+# Constants #
+
+INDENT = "  "
+
+NAME = re.compile(r'^[\w.-]+$')
+
+# Types #
+
+def _newline(level):
+    return "\n" + INDENT * level
+
+class Type(object):
+    """A field type. Subclasses build the encoder and validator functions of
+    the type. A compact encoder is called as encode(value) and a pretty one
+    as encode(value, level), where level is the depth of indentation; both
+    return JSON text. A validator is called as validate(value, path, errors)
+    and appends a message to errors for each problem.
+    """
+    # The Python types of the values of this type, used by Either.
+    python_types = ()
+
+    def encoder(self,pretty=False):
+        raise NotImplementedError
+
+    def validator(self):
+        raise NotImplementedError
+
+class String(Type):
+    """A string, optionally matching a pattern or passing a check function,
+    and at most max_length characters.
+    """
+    python_types = (basestring,)
+
+    def __init__(self,pattern=None,check=None,max_length=None,message="is not valid"):
+        self.pattern = pattern
+        self.check = check
+        self.max_length = max_length
+        self.message = message
+
+    def encoder(self,pretty=False):
+        if pretty: return lambda value,level: encode_basestring_ascii(value)
+        return encode_basestring_ascii
+
+    def validator(self):
+        pattern,check,max_length,message = self.pattern,self.check,self.max_length,self.message
+        def validate(value,path,errors):
+            if not isinstance(value,basestring):
+                errors.append("%s must be a string." %path)
+            elif max_length and len(value) > max_length:
+                errors.append("%s must be at most %s characters." %(path,max_length))
+            elif (pattern and not pattern.match(value)) or (check and not check(value)):
+                errors.append("%s %s: %r." %(path,message,value))
+        return validate
+
+class Boolean(Type):
+    python_types = (bool,)
+
+    def encoder(self,pretty=False):
+        def encode(value,level=None):
+            if value: return "true"
+            return "false"
+        return encode
+
+    def validator(self):
+        def validate(value,path,errors):
+            if not isinstance(value,bool): errors.append("%s must be true or false." %path)
+        return validate
+
+class Array(Type):
+    """A list of items of one type. With single, a lone item given in place
+    of a list is valid, as descriptors often do.
+    """
+    python_types = (list,tuple)
+
+    def __init__(self,item,single=False):
+        self.item = item
+        self.single = single
+
+    def encoder(self,pretty=False):
+        item = self.item.encoder(pretty)
+        if not pretty:
+            def encode(value):
+                return "[" + ",".join(map(item,value)) + "]"
+        else:
+            def encode(value,level):
+                if not value: return "[]"
+                inner = _newline(level + 1)
+                return "[" + inner + ("," + inner).join([item(entry,level + 1) for entry in value]) + _newline(level) + "]"
+        return encode
+
+    def validator(self):
+        item,single = self.item.validator(),self.single
+        def validate(value,path,errors):
+            if isinstance(value,(list,tuple)):
+                for i,entry in enumerate(value): item(entry,"%s[%s]" %(path,i),errors)
+            elif single:
+                item(value,path,errors)
+            else:
+                errors.append("%s must be a list." %path)
+        return validate
+
+class Map(Type):
+    """An object of arbitrary keys whose values are of one type, written in
+    the order of the dictionary.
+    """
+    python_types = (dict,)
+
+    def __init__(self,value):
+        self.value = value
+
+    def encoder(self,pretty=False):
+        item = self.value.encoder(pretty)
+        if not pretty:
+            def encode(value):
+                return "{" + ",".join([encode_basestring_ascii(key) + ":" + item(entry) for key,entry in value.items()]) + "}"
+        else:
+            def encode(value,level):
+                if not value: return "{}"
+                inner = _newline(level + 1)
+                entries = [encode_basestring_ascii(key) + ": " + item(entry,level + 1) for key,entry in value.items()]
+                return "{" + inner + ("," + inner).join(entries) + _newline(level) + "}"
+        return encode
+
+    def validator(self):
+        item = self.value.validator()
+        def validate(value,path,errors):
+            if not isinstance(value,dict):
+                errors.append("%s must be an object." %path)
+                return
+            for key,entry in value.items():
+                item(entry,"%s.%s" %(path,key),errors)
+        return validate
+
+class Object(Type):
+    """An object with the given fields, each a (key, type, required) tuple,
+    written in that order. Fields whose value is None are left out.
+    """
+    python_types = (dict,)
+
+    def __init__(self,*fields):
+        self.fields = fields
+
+    def extend(self,*fields):
+        """A copy of this object type with the given fields added, or
+        replacing the fields of the same keys.
+        """
+        replaced = dict([(field[0],field) for field in fields])
+        kept = [replaced.pop(field[0],field) for field in self.fields]
+        return Object(*(kept + [field for field in fields if field[0] in replaced]))
+
+    def encoder(self,pretty=False):
+        if not pretty:
+            fields = [(key,encode_basestring_ascii(key) + ":",kind.encoder()) for key,kind,required in self.fields]
+            def encode(value):
+                get = value.get
+                entries = []
+                for key,token,item in fields:
+                    entry = get(key)
+                    if entry is not None: entries.append(token + item(entry))
+                return "{" + ",".join(entries) + "}"
+        else:
+            fields = [(key,encode_basestring_ascii(key) + ": ",kind.encoder(True)) for key,kind,required in self.fields]
+            def encode(value,level):
+                get = value.get
+                entries = []
+                for key,token,item in fields:
+                    entry = get(key)
+                    if entry is not None: entries.append(token + item(entry,level + 1))
+                if not entries: return "{}"
+                inner = _newline(level + 1)
+                return "{" + inner + ("," + inner).join(entries) + _newline(level) + "}"
+        return encode
+
+    def validator(self):
+        fields = [(key,kind.validator(),required) for key,kind,required in self.fields]
+        def validate(value,path,errors):
+            if not isinstance(value,dict):
+                errors.append("%s must be an object." %path)
+                return
+            for key,item,required in fields:
+                entry = value.get(key)
+                if entry is None:
+                    if required: errors.append("%s.%s is required." %(path,key))
+                else:
+                    item(entry,"%s.%s" %(path,key),errors)
+        return validate
+
+class Either(Type):
+    """A value of any of the given types. The value is encoded and checked
+    as the first type whose Python types it is an instance of.
+    """
+    def __init__(self,*types):
+        self.types = types
+        self.python_types = tuple([t for kind in types for t in kind.python_types])
+
+    def encoder(self,pretty=False):
+        choices = [(kind.python_types,kind.encoder(pretty)) for kind in self.types]
+        def encode(value,*level):
+            for python_types,item in choices:
+                if isinstance(value,python_types): return item(value,*level)
+            raise TypeError("%r is not one of the types of the schema." %(value,))
+        return encode
+
+    def validator(self):
+        choices = [(kind.python_types,kind.validator()) for kind in self.types]
+        names = " or ".join([kind.__class__.__name__.lower() for kind in self.types])
+        def validate(value,path,errors):
+            for python_types,item in choices:
+                if isinstance(value,python_types): return item(value,path,errors)
+            errors.append("%s must be a %s." %(path,names))
+        return validate
+
+class Anything(Type):
+    """A value that is not checked, such as a flag given in any form. It 
+    cannot be encoded.
+    """
+    python_types = (object,)
+
+    def validator(self):
+        def validate(value,path,errors):
+            pass
+        return validate
+
+# Schemas #
+
+class Schema(object):
+    """A document type, whose encoder and validator are compiled when they
+    are first used.
+    """
+    def __init__(self,kind,name="package.json"):
+        self.kind = kind
+        self.name = name
+        self._compact = None
+        self._pretty = None
+        self._validate = None
+
+    def encode(self,value,pretty=False):
+        """Write value as JSON text, compact or indented."""
+        if pretty:
+            if self._pretty is None: self._pretty = self.kind.encoder(True)
+            return self._pretty(value,0)
+        if self._compact is None: self._compact = self.kind.encoder()
+        return self._compact(value)
+
+    def validate(self,value):
+        """Check value against the schema. Returns a list of error messages,
+        empty when the value is valid.
+        """
+        if self._validate is None: self._validate = self.kind.validator()
+        errors = []
+        self._validate(value,self.name,errors)
+        return errors
+
+PERSON_FIELDS = Object(
+    ('name',String(),True),
+    ('email',String(),False),
+    ('web',String(),False),
+)
+
+LICENSE_FIELDS = Object(
+    ('type',String(),True),
+    ('url',String(),False),
+)
+
+REPO_FIELDS = Object(
+    ('type',String(),True),
+    ('url',String(),True),
+    ('path',String(),False),
+)
+
+"""
+The package.json documents served by the registry, in the order their keys
+are written. See commonjs.py.
+"""
+PACKAGE_FIELDS = Object(
+    ('name',String(pattern=NAME,max_length=128,message="is not a valid package name"),True),
+    ('version',String(check=semver.is_valid,message="is not a valid version"),True),
+    ('description',String(),False),
+    ('keywords',Array(String()),False),
+    ('maintainers',Array(PERSON_FIELDS),False),
+    ('contributors',Array(PERSON_FIELDS),False),
+    ('bugs',Object(('mail',String(),False),('web',String(),False)),False),
+    ('licenses',Array(LICENSE_FIELDS),False),
+    ('repositories',Array(REPO_FIELDS),False),
+    ('dependencies',Map(String()),False),
+    ('implements',Array(String()),False),
+    ('os',Array(String()),False),
+    ('cpu',Array(String()),False),
+    ('engine',Array(String()),False),
+    ('scripts',Map(String()),False),
+    ('directories',Map(String()),False),
+    ('main',String(),False),
+    ('homepage',String(),False),
+    ('builtin',Boolean(),False),
+    ('checksums',Object(('md5',String(),True),('sha256',String(),True)),False),
+)
+
+"""
+Descriptors given to the registry, which may use the shorter forms the spec
+allows: a person or license as a string, a single value in place of a list,
+and the singular license, repository and engines keys. See importer.py.
+"""
+DESCRIPTOR_FIELDS = PACKAGE_FIELDS.extend(
+    ('keywords',Either(String(),Array(String())),False),
+    ('maintainers',Array(Either(String(),PERSON_FIELDS.extend(('url',String(),False))),single=True),False),
+    ('contributors',Array(Either(String(),PERSON_FIELDS.extend(('url',String(),False))),single=True),False),
+    ('bugs',Either(String(),Object(('mail',String(),False),('email',String(),False),('web',String(),False),('url',String(),False))),False),
+    ('licenses',Array(Either(String(),LICENSE_FIELDS),single=True),False),
+    ('license',Array(Either(String(),LICENSE_FIELDS),single=True),False),
+    ('repositories',Array(Either(String(),REPO_FIELDS.extend(('type',String(),False))),single=True),False),
+    ('repository',Array(Either(String(),REPO_FIELDS.extend(('type',String(),False))),single=True),False),
+    ('implements',Array(String(),single=True),False),
+    ('os',Array(String(),single=True),False),
+    ('cpu',Array(String(),single=True),False),
+    ('engine',Array(String(),single=True),False),
+    ('engines',Array(String(),single=True),False),
+    ('dependencies',Map(String(check=semver.is_valid_range,message="is not a valid version range")),False),
+    ('builtin',Anything(),False),
+    ('checksums',Anything(),False),
+)
+
+PACKAGE = Schema(PACKAGE_FIELDS)
+DESCRIPTOR = Schema(DESCRIPTOR_FIELDS)
+CONTACT = Schema(PERSON_FIELDS,"contact")
+LICENSE = Schema(LICENSE_FIELDS,"license")
+REPO = Schema(REPO_FIELDS,"repository")
+DIRECTORIES = Schema(Map(String()),"directories")
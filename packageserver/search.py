@@ -0,0 +1,175 @@
+"""
+Ranked full-text search over package names, titles, keywords and descriptions.
+
+Searching with LIKE '%term%' scans every package. Instead, packages are kept in
+an inverted index that is updated whenever a Package is saved or deleted:
+
+1. Under SQLite, when the FTS5 extension is available, the index is an FTS5
+virtual table keyed by package id and results are ranked with bm25(). The
+table is created by syncdb. Terms match as prefixes.
+
+2. Otherwise the index is the Search_Term table, which holds a weighted row for
+each distinct term of each package. Results are ranked by the summed weight of
+the matched terms. Terms must match exactly.
+
+Either way a search is one query against the index and one for the matching
+page of packages.
+"""
+
+# Imports #
+
+import re
+
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, connections, router, transaction
+from django.db.models import Count, Sum, signals
+
+from models import *
+
+# Constants #
+
+FTS_TABLE = "packageserver_package_search"
+
+"""
+Relative weight of a match in each indexed field, in the order the fields are
+given to FTS5.
+"""
+WEIGHTS = (
+    ('name',10),
+    ('title',5),
+    ('keywords',3),
+    ('description',1),
+)
+
+TERM = re.compile(r'\w+',re.UNICODE)
+
+# Index #
+
+# Database name to whether the FTS5 index is in use there.
+_use_fts = {}
+
+def create_fts_table(connection=connection):
+    """Create the FTS5 table if the database supports it. This is done when 
+    syncdb runs, since SQLite commits any open transaction before DDL.
+    """
+    if not connection.settings_dict['ENGINE'].endswith('sqlite3'): return
+    try:
+        cursor = connection.cursor()
+        # The prefix indexes speed up short prefix searches.
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s,prefix='2 3')" %(FTS_TABLE,",".join([field for field,weight in WEIGHTS])))
+        transaction.commit_unless_managed(using=connection.alias)
+    except DatabaseError:
+        transaction.rollback_unless_managed(using=connection.alias)
+    _use_fts.pop(connection.settings_dict['NAME'],None)
+
+def use_fts(connection=connection):
+    """Indicates whether the FTS5 index is in use on a database. Otherwise 
+    the Search_Term table is used.
+    """
+    name = connection.settings_dict['NAME']
+    if name not in _use_fts:
+        _use_fts[name] = False
+        if connection.settings_dict['ENGINE'].endswith('sqlite3'):
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s",[FTS_TABLE])
+            _use_fts[name] = cursor.fetchone() is not None
+    return _use_fts[name]
+
+def terms(text):
+    """Split text into lowercase search terms."""
+    if not text: return []
+    return [term.lower() for term in TERM.findall(text)]
+
+def index_packages(ids):
+    """Add the given packages to the index, replacing any existing entries."""
+    ids = list(ids)
+    if not ids: return
+    unindex_packages(ids)
+    rows = Package.objects.filter(pk__in=ids).values_list('pk',*[field for field,weight in WEIGHTS])
+    if use_fts():
+        cursor = connection.cursor()
+        cursor.executemany(
+            "INSERT INTO %s (rowid,%s) VALUES (%%s,%s)" %(FTS_TABLE,",".join([field for field,weight in WEIGHTS]),",".join(["%s"] * len(WEIGHTS))),
+            [[row[0]] + [value or "" for value in row[1:]] for row in rows],
+        )
+        transaction.commit_unless_managed()
+    else:
+        for row in rows:
+            scores = {}
+            for (field,weight),text in zip(WEIGHTS,row[1:]):
+                for term in terms(text):
+                    scores[term] = scores.get(term,0) + weight
+            for term,weight in scores.items():
+                Search_Term.objects.create(package_id=row[0],term=term[:64],weight=weight)
+
+def unindex_packages(ids):
+    """Remove the given packages from the index."""
+    ids = list(ids)
+    if not ids: return
+    if use_fts():
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s WHERE rowid IN (%s)" %(FTS_TABLE,",".join(["%s"] * len(ids))),ids)
+        transaction.commit_unless_managed()
+    else:
+        Search_Term.objects.filter(package__in=ids).delete()
+
+def rebuild_index():
+    """Index every package from scratch."""
+    if use_fts():
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s" %FTS_TABLE)
+        transaction.commit_unless_managed()
+    else:
+        Search_Term.objects.all().delete()
+    ids = list(Package.objects.values_list('pk',flat=True))
+    for start in range(0,len(ids),500):
+        index_packages(ids[start:start+500])
+
+# Search #
+
+def search(query,page=1,per_page=20):
+    """Search the index. Returns a list of (package id, score) tuples for
+    the requested page, best match first, and whether there is a next page.
+    One more row than needed is fetched to find out if there is a next page,
+    so the total number of matches is never counted.
+    """
+    words = terms(query)
+    if not words: return [],False
+    offset = (page - 1) * per_page
+    connection = connections[router.db_for_read(Package)]
+
+    if use_fts(connection):
+        match = " AND ".join(['"%s"*' %word for word in words])
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT rowid, bm25(%s,%s) AS rank FROM %s WHERE %s MATCH %%s ORDER BY rank LIMIT %%s OFFSET %%s" %(FTS_TABLE,",".join([str(float(weight)) for field,weight in WEIGHTS]),FTS_TABLE,FTS_TABLE),
+            [match,per_page + 1,offset],
+        )
+        # bm25() is lower for better matches.
+        results = [(pk,-rank) for pk,rank in cursor.fetchall()]
+    else:
+        words = list(set(words))
+        rows = Search_Term.objects.filter(term__in=words).values('package')
+        rows = rows.annotate(score=Sum('weight'),matched=Count('term')).filter(matched=len(words)).order_by('-score','package')
+        results = [(row['package'],row['score']) for row in rows[offset:offset + per_page + 1]]
+
+    return results[:per_page],len(results) > per_page
+
+# Handlers #
+
+def app_synced(sender,db=DEFAULT_DB_ALIAS,**kwargs):
+    """Create the FTS5 table along with the tables of the models."""
+    if sender.__name__ == Package.__module__ and router.allow_syncdb(db,Package): create_fts_table(connections[db])
+
+def package_saved(sender,instance,**kwargs):
+    """Keep the index current when a package is saved."""
+    index_packages([instance.pk])
+
+def package_deleted(sender,instance,**kwargs):
+    """Remove a deleted package from the index."""
+    unindex_packages([instance.pk])
+
+# Connections #
+
+signals.post_syncdb.connect(app_synced,dispatch_uid='packageserver.search.synced')
+signals.post_save.connect(package_saved,sender=Package,dispatch_uid='packageserver.search.saved')
+signals.post_delete.connect(package_deleted,sender=Package,dispatch_uid='packageserver.search.deleted')
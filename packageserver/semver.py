@@ -0,0 +1,261 @@
+"""
+Parsing of Semantic Versioning version strings and ranges.
+
+See http://semver.org/
+
+The CommonJS spec allows a version to be given as MAJOR[.MINOR[.PATCH]],
+optionally followed by a pre-release tag such as "1.0.0beta1" or
+"1.0.0-rc.2". Missing components are taken to be zero. Pre-release tags are
+ordered as semver.org has them: identifier by identifier, numbers by value
+and below words, and a tag below the longer ones it begins. prerelease_key()
+writes a tag as a string that sorts that way, which Package_Version stores
+so the database orders by it too.
+
+A dependency may instead give a range of versions. A range is one or more
+option groups separated by "||", in order of preference. Each group is "*"
+or empty for any version, a hyphen range such as "1.0 - 1.4", or a list of
+comparators that must all hold, such as ">=1.2.0 <2", "1.2.x", "~1.2.3" or
+"^0.3". Pre-releases sort below their release, and a bound on a release
+does not take in its pre-releases: "<2.0.0" excludes "2.0.0-rc.1".
+
+Ranges are compiled once into Range objects and cached by compile_range().
+Every comparator group reduces to a single interval of version keys (see
+key()), so a Range is a short list of intervals. Matching one version is a
+couple of tuple comparisons, and the versions of a package that satisfy a
+range are found by bisecting the sorted list of their keys, so the cost
+grows with the logarithm of the number of versions.
+"""
+
+# Imports #
+
+import re
+from bisect import bisect_left, bisect_right
+
+# Constants #
+
+VERSION = re.compile(r'^v?(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:-?([0-9A-Za-z][0-9A-Za-z.-]*))?(?:\+[0-9A-Za-z.-]+)?$')
+
+# A version in a range, whose missing or wildcard components match anything.
+PARTIAL = re.compile(r'^v?(\d+|[xX*])(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?(?:-?([0-9A-Za-z][0-9A-Za-z.-]*))?(?:\+[0-9A-Za-z.-]+)?$')
+
+COMPARATOR = re.compile(r'^(>=|<=|>|<|=|~>|~|\^)?\s*(\S+)$')
+
+HYPHEN = re.compile(r'^(\S+)\s+-\s+(\S+)$')
+
+# The most compiled ranges kept by compile_range().
+MAX_CACHED_RANGES = 10000
+
+# Functions #
+
+def parse(version):
+    """Parse a version string into a (major, minor, patch, prerelease)
+    tuple. The prerelease is an empty string for a release. Raises
+    ValueError if the string is not a valid version.
+    """
+    match = VERSION.match((version or "").strip())
+    if not match: raise ValueError("Invalid version: %r" %version)
+    major,minor,patch,prerelease = match.groups()
+    return (int(major),int(minor or 0),int(patch or 0),prerelease or "")
+
+def is_valid(version):
+    """Indicates the string is a valid version."""
+    try:
+        parse(version)
+    except ValueError:
+        return False
+    return True
+
+def prerelease_key(prerelease):
+    """A string that sorts pre-release tags in semver order. Numeric
+    identifiers are written with their length ahead of them, and below
+    words; identifiers are joined by a character below any they contain.
+    A release has an empty key.
+    """
+    if not prerelease: return ""
+    parts = []
+    for identifier in prerelease.split('.'):
+        if identifier.isdigit():
+            digits = identifier.lstrip('0') or '0'
+            parts.append('0%02d%s' %(len(digits),digits))
+        else:
+            parts.append('1' + identifier)
+    return '!'.join(parts)
+
+def key(major,minor,patch,prerelease=""):
+    """The sort key of a version, the same order as Package_VersionManager
+    uses: a pre-release sorts below its release.
+    """
+    return (major,minor,patch,not prerelease,prerelease_key(prerelease))
+
+def _first(major,minor,patch):
+    """The key below every pre-release of a version."""
+    return (major,minor,patch,False,"")
+
+# Ranges #
+
+class RangeError(ValueError):
+    """A version range that cannot be parsed."""
+
+class Range(object):
+    """A compiled version range: a list of (low, low inclusive, high, high
+    inclusive) intervals of version keys, one per option group, in order of
+    preference. A bound of None is open.
+
+        compile_range(">=1.2 <2 || 3.x").matches("1.4.0")
+    """
+    def __init__(self,text):
+        self.text = text
+        self.intervals = [_group(group.strip()) for group in text.split("||")]
+
+    def __repr__(self):
+        return "<Range %r>" %self.text
+
+    def match_key(self,version):
+        """Indicates the version key is in the range."""
+        for low,low_inclusive,high,high_inclusive in self.intervals:
+            if low is not None and (version < low or (version == low and not low_inclusive)): continue
+            if high is not None and (version > high or (version == high and not high_inclusive)): continue
+            return True
+        return False
+
+    def matches(self,version):
+        """Indicates the version string is in the range."""
+        try:
+            return self.match_key(key(*parse(version)))
+        except ValueError:
+            return False
+
+    def slices(self,keys):
+        """Get the (start, stop) slice of a sorted list of version keys that
+        each option group takes in, in order of preference.
+        """
+        slices = []
+        for low,low_inclusive,high,high_inclusive in self.intervals:
+            if low is None: start = 0
+            elif low_inclusive: start = bisect_left(keys,low)
+            else: start = bisect_right(keys,low)
+            if high is None: stop = len(keys)
+            elif high_inclusive: stop = bisect_right(keys,high)
+            else: stop = bisect_left(keys,high)
+            slices.append((start,max(start,stop)))
+        return slices
+
+    def select(self,keys):
+        """Get the indexes of the sorted version keys in the range, in
+        order.
+        """
+        selected = set()
+        for start,stop in self.slices(keys): selected.update(range(start,stop))
+        return sorted(selected)
+
+    def best(self,keys):
+        """Get the index of the highest of the sorted version keys in the
+        first option group that takes in any, or None.
+        """
+        for start,stop in self.slices(keys):
+            if stop > start: return stop - 1
+        return None
+
+def _partial(text):
+    """Parse a version of a range into its (major, minor, patch, prerelease)
+    with None for each missing or wildcard component.
+    """
+    match = PARTIAL.match(text)
+    if not match: raise RangeError("Invalid version in range: %r" %text)
+    parts = []
+    for part in match.groups()[:3]:
+        if part is None or part in "xX*" or (parts and parts[-1] is None): parts.append(None)
+        else: parts.append(int(part))
+    return parts + [match.group(4) or ""]
+
+def _bounds(major,minor,patch,prerelease):
+    """Get the keys of a partial version that bound a range: the key below
+    its pre-releases, its own key, and the key below every version above
+    those it stands for, or None when there is none. Missing components
+    are taken to be zero for the first two.
+    """
+    if major is None: return None,None,None
+    first = _first(major,minor or 0,patch or 0)
+    if prerelease: return first,key(major,minor or 0,patch or 0,prerelease),None
+    own = key(major,minor or 0,patch or 0)
+    if minor is None: return first,own,_first(major + 1,0,0)
+    if patch is None: return first,own,_first(major,minor + 1,0)
+    return first,own,_first(major,minor,patch + 1)
+
+def _comparator(operator,text):
+    """The (low, low inclusive, high, high inclusive) interval of one
+    comparator.
+    """
+    major,minor,patch,prerelease = _partial(text)
+    first,low,above = _bounds(major,minor,patch,prerelease)
+    if low is None:
+        # "*" and "x" with any operator but < match everything.
+        if operator == '<': return (None,True,_first(0,0,0),False)
+        return (None,True,None,True)
+    if operator in (None,'='):
+        if prerelease: return (low,True,low,True)
+        return (low,True,above,False)
+    if operator == '>=': return (low,True,None,True)
+    if operator == '<':
+        if prerelease: return (None,True,low,False)
+        return (None,True,first,False)
+    if operator == '>':
+        if prerelease: return (low,False,None,True)
+        return (above,True,None,True)
+    if operator == '<=':
+        if prerelease: return (None,True,low,True)
+        return (None,True,above,False)
+    if operator in ('~','~>'):
+        if minor is None: return (low,True,_first(major + 1,0,0),False)
+        return (low,True,_first(major,minor + 1,0),False)
+    if operator == '^':
+        if major or minor is None: high = _first(major + 1,0,0)
+        elif minor or patch is None: high = _first(0,minor + 1,0)
+        else: high = _first(0,0,patch + 1)
+        return (low,True,high,False)
+    raise RangeError("Invalid operator in range: %r" %operator)
+
+def _intersect(a,b):
+    """The intersection of two intervals."""
+    low,low_inclusive,high,high_inclusive = a
+    if b[0] is not None and (low is None or b[0] > low or (b[0] == low and not b[1])): low,low_inclusive = b[0],b[1]
+    if b[2] is not None and (high is None or b[2] < high or (b[2] == high and not b[3])): high,high_inclusive = b[2],b[3]
+    return (low,low_inclusive,high,high_inclusive)
+
+def _group(text):
+    """Compile one option group of a range into an interval."""
+    if text in ("","*","latest"): return (None,True,None,True)
+    match = HYPHEN.match(text)
+    if match:
+        low = _comparator('>=',match.group(1))
+        return _intersect(low,_comparator('<=',match.group(2)))
+    interval = (None,True,None,True)
+    # Allow a space between an operator and its version, as in ">= 1.0".
+    tokens = re.sub(r'(>=|<=|>|<|=|~>|~|\^)\s+',r'\1',text).split()
+    for token in tokens:
+        match = COMPARATOR.match(token)
+        if not match: raise RangeError("Invalid comparator in range: %r" %token)
+        interval = _intersect(interval,_comparator(match.group(1),match.group(2)))
+    return interval
+
+_ranges = {}
+
+def compile_range(text):
+    """Get the compiled Range of a range string, from the cache when it has
+    been compiled before. Raises RangeError if it is not a valid range.
+    """
+    text = (text or "").strip()
+    compiled = _ranges.get(text)
+    if compiled is None:
+        compiled = Range(text)
+        if len(_ranges) >= MAX_CACHED_RANGES: _ranges.clear()
+        _ranges[text] = compiled
+    return compiled
+
+def is_valid_range(text):
+    """Indicates the string is a valid version range."""
+    try:
+        compile_range(text)
+    except RangeError:
+        return False
+    return True
@@ -0,0 +1,81 @@
+"""
+A thread pool WSGI server for the registry.
+
+The registry's read views serve stored documents with one or two indexed
+queries (see documents.py), so a request spends most of its time waiting on
+the socket and the database rather than computing. A small pool of process
+workers, each holding a request for its full duration, leaves clients queued
+behind a few slow ones during install storms. This server instead accepts
+connections on one thread and hands them to a pool of worker threads, so many
+requests wait on I/O at once. Each worker keeps its own persistent database
+connection (see databases.py), and with SQLite in WAL mode readers do not
+block each other.
+
+    ./manage.py serve_registry 0.0.0.0:8000 --threads=64
+"""
+
+# Imports #
+
+import threading
+from Queue import Queue
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from django.core.handlers.wsgi import WSGIHandler
+
+# Classes #
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Handle a request without logging it to stderr, which would serialize
+    the workers on the log.
+    """
+    def log_message(self,format,*args):
+        pass
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """A WSGI server that handles connections on a fixed pool of threads.
+    Accepted connections wait in a queue for a free worker, so the pool
+    bounds the number of requests (and database connections) at once.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self,address,threads=16,handler=QuietRequestHandler):
+        WSGIServer.__init__(self,address,handler)
+        self.requests = Queue()
+        self.workers = []
+        for i in range(threads):
+            worker = threading.Thread(target=self.work,name="registry-worker-%s" %i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def process_request(self,request,client_address):
+        """Queue an accepted connection for the workers."""
+        self.requests.put((request,client_address))
+
+    def work(self):
+        """Handle queued connections until told to stop."""
+        while True:
+            item = self.requests.get()
+            if item is None: break
+            request,client_address = item
+            try:
+                self.finish_request(request,client_address)
+            except Exception:
+                self.handle_error(request,client_address)
+            self.shutdown_request(request)
+
+    def stop(self):
+        """Stop serving and let the workers finish the queued connections."""
+        self.shutdown()
+        for worker in self.workers: self.requests.put(None)
+        for worker in self.workers: worker.join()
+        self.server_close()
+
+# Functions #
+
+def make_server(host,port,threads=16,application=None):
+    """Create a ThreadPoolWSGIServer for the Django application."""
+    server = ThreadPoolWSGIServer((host,port),threads)
+    server.set_app(application or WSGIHandler())
+    return server
@@ -0,0 +1,13 @@
+-- The id of a change is its sequence number in the changes feed. Without
+-- AUTOINCREMENT SQLite reuses the id of the last row once it is deleted, as
+-- it is when the same version changes again, and a mirror or export that had
+-- seen that id would miss the new change. The table is empty when this runs.
+DROP TABLE packageserver_change;
+CREATE TABLE packageserver_change (
+    id integer NOT NULL PRIMARY KEY AUTOINCREMENT,
+    package_name varchar(128) NOT NULL,
+    version varchar(16) NOT NULL,
+    deleted bool NOT NULL,
+    created datetime NOT NULL,
+    UNIQUE (package_name, version)
+);
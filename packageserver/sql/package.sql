@@ -0,0 +1,17 @@
+-- Covers platform compatibility queries, which filter on the masks and page
+-- by name. See platforms.py.
+CREATE INDEX packageserver_package_platform ON packageserver_package (os_mask, cpu_mask, engine_mask, name);
+
+-- Serves the direct dependents of a package, which are read through the
+-- dependency table from the side of the package depended on. See
+-- dependents.py.
+CREATE INDEX packageserver_package_dependents ON packageserver_package_dependencies (to_package_id, from_package_id);
+
+-- Serves the browse API newest first, which pages by (updated, id). See
+-- browse.py.
+CREATE INDEX packageserver_package_updated ON packageserver_package (updated, id);
+
+-- Serve the packages of a maintainer or contributor, which are read through
+-- the intermediary tables from the side of the contact. See contacts.py.
+CREATE INDEX packageserver_package_maintainers_contact ON packageserver_package_maintainers (contact_id, package_id);
+CREATE INDEX packageserver_package_contributors_contact ON packageserver_package_contributors (contact_id, package_id);
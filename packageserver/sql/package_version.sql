@@ -0,0 +1,3 @@
+-- Serves the ordered list of versions of a package. The unique index on
+-- (package, is_release, major, minor, patch, prerelease_key) serves the latest.
+CREATE INDEX packageserver_package_version_ordered ON packageserver_package_version (package_id, major, minor, patch, is_release, prerelease_key);
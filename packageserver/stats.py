@@ -0,0 +1,205 @@
+"""
+Fetch and download statistics.
+
+Counting each request with an UPDATE would turn every read of the registry
+into a write, and on SQLite every writer waits for the one before it. Instead
+each process counts the documents and archives it serves in memory, by
+package, version and day, and a thread of its own adds the counts to the
+Daily_Stat rollups every STATS_FLUSH_INTERVAL seconds, or sooner once counts
+for STATS_MAX_PENDING rows are waiting. A flush is two statements however
+many requests it counts (see bulk.bulk_increment()), and the database adds to
+the stored counts, so any number of processes flush into the same rows
+without losing each other's counts. The stats views read only the rollups.
+
+Counts still in memory when a process exits are flushed on the way out, once
+the flusher thread has been stopped. Those of a process that is killed are
+lost, the price of not writing per request.
+"""
+
+# Imports #
+
+import atexit
+import os
+import threading
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Sum
+
+from models import Daily_Stat
+from bulk import bulk_increment
+
+# Constants #
+
+"""
+Seconds between flushes. Override with the STATS_FLUSH_INTERVAL setting.
+"""
+FLUSH_INTERVAL = 10.0
+
+"""
+Rollup rows whose counts may wait in memory before a flush is made early.
+Override with the STATS_MAX_PENDING setting.
+"""
+MAX_PENDING = 1000
+
+"""
+The counters of a Daily_Stat.
+"""
+FIELDS = ('fetches','downloads')
+
+KEYS = ('package_name','version','day')
+
+# Classes #
+
+class Aggregator(object):
+    """Counts kept in memory and flushed into the rollups in bulk. Counting
+    is safe from any thread. With an interval the counts are flushed by a
+    thread started on the first count, and otherwise only by flush().
+    """
+    def __init__(self,interval=None,max_pending=None):
+        self.interval = interval
+        self.max_pending = max_pending or MAX_PENDING
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = {}
+        self.pid = None
+        self.thread = None
+        self.stopping = False
+
+    def _check_process(self):
+        """Forget counts inherited from a parent process, which flushes them
+        itself, and the flusher thread, which is not inherited. Call with
+        the lock held.
+        """
+        pid = os.getpid()
+        if self.pid == pid: return
+        self.pid = pid
+        self.pending = {}
+        self.thread = None
+
+    def add(self,name,version,field,count=1):
+        """Count a fetch or a download of a package version today."""
+        index = FIELDS.index(field)
+        key = (name,version,date.today())
+        self.lock.acquire()
+        try:
+            self._check_process()
+            counts = self.pending.get(key)
+            if counts is None: counts = self.pending[key] = [0] * len(FIELDS)
+            counts[index] += count
+            if self.interval and self.thread is None and not self.stopping:
+                self.thread = threading.Thread(target=self.run,name="registry-stats")
+                self.thread.daemon = True
+                self.thread.start()
+            full = len(self.pending) >= self.max_pending
+        finally:
+            self.lock.release()
+        if full and self.thread: self.wake.set()
+
+    def take(self):
+        """Remove and return the pending counts, a dictionary of (package
+        name, version, day) to a list of counts in the order of FIELDS.
+        """
+        self.lock.acquire()
+        try:
+            self._check_process()
+            pending,self.pending = self.pending,{}
+        finally:
+            self.lock.release()
+        return pending
+
+    def restore(self,pending):
+        """Put counts that could not be flushed back for the next flush."""
+        self.lock.acquire()
+        try:
+            for key,counts in pending.items():
+                current = self.pending.setdefault(key,[0] * len(FIELDS))
+                for i,count in enumerate(counts): current[i] += count
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        """Add the pending counts to the rollups. Returns the number of rows
+        written. If the database fails, the counts are kept for the next
+        flush.
+        """
+        pending = self.take()
+        if not pending: return 0
+        rows = [key + tuple(counts) for key,counts in pending.items()]
+        try:
+            bulk_increment(Daily_Stat,KEYS,FIELDS,rows)
+        except DatabaseError:
+            transaction.rollback_unless_managed()
+            self.restore(pending)
+            return 0
+        return len(rows)
+
+    def run(self):
+        """Flush every interval, or when woken early, in the flusher thread,
+        until stopped.
+        """
+        while not self.stopping:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            if not self.stopping: self.flush()
+
+    def stop(self):
+        """Stop the flusher thread of this process, if it runs, and wait for
+        it to finish a flush it is making. Counts made afterwards are only
+        flushed by flush().
+        """
+        self.lock.acquire()
+        try:
+            self._check_process()
+            thread = self.thread
+            self.stopping = True
+        finally:
+            self.lock.release()
+        if thread is None: return
+        self.wake.set()
+        thread.join()
+
+aggregator = Aggregator(
+    interval=getattr(settings,'STATS_FLUSH_INTERVAL',FLUSH_INTERVAL),
+    max_pending=getattr(settings,'STATS_MAX_PENDING',MAX_PENDING),
+)
+
+# Functions #
+
+def count_fetch(name,version):
+    """Count a package.json document served."""
+    aggregator.add(name,version,'fetches')
+
+def count_download(name,version):
+    """Count an archive downloaded."""
+    aggregator.add(name,version,'downloads')
+
+def flush():
+    """Flush the counts of this process now."""
+    return aggregator.flush()
+
+def shutdown():
+    """Stop the flusher thread, which would otherwise still be waiting when
+    the interpreter is torn down, and flush what is left.
+    """
+    aggregator.stop()
+    return aggregator.flush()
+
+def package_stats(name,days=30):
+    """Get the counts of a package over the last number of days, today
+    included, from the rollups: its totals, a list of (day, fetches,
+    downloads) tuples, oldest first, for the days with any, and a
+    dictionary of version to (fetches, downloads).
+    """
+    since = date.today() - timedelta(days=days - 1)
+    rows = Daily_Stat.objects.filter(package_name=name,day__gte=since)
+    sums = {'total_fetches': Sum('fetches'),'total_downloads': Sum('downloads')}
+    daily = [(day,fetches or 0,downloads or 0) for day,fetches,downloads in rows.values('day').annotate(**sums).order_by('day').values_list('day','total_fetches','total_downloads')]
+    versions = dict([(version,(fetches or 0,downloads or 0)) for version,fetches,downloads in rows.values('version').annotate(**sums).order_by().values_list('version','total_fetches','total_downloads')])
+    totals = (sum([row[1] for row in daily]),sum([row[2] for row in daily]))
+    return totals,daily,versions
+
+# Connections #
+
+atexit.register(shutdown)
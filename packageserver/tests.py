@@ -5,7 +5,1320 @@ unittest). These will both pass when you run "manage.py test".
 Replace these with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+# Imports #
+
+import base64
+import gzip
+import hashlib
+import httplib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from StringIO import StringIO
+from datetime import date, datetime
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, IntegrityError, connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.utils.datastructures import SortedDict
+
+from models import *
+from commonjs import bulk_to_commonjs
+from documents import deferred
+from importer import Importer
+from resolver import Resolver
+import admin
+import archives
+import benchmarks
+import browse
+import contacts
+import export
+import instrumentation
+import routers
+import schema
+import server
+import stats
+import views
+import semver
+
+# Helpers #
+
+class QueryCounter(object):
+    """Count the queries issued inside a with block. The test runner turns
+    DEBUG off, so it is switched back on to have connection.queries recorded.
+    """
+    def __enter__(self):
+        self.debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        return self
+
+    def __exit__(self,*args):
+        self.count = len(connection.queries)
+        settings.DEBUG = self.debug
+
+def decompress(document_gzip):
+    """Decode and decompress a stored gzip document."""
+    return gzip.GzipFile(fileobj=StringIO(base64.b64decode(document_gzip))).read()
+
+def make_package(name,version="1.0.0",**kwargs):
+    """Create a package with a fresh (empty) set of system requirements."""
+    kwargs.setdefault('requirements',System_Requirement.objects.create())
+    kwargs.setdefault('description',"The %s package." %name)
+    return Package.objects.create(title=name.title(),name=name,version=version,**kwargs)
+
+def make_publisher(username="publisher",password="secret"):
+    """Create a user with permission to change packages."""
+    user = User.objects.create_user(username,"%s@example.com" %username,password)
+    user.user_permissions.add(Permission.objects.get(content_type__app_label='packageserver',codename='change_package'))
+    return user
+
+def basic_credentials(username="publisher",password="secret"):
+    return {'HTTP_AUTHORIZATION': "Basic %s" %base64.b64encode("%s:%s" %(username,password))}
+
+def make_related_package(name,index):
+    """Create a package with one row in each of its relations."""
+    package = make_package(name)
+    contact = Contact.objects.create(first_name="First%s" %index,last_name="Last",email="%s@example.com" %name)
+    package.maintainers.add(contact)
+    package.contributors.add(contact)
+    package.licenses.add(License.objects.create(title="MIT %s" %index,abbreviation="MIT",url="http://example.com/mit"))
+    package.repositories.add(Repo.objects.create(type="git",url="http://example.com/%s.git" %name))
+    package.implements.add(Specification.objects.create(title="Spec %s" %index,name="CommonJS/Spec%s" %index))
+    package.scripts.add(Script.objects.create(name="test-%s" %index,path="bin/test"))
+    package.directories.add(Directory.objects.create(name="doc",path="docs"))
+    package.requirements.os.add(Operating_System.objects.create(title="Linux %s" %index,name="linux%s" %index))
+    package.requirements.cpu.add(Cpu.objects.create(title="x86 %s" %index,name="x86_%s" %index))
+    package.requirements.engines.add(JavaScript_Engine.objects.create(title="Node %s" %index,name="node%s" %index))
+    return package
+
+# Tests #
+
+class BulkCommonJSTest(TestCase):
+    def setUp(self):
+        self.packages = [make_related_package("pkg%s" %i,i) for i in range(10)]
+        Dependency.objects.create(from_package=self.packages[1],to_package=self.packages[0],version_range="^1.0")
+
+    def test_query_count_is_fixed(self):
+        """The number of queries does not depend on the number of packages."""
+        with QueryCounter() as few:
+            bulk_to_commonjs(Package.objects.filter(pk__in=[p.pk for p in self.packages[:2]]))
+        with QueryCounter() as many:
+            bulk_to_commonjs(Package.objects.all())
+        self.assertEqual(few.count,many.count)
+        self.assertEqual(many.count,13)
+
+    def test_document(self):
+        data = json.loads(bulk_to_commonjs(Package.objects.all())[self.packages[1].pk])
+        self.assertEqual(data['name'],"pkg1")
+        self.assertEqual(data['maintainers'],[{"name": "First1 Last","email": "pkg1@example.com"}])
+        self.assertEqual(data['licenses'],[{"type": "MIT","url": "http://example.com/mit"}])
+        self.assertEqual(data['dependencies'],{"pkg0": "^1.0"})
+        self.assertEqual(data['os'],["linux1"])
+        self.assertEqual(data['directories'],{"doc": "docs"})
+        self.assertEqual(json.loads(self.packages[1].to_commonjs()),data)
+        self.assertEqual(json.loads(self.packages[1].to_commonjs(pretty=True)),data)
+
+class SchemaTest(TestCase):
+    def test_encode(self):
+        data = {"version": "1.0.0","name": "quoted","description": u'Says "hi"\n\u00e9',"keywords": [],"builtin": True,"main": None,
+                "dependencies": SortedDict([("b","1.0"),("a","2.0")])}
+        text = schema.PACKAGE.encode(data)
+        self.assertEqual(text,'{"name":"quoted","version":"1.0.0","description":"Says \\"hi\\"\\n\\u00e9","keywords":[],"dependencies":{"b":"1.0","a":"2.0"},"builtin":true}')
+        pretty = schema.PACKAGE.encode(data,pretty=True)
+        self.assertEqual(json.loads(pretty),json.loads(text))
+        self.assertEqual(pretty.splitlines()[:3],['{','  "name": "quoted",','  "version": "1.0.0",'])
+
+    def test_related_objects(self):
+        contact = Contact(first_name='A "B"',last_name="C",email="a@example.com")
+        self.assertEqual(json.loads(contact.to_commonjs()),{"name": 'A "B" C',"email": "a@example.com"})
+        self.assertEqual(json.loads(License(abbreviation="MIT",url="http://example.com/mit").to_commonjs()),{"type": "MIT","url": "http://example.com/mit"})
+        self.assertEqual(json.loads(Repo(type="git",url="http://example.com/x.git").to_commonjs()),{"type": "git","url": "http://example.com/x.git"})
+        self.assertEqual(json.loads(Directory(name="lib",path="src").to_commonjs()),{"lib": "src"})
+
+    def test_validate(self):
+        self.assertEqual(schema.DESCRIPTOR.validate({"name": "a","version": "1.0","license": "MIT","maintainers": "Ann <a@example.com>","os": "linux"}),[])
+        errors = schema.DESCRIPTOR.validate({"name": "a b","version": "one","maintainers": [{"email": "a@example.com"}],"dependencies": ["b"],"os": [1]})
+        self.assertEqual(errors,[
+            "package.json.name is not a valid package name: 'a b'.",
+            "package.json.version is not a valid version: 'one'.",
+            "package.json.maintainers[0].name is required.",
+            "package.json.dependencies must be an object.",
+            "package.json.os[0] must be a string.",
+        ])
+        self.assertEqual(schema.DESCRIPTOR.validate([]),["package.json must be an object."])
+        errors = schema.DESCRIPTOR.validate({"name": "a","version": "1.0","dependencies": {"b": "^1.2 || 2.x","c": ">>1"}})
+        self.assertEqual(errors,["package.json.dependencies.c is not a valid version range: '>>1'."])
+
+class StoredDocumentTest(TestCase):
+    def setUp(self):
+        self.package = make_related_package("stored",1)
+
+    def stored(self):
+        package = Package.objects.get(pk=self.package.pk)
+        return package.versions.get(number=package.version)
+
+    def document(self):
+        return json.loads(self.stored().document)
+
+    def test_saved_with_package(self):
+        self.package.description = "Changed."
+        self.package.save()
+        self.assertEqual(self.document()['description'],"Changed.")
+        stored = self.stored()
+        self.assertEqual(decompress(stored.document_gzip),stored.document)
+
+    def test_relation_changes(self):
+        contact = Contact.objects.create(first_name="New",last_name="Person")
+        self.package.maintainers.add(contact)
+        self.assertEqual(len(self.document()['maintainers']),2)
+        contact.first_name = "Renamed"
+        contact.save()
+        self.assertTrue({"name": "Renamed Person"} in self.document()['maintainers'])
+        contact.delete()
+        self.assertEqual(len(self.document()['maintainers']),1)
+        self.package.scripts.clear()
+        self.assertFalse('scripts' in self.document())
+
+    def test_requirement_changes(self):
+        cpu = Cpu.objects.create(title="ARM",name="arm")
+        cpu.system_requirement_set.add(self.package.requirements)
+        self.assertTrue("arm" in self.document()['cpu'])
+        cpu.name = "armv7"
+        cpu.save()
+        self.assertTrue("armv7" in self.document()['cpu'])
+
+    def test_dependency_changes(self):
+        dependency = make_package("dependency")
+        edge = Dependency.objects.create(from_package=self.package,to_package=dependency)
+        self.assertEqual(self.document()['dependencies'],{"dependency": "*"})
+        edge.version_range = ">=2.0.0"
+        edge.save()
+        self.assertEqual(self.document()['dependencies'],{"dependency": ">=2.0.0"})
+        dependency.name = "renamed"
+        dependency.save()
+        self.assertEqual(self.document()['dependencies'],{"renamed": ">=2.0.0"})
+        edge.delete()
+        self.assertEqual(self.document()['dependencies'],{})
+
+    def test_view_serves_stored_document(self):
+        response = self.client.get("/registry/stored/")
+        self.assertEqual(response.status_code,200)
+        self.assertEqual(response.content,self.stored().document)
+        with QueryCounter() as queries:
+            self.client.get("/registry/stored/1.0.0/")
+        self.assertEqual(queries.count,2)
+        self.assertEqual(self.client.get("/registry/stored/9.9.9/").status_code,404)
+        self.assertEqual(self.client.get("/registry/missing/").status_code,404)
+
+class ConditionalPackageTest(TestCase):
+    def setUp(self):
+        self.package = make_related_package("conditional",1)
+
+    def test_etag(self):
+        response = self.client.get("/registry/conditional/")
+        etag = response['ETag']
+        with QueryCounter() as queries:
+            response = self.client.get("/registry/conditional/",HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,304)
+        self.assertEqual(queries.count,1)
+        self.package.description = "Changed."
+        self.package.save()
+        response = self.client.get("/registry/conditional/",HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code,200)
+        self.assertNotEqual(response['ETag'],etag)
+
+    def test_last_modified(self):
+        response = self.client.get("/registry/conditional/")
+        response = self.client.get("/registry/conditional/",HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code,304)
+
+    def test_gzip(self):
+        plain = self.client.get("/registry/conditional/")
+        response = self.client.get("/registry/conditional/",HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response['Content-Encoding'],"gzip")
+        self.assertEqual(response['Vary'],"Accept-Encoding")
+        self.assertNotEqual(response['ETag'],plain['ETag'])
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(response.content)).read(),plain.content)
+
+    def test_gzip_refused(self):
+        for header in ("gzip;q=0","x-gzip; q=0.0, deflate","*;q=1, gzip;q=0","identity",""):
+            response = self.client.get("/registry/conditional/",HTTP_ACCEPT_ENCODING=header)
+            self.assertFalse(response.has_header('Content-Encoding'),header)
+        for header in ("gzip;q=0.5","deflate, *","X-GZIP;q=1"):
+            response = self.client.get("/registry/conditional/",HTTP_ACCEPT_ENCODING=header)
+            self.assertEqual(response['Content-Encoding'],"gzip",header)
+
+class SemverTest(TestCase):
+    def test_parse(self):
+        self.assertEqual(semver.parse("1.2.3"),(1,2,3,""))
+        self.assertEqual(semver.parse("1.2"),(1,2,0,""))
+        self.assertEqual(semver.parse("1.0.0beta1"),(1,0,0,"beta1"))
+        self.assertEqual(semver.parse("2.0.0-rc.1"),(2,0,0,"rc.1"))
+        self.assertRaises(ValueError,semver.parse,"one")
+
+    def test_prerelease_order(self):
+        """Pre-releases sort as semver.org orders them."""
+        versions = ["1.0.0-alpha","1.0.0-alpha.1","1.0.0-alpha.beta","1.0.0-beta","1.0.0-beta.2","1.0.0-beta.10","1.0.0-beta.11.1","1.0.0-beta-x","1.0.0-rc.1","1.0.0"]
+        keys = [semver.key(*semver.parse(version)) for version in versions]
+        self.assertEqual(sorted(keys),keys)
+        self.assertEqual(semver.prerelease_key("beta.010"),semver.prerelease_key("beta.10"))
+
+    def test_ranges(self):
+        cases = (
+            ("*",("0.1.0","2.0.0-rc.1"),()),
+            ("1.2.x",("1.2.0","1.2.9"),("1.2.0beta1","1.3.0")),
+            (">=1.2.0 <2",("1.2.0","1.99.0"),("1.1.9","2.0.0-rc.1","2.0.0")),
+            ("~1.2.3",("1.2.3","1.2.10"),("1.2.2","1.3.0")),
+            ("^0.3",("0.3.0","0.3.7"),("0.4.0",)),
+            ("^1.2.3",("1.2.3","1.9.0"),("1.2.3-rc.1","2.0.0")),
+            ("1.0 - 1.4",("1.0.0","1.4.9"),("1.5.0",)),
+            ("<1.0.0 || >= 3",("0.9.0","3.1.0"),("1.0.0","2.5.0")),
+        )
+        for text,included,excluded in cases:
+            version_range = semver.compile_range(text)
+            for version in included: self.assertTrue(version_range.matches(version),(text,version))
+            for version in excluded: self.assertFalse(version_range.matches(version),(text,version))
+        self.assertTrue(semver.compile_range("1.x") is semver.compile_range(" 1.x "))
+        self.assertFalse(semver.is_valid_range(">>1"))
+        self.assertFalse(semver.is_valid_range("1.2.3 - "))
+
+    def test_select(self):
+        versions = ["0.9.0","1.0.0-rc.1","1.0.0","1.1.0","2.0.0","3.0.0"]
+        keys = [semver.key(*semver.parse(version)) for version in versions]
+        version_range = semver.compile_range("^1.0.0 || >=2")
+        self.assertEqual([versions[i] for i in version_range.select(keys)],["1.0.0","1.1.0","2.0.0","3.0.0"])
+        # The first option group that matches is preferred.
+        self.assertEqual(versions[version_range.best(keys)],"1.1.0")
+        self.assertEqual(semver.compile_range("4.x").best(keys),None)
+
+    def test_select_prereleases(self):
+        """Ranges take in pre-releases with multi-digit numbers in order."""
+        versions = ["1.0.0-beta.2","1.0.0-beta.3","1.0.0-beta.10","1.0.0-beta.21","1.0.0"]
+        keys = [semver.key(*semver.parse(version)) for version in versions]
+        self.assertEqual([versions[i] for i in semver.compile_range(">=1.0.0-beta.3 <1.0.0-beta.30").select(keys)],versions[1:4])
+        self.assertEqual([versions[i] for i in semver.compile_range(">1.0.0-beta.3 <=1.0.0-beta.10").select(keys)],["1.0.0-beta.10"])
+        self.assertEqual(versions[semver.compile_range("<1.0.0-beta.21").best(keys)],"1.0.0-beta.10")
+
+class PackageVersionTest(TestCase):
+    def setUp(self):
+        self.package = make_package("versioned",version="1.2.0")
+        for number in ("1.10.0","1.9.3","2.0.0beta1","1.2.0beta2"):
+            self.package.version = number
+            self.package.save()
+
+    def test_latest_release(self):
+        with QueryCounter() as queries:
+            self.assertEqual(Package_Version.objects.latest_version("versioned").number,"1.10.0")
+        self.assertEqual(queries.count,1)
+        self.assertEqual(json.loads(self.client.get("/registry/versioned/").content)['version'],"1.10.0")
+
+    def test_latest_prerelease(self):
+        make_package("unreleased",version="0.1.0alpha")
+        self.assertEqual(Package_Version.objects.latest_version("unreleased").number,"0.1.0alpha")
+        self.assertEqual(Package_Version.objects.latest_version("missing"),None)
+
+    def test_prerelease_order(self):
+        package = make_package("beta",version="1.0.0-beta.2")
+        for number in ("1.0.0-beta.10","1.0.0-beta.9","1.0.0-beta"):
+            package.version = number
+            package.save()
+        self.assertEqual(Package_Version.objects.latest_version("beta").number,"1.0.0-beta.10")
+        self.assertEqual(json.loads(self.client.get("/registry/beta/").content)['version'],"1.0.0-beta.10")
+        response = self.client.get("/registry/beta/versions/")
+        self.assertEqual(json.loads(response.content)['versions'],["1.0.0-beta","1.0.0-beta.2","1.0.0-beta.9","1.0.0-beta.10"])
+        data = json.loads(self.client.get("/registry/beta/versions/",{"range": ">=1.0.0-beta.3"}).content)
+        self.assertEqual((data['versions'],data['best']),(["1.0.0-beta.9","1.0.0-beta.10"],"1.0.0-beta.10"))
+
+    def test_versions_are_kept(self):
+        response = self.client.get("/registry/versioned/1.9.3/")
+        self.assertEqual(json.loads(response.content)['version'],"1.9.3")
+        response = self.client.get("/registry/versioned/versions/")
+        self.assertEqual(json.loads(response.content)['versions'],["1.2.0beta2","1.2.0","1.9.3","1.10.0","2.0.0beta1"])
+
+    def test_versions_in_range(self):
+        response = self.client.get("/registry/versioned/versions/",{"range": ">=1.2 <2"})
+        data = json.loads(response.content)
+        self.assertEqual(data['versions'],["1.2.0","1.9.3","1.10.0"])
+        self.assertEqual(data['best'],"1.10.0")
+        data = json.loads(self.client.get("/registry/versioned/versions/",{"range": "3.x"}).content)
+        self.assertEqual((data['versions'],data['best']),([],None))
+        self.assertEqual(self.client.get("/registry/versioned/versions/",{"range": ">>1"}).status_code,400)
+        self.assertEqual(self.client.get("/registry/missing/versions/",{"range": "*"}).status_code,404)
+
+    def test_respelled(self):
+        """A version is found, and kept, under any spelling of its number."""
+        self.assertEqual(json.loads(self.client.get("/registry/versioned/1.9.3/").content)['version'],"1.9.3")
+        self.assertEqual(json.loads(self.client.get("/registry/versioned/v1.10/").content)['version'],"1.10.0")
+        self.assertEqual(self.client.get("/registry/versioned/1.9/").status_code,404)
+        self.assertEqual(self.client.get("/registry/versioned/x.y/").status_code,404)
+        for number in ("v2.0.0beta1","2.0.0-beta1+b5"):
+            self.package.version = number
+            self.package.save()
+            self.assertEqual(self.package.versions.count(),5)
+            self.assertEqual(json.loads(self.client.get("/registry/versioned/2.0.0beta1/").content)['version'],number)
+
+class ResolverTest(TestCase):
+    def setUp(self):
+        # a -> b, c; b -> d; c -> d; d -> e
+        self.packages = dict([(name,make_package(name)) for name in "abcde"])
+        for source,targets in (("a","bc"),("b","d"),("c","d"),("d","e")):
+            for target in targets: Dependency.objects.create(from_package=self.packages[source],to_package=self.packages[target])
+
+    def test_dependencies_are_directed(self):
+        self.assertEqual(list(self.packages['b'].dependencies.values_list('name',flat=True)),["d"])
+        self.assertEqual(sorted(self.packages['d'].dependents.values_list('name',flat=True)),["b","c"])
+
+    def test_resolve(self):
+        resolver = Resolver()
+        graph = resolver.resolve(self.packages['a'])
+        self.assertEqual(graph['levels'],[["b","c"],["d"],["e"]])
+        self.assertEqual(graph['packages']['d'],{"version": "1.0.0","dependencies": ["e"],"ranges": {"e": "*"}})
+        self.assertEqual(graph['cycles'],[])
+        self.assertEqual(resolver.queries,5)
+        # The subgraph below b has already been expanded.
+        resolver.resolve(self.packages['b'])
+        self.assertEqual(resolver.queries,5)
+
+    def test_ranges(self):
+        """A dependency is given the best version every edge into it
+        accepts rather than its head version.
+        """
+        for number in ("1.1.0","2.0.0-beta.2","2.0.0"):
+            self.packages['d'].version = number
+            self.packages['d'].save()
+        Dependency.objects.filter(to_package=self.packages['d']).update(version_range="^1.0")
+        graph = Resolver().resolve(self.packages['a'])
+        self.assertEqual(graph['packages']['d']['version'],"1.1.0")
+        self.assertEqual(graph['packages']['b']['ranges'],{"d": "^1.0"})
+        Dependency.objects.filter(from_package=self.packages['c']).update(version_range="1.0.0 || >=2.0.0-beta.1")
+        self.assertEqual(Resolver().resolve(self.packages['a'])['packages']['d']['version'],"1.0.0")
+        Dependency.objects.filter(from_package=self.packages['b']).update(version_range=">=3")
+        self.assertEqual(Resolver().resolve(self.packages['a'])['packages']['d']['version'],None)
+
+    def test_cycles(self):
+        Dependency.objects.create(from_package=self.packages['e'],to_package=self.packages['b'])
+        graph = Resolver().resolve(self.packages['a'])
+        self.assertEqual(graph['cycles'],[["b","d","e","b"]])
+
+    def test_view(self):
+        response = self.client.get("/registry/a/dependencies/")
+        self.assertEqual(sorted(json.loads(response.content)['packages']),list("abcde"))
+        self.assertEqual(self.client.get("/registry/z/dependencies/").status_code,404)
+
+class DependentsTest(TestCase):
+    def setUp(self):
+        # a -> b, c; b -> d; c -> d; d -> e
+        self.packages = dict([(name,make_package(name)) for name in "abcde"])
+        for source,targets in (("a","bc"),("b","d"),("c","d"),("d","e")):
+            for target in targets: Dependency.objects.create(from_package=self.packages[source],to_package=self.packages[target])
+
+    def counts(self):
+        return dict([(name,(direct,transitive)) for name,direct,transitive in Package.objects.values_list('name','dependent_count','transitive_dependent_count')])
+
+    def test_counts(self):
+        self.assertEqual(self.counts(),{"a": (0,0),"b": (1,1),"c": (1,1),"d": (2,3),"e": (1,4)})
+        Dependency.objects.filter(from_package=self.packages['c'],to_package=self.packages['d']).delete()
+        self.assertEqual(self.counts()['e'],(1,3))
+        with deferred():
+            Dependency.objects.filter(from_package=self.packages['b']).delete()
+        self.assertEqual(self.counts()['e'],(1,1))
+        self.packages['b'].delete()
+        self.assertEqual(self.counts()['e'],(1,1))
+        self.packages['a'].delete()
+        self.assertEqual(self.counts(),{"c": (0,0),"d": (0,0),"e": (1,1)})
+
+    def test_cycle(self):
+        Dependency.objects.create(from_package=self.packages['e'],to_package=self.packages['b'])
+        self.assertEqual(self.counts()['e'],(1,4))
+        self.assertEqual(self.counts()['b'],(2,4))
+
+    def test_view(self):
+        data = json.loads(self.client.get("/registry/d/dependents/",{"limit": 1}).content)
+        self.assertEqual((data['dependents'],data['transitive_dependents']),(2,3))
+        self.assertEqual([row['name'] for row in data['results']],["b"])
+        data = json.loads(self.client.get("/registry/d/dependents/",{"limit": 1,"after": data['next']}).content)
+        self.assertEqual([row['name'] for row in data['results']],["c"])
+        self.assertEqual(data['next'],None)
+        self.assertEqual(self.client.get("/registry/z/dependents/").status_code,404)
+
+    def test_import(self):
+        importer = Importer()
+        importer.import_batch([("f",{"name": "f","version": "1.0.0","dependencies": {"e": "1.0.0"}})])
+        importer.finish()
+        self.assertEqual(self.counts()['e'],(2,5))
+
+class ContactsTest(TestCase):
+    def setUp(self):
+        self.ann = Contact.objects.create(first_name="Ann",last_name="Smith",email=" Ann@Example.com")
+        self.bob = Contact.objects.create(first_name="Bob",last_name="Jones",email="bob@example.com")
+        self.packages = [make_package("pkg%s" %i) for i in range(5)]
+        for package in self.packages: package.maintainers.add(self.ann)
+        self.packages[0].contributors.add(self.ann,self.bob)
+
+    def counts(self,contact):
+        return Contact.objects.filter(pk=contact.pk).values_list('maintained_count','contributed_count')[0]
+
+    def test_email_is_unique(self):
+        self.assertEqual(self.ann.email_key,"ann@example.com")
+        self.assertEqual(contacts.get_contact("ANN@example.com"),self.ann)
+        duplicate = Contact(first_name="A",last_name="S",email="ann@EXAMPLE.com")
+        self.assertRaises(ValidationError,duplicate.clean)
+        self.assertRaises(IntegrityError,duplicate.save)
+
+    def test_counts(self):
+        self.assertEqual((self.counts(self.ann),self.counts(self.bob)),((5,1),(0,1)))
+        self.packages[1].maintainers.remove(self.ann)
+        self.bob.package_maintainers.add(self.packages[2],self.packages[3])
+        self.assertEqual((self.counts(self.ann),self.counts(self.bob)),((4,1),(2,1)))
+        self.packages[0].contributors.clear()
+        self.ann.package_maintainers.clear()
+        self.assertEqual((self.counts(self.ann),self.counts(self.bob)),((0,0),(2,0)))
+        self.packages[2].delete()
+        self.assertEqual(self.counts(self.bob),(1,0))
+
+    def test_directory(self):
+        Contact.objects.create(first_name="No",last_name="Email")
+        data = json.loads(self.client.get("/registry/-/maintainers/",{"limit": 1}).content)
+        self.assertEqual(data['results'],[{"name": "Ann Smith","email": " Ann@Example.com","web": None,"maintains": 5,"contributes": 1}])
+        data = json.loads(self.client.get("/registry/-/maintainers/",{"after": data['next']}).content)
+        self.assertEqual([row['name'] for row in data['results']],["Bob Jones"])
+        self.assertEqual(data['next'],None)
+
+    def test_packages(self):
+        data = json.loads(self.client.get("/registry/-/maintainers/ANN@example.com/",{"limit": 3}).content)
+        self.assertEqual((data['maintains'],data['role']),(5,"maintainer"))
+        self.assertEqual([row['name'] for row in data['results']],["pkg0","pkg1","pkg2"])
+        data = json.loads(self.client.get("/registry/-/maintainers/ann@example.com/",{"limit": 3,"after": data['next']}).content)
+        self.assertEqual([row['name'] for row in data['results']],["pkg3","pkg4"])
+        self.assertEqual(data['next'],None)
+        data = json.loads(self.client.get("/registry/-/maintainers/bob@example.com/",{"role": "contributor"}).content)
+        self.assertEqual(data['results'],[{"name": "pkg0","version": "1.0.0"}])
+        self.assertEqual(self.client.get("/registry/-/maintainers/bob@example.com/",{"role": "owner"}).status_code,400)
+        self.assertEqual(self.client.get("/registry/-/maintainers/nobody@example.com/").status_code,404)
+
+    def test_merge_duplicates(self):
+        # Contacts from before addresses were unique.
+        Contact.objects.all().update(email_key=None)
+        Contact.objects.filter(pk=self.bob.pk).update(email="ANN@example.com")
+        self.packages[1].contributors.add(self.bob)
+        self.assertEqual(contacts.merge_duplicates(),1)
+        self.assertEqual(list(Contact.objects.values_list('pk','email_key')),[(self.ann.pk,"ann@example.com")])
+        self.assertEqual(self.counts(self.ann),(5,2))
+        data = json.loads(self.packages[1].versions.get().document)
+        self.assertEqual([person['name'] for person in data['contributors']],["Ann Smith"])
+
+class SearchTest(TestCase):
+    def setUp(self):
+        make_package("parser",keywords="json, text")
+        make_package("jsonkit",description="Tools.")
+        make_package("textual",description="Reads JSON from a file.")
+        make_package("unrelated")
+
+    def names(self,query,**kwargs):
+        results,has_next = search.search(query,**kwargs)
+        return [Package.objects.get(pk=pk).name for pk,score in results]
+
+    def test_ranked(self):
+        self.assertEqual(self.names("json"),["jsonkit","parser","textual"])
+        self.assertEqual(self.names("json tools"),["jsonkit"])
+        self.assertEqual(self.names("nothing"),[])
+
+    def test_pages(self):
+        self.assertEqual(self.names("json",per_page=2,page=2),["textual"])
+        self.assertEqual(search.search("json",per_page=2)[1],True)
+        self.assertEqual(search.search("json",per_page=3)[1],False)
+
+    def test_index_is_current(self):
+        package = Package.objects.get(name="unrelated")
+        package.description = "Now with JSON."
+        package.save()
+        self.assertTrue("unrelated" in self.names("json"))
+        package.delete()
+        self.assertFalse("unrelated" in self.names("json"))
+
+    def test_term_table(self):
+        name = connection.settings_dict['NAME']
+        use_fts = search._use_fts.get(name)
+        search._use_fts[name] = False
+        try:
+            search.rebuild_index()
+            self.assertEqual(self.names("json"),["parser","textual"])
+            self.assertEqual(self.names("json text"),["parser"])
+        finally:
+            search._use_fts[name] = use_fts
+
+    def test_view(self):
+        data = json.loads(self.client.get("/registry/-/search/",{"q": "json"}).content)
+        self.assertEqual([row['name'] for row in data['results']],["jsonkit","parser","textual"])
+        self.assertEqual(data['next'],None)
+        self.assertEqual(self.client.get("/registry/-/search/",{"q": "json","page": "x"}).status_code,400)
+
+class CatalogTest(TestCase):
+    def setUp(self):
+        for name in ("gamma","alpha","beta","delta","epsilon"):
+            make_package(name)
+        self.chunk = views.CATALOG_CHUNK
+        views.CATALOG_CHUNK = 2
+
+    def tearDown(self):
+        views.CATALOG_CHUNK = self.chunk
+
+    def test_streamed_in_chunks(self):
+        response = self.client.get("/registry/")
+        with QueryCounter() as queries:
+            content = "".join(response)
+        self.assertEqual(queries.count,3)
+        data = json.loads(content)
+        self.assertEqual(sorted(data),["alpha","beta","delta","epsilon","gamma"])
+        self.assertEqual(data['beta']['version'],"1.0.0")
+
+    def test_empty(self):
+        Package.objects.all().delete()
+        self.assertEqual(json.loads("".join(self.client.get("/registry/"))),{})
+
+class BatchTest(TestCase):
+    def setUp(self):
+        for name in ("alpha","beta","gamma","delta"):
+            package = make_package(name)
+        package.version = "1.1.0"
+        package.save()
+
+    def fetch(self,specs,**kwargs):
+        response = self.client.post("/registry/-/batch/",json.dumps(specs),content_type="application/json",**kwargs)
+        return response.status_code,"".join(response)
+
+    def test_documents(self):
+        status,content = self.fetch(["alpha","delta","delta@1.0","missing","beta@2.0.0","alpha"])
+        self.assertEqual(status,200)
+        data = json.loads(content)
+        self.assertEqual(sorted(data['packages']),["alpha","delta","delta@1.0"])
+        self.assertEqual(data['packages']['delta']['version'],"1.1.0")
+        self.assertEqual(data['packages']['delta@1.0']['version'],"1.0.0")
+        self.assertEqual(data['missing'],["missing","beta@2.0.0"])
+        response = self.client.get("/registry/-/batch/",{"packages": "gamma,beta"})
+        self.assertEqual(sorted(json.loads("".join(response))['packages']),["beta","gamma"])
+
+    def test_ndjson(self):
+        status,content = self.fetch(["beta","missing"],HTTP_ACCEPT="application/x-ndjson")
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(lines[0]['name'],"beta")
+        self.assertEqual(lines[1],{"error": "not_found","package": "missing"})
+        response = self.client.get("/registry/-/batch/",{"packages": "alpha","format": "ndjson"})
+        self.assertEqual(response['Content-Type'],"application/x-ndjson")
+
+    def test_query_count(self):
+        """A chunk reads the ids of the packages, the versions asked for and
+        the latest version of each package named without one, however many
+        versions the packages have.
+        """
+        with QueryCounter() as few:
+            self.fetch(["alpha","beta@1.0.0"])
+        package = Package.objects.get(name="alpha")
+        for number in ["1.%s.0" %i for i in range(1,20)] + ["2.0.0-beta.1","1.0.0-rc.1"]:
+            package.version = number
+            package.save()
+        with QueryCounter() as many:
+            status,content = self.fetch(["alpha","beta@1.0.0","delta@1.0.0","alpha@1.0.0-rc.1","alpha@v1.5"])
+        self.assertEqual(few.count,3)
+        self.assertEqual(many.count,3)
+        data = json.loads(content)
+        self.assertEqual(data['packages']['alpha']['version'],"1.19.0")
+        self.assertEqual(data['packages']['alpha@1.0.0-rc.1']['version'],"1.0.0-rc.1")
+        self.assertEqual(data['packages']['alpha@v1.5']['version'],"1.5.0")
+        with QueryCounter() as bare:
+            self.fetch(["alpha","beta","gamma","delta"])
+        self.assertEqual(bare.count,1 + 4)
+
+    def test_renders_missing_documents(self):
+        Package_Version.objects.filter(package__name="gamma").update(document=None,document_etag=None)
+        status,content = self.fetch(["gamma"])
+        self.assertEqual(json.loads(content)['packages']['gamma']['name'],"gamma")
+
+    def test_bad_requests(self):
+        self.assertEqual(self.fetch(["alpha","not a name"])[0],400)
+        self.assertEqual(self.fetch(["alpha@one"])[0],400)
+        self.assertEqual(self.fetch({"names": ["alpha"]})[0],400)
+        self.assertEqual(self.client.put("/registry/-/batch/").status_code,405)
+
+class StatsTest(TestCase):
+    def setUp(self):
+        self.aggregator = stats.aggregator
+        stats.aggregator = stats.Aggregator()
+        package = make_package("counted")
+        package.version = "1.1.0"
+        package.save()
+
+    def tearDown(self):
+        stats.aggregator = self.aggregator
+
+    def counts(self):
+        return dict([(version,(fetches,downloads)) for version,fetches,downloads in Daily_Stat.objects.values_list('version','fetches','downloads')])
+
+    def test_counts_are_buffered(self):
+        for i in range(3): self.client.get("/registry/counted/")
+        self.client.get("/registry/counted/1.0.0/")
+        self.client.post("/registry/-/batch/",json.dumps(["counted@1.0.0","missing"]),content_type="application/json").content
+        self.assertEqual(self.counts(),{})
+        self.assertEqual(stats.flush(),2)
+        self.assertEqual(self.counts(),{"1.0.0": (2,0),"1.1.0": (3,0)})
+        stats.count_download("counted","1.0.0")
+        self.client.get("/registry/counted/")
+        stats.flush()
+        self.assertEqual(self.counts(),{"1.0.0": (2,1),"1.1.0": (4,0)})
+        self.assertEqual(stats.flush(),0)
+
+    def test_flush_query_count_is_fixed(self):
+        for i in range(50): stats.count_fetch("counted","1.0.%s" %i)
+        with QueryCounter() as queries:
+            self.assertEqual(stats.flush(),50)
+        self.assertEqual(queries.count,2)
+
+    def test_counts_of_parent_process_are_dropped(self):
+        stats.count_fetch("counted","1.0.0")
+        # As seen from a forked child.
+        stats.aggregator.pid = -1
+        self.assertEqual(stats.flush(),0)
+
+    def test_shutdown(self):
+        """The flusher thread is stopped before the last flush."""
+        stats.aggregator = stats.Aggregator(interval=60)
+        stats.count_fetch("counted","1.0.0")
+        thread = stats.aggregator.thread
+        self.assertTrue(thread.isAlive())
+        self.assertEqual(stats.shutdown(),1)
+        self.assertFalse(thread.isAlive())
+        stats.count_fetch("counted","1.0.0")
+        self.assertEqual(stats.aggregator.thread,thread)
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(self.counts(),{"1.0.0": (1,0)})
+
+    def test_view(self):
+        self.client.get("/registry/counted/")
+        stats.count_download("counted","1.1.0")
+        stats.flush()
+        data = json.loads(self.client.get("/registry/counted/stats/").content)
+        self.assertEqual((data['fetches'],data['downloads'],data['days']),(1,1,30))
+        self.assertEqual(data['daily'],[{"day": date.today().isoformat(),"fetches": 1,"downloads": 1}])
+        self.assertEqual(data['versions'],{"1.1.0": {"fetches": 1,"downloads": 1}})
+        self.assertEqual(self.client.get("/registry/counted/stats/",{"days": "x"}).status_code,400)
+        self.assertEqual(self.client.get("/registry/missing/stats/").status_code,404)
+
+class ChangesTest(TestCase):
+    def feed(self,since=0,**params):
+        params['since'] = since
+        return json.loads(self.client.get("/registry/-/changes/",params).content)
+
+    def test_feed(self):
+        first = make_package("first")
+        second = make_package("second")
+        seq = self.feed()['last_seq']
+        self.assertEqual(self.feed(seq),{"results": [],"last_seq": seq,"more": False})
+
+        first.maintainers.add(Contact.objects.create(first_name="A",last_name="B"))
+        data = self.feed(seq)
+        self.assertEqual([(row['name'],row['version']) for row in data['results']],[("first","1.0.0")])
+
+        second.version = "1.1.0"
+        second.save()
+        second.delete()
+        data = self.feed(data['last_seq'])
+        self.assertEqual(sorted([(row['name'],row['version'],row['deleted']) for row in data['results']]),[("second","1.0.0",True),("second","1.1.0",True)])
+
+    def test_limit(self):
+        for name in "abc": make_package(name)
+        data = self.feed(limit=2)
+        self.assertEqual(len(data['results']),2)
+        self.assertTrue(data['more'])
+        data = self.feed(data['last_seq'],limit=2)
+        self.assertEqual([row['name'] for row in data['results']],["c"])
+        self.assertFalse(data['more'])
+
+    def test_sequence_not_reused(self):
+        package = make_package("first")
+        seq = self.feed()['last_seq']
+        package.description = "Changed."
+        package.save()
+        self.assertTrue(self.feed()['last_seq'] > seq)
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self,*path):
+        return open(os.path.join(self.directory,'registry',*path)).read()
+
+    def test_export(self):
+        first = make_package("first")
+        make_package("second")
+        self.assertEqual(export.export(self.directory,processes=0),(2,8))
+        self.assertEqual(json.loads(self.read("first","1.0.0","package.json"))['name'],"first")
+        self.assertEqual(self.read("first","package.json"),self.read("first","1.0.0","package.json"))
+        compressed = gzip.GzipFile(fileobj=StringIO(self.read("second","1.0.0","package.json.gz"))).read()
+        self.assertEqual(compressed,self.read("second","1.0.0","package.json"))
+        self.assertEqual(export.export(self.directory,processes=0),(0,0))
+
+        first.version = "1.1.0"
+        first.save()
+        self.assertEqual(export.export(self.directory,processes=0),(1,4))
+        self.assertEqual(json.loads(self.read("first","package.json"))['version'],"1.1.0")
+        self.assertTrue(os.path.exists(os.path.join(self.directory,'registry',"first","1.0.0","package.json")))
+
+        first.delete()
+        self.assertEqual(export.export(self.directory,processes=0),(1,0))
+        self.assertFalse(os.path.exists(os.path.join(self.directory,'registry',"first","package.json")))
+        self.assertFalse(os.path.exists(os.path.join(self.directory,'registry',"first","1.1.0","package.json")))
+        self.assertEqual([name for name in os.listdir(self.directory) if name != 'registry'],[export.WATERMARK])
+
+class ImportTest(TestCase):
+    descriptors = [
+        {"name": "app","version": "1.0.0","description": "An app.","keywords": ["web","app"],
+         "maintainers": [{"name": "Ann Smith","email": "ann@example.com"}],
+         "contributors": ["Ann Smith <ANN@example.com>","Bob Jones (http://example.com/bob)"],
+         "licenses": [{"type": "MIT","url": "http://example.com/mit"}],
+         "dependencies": {"lib": "2.0.0","missing": "1.0.0"},
+         "os": ["linux"],"cpu": ["x86_64"],"engine": ["node"],
+         "directories": {"lib": "lib","doc": "docs"}},
+        {"name": "lib","version": "2.0.0","description": "A library.","license": "MIT",
+         "os": ["linux"],"cpu": ["x86_64"],"engine": ["node"]},
+        {"name": "broken","version": "not a version"},
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for i,descriptor in enumerate(self.descriptors):
+            f = open(os.path.join(self.directory,"%s.json" %i),"w")
+            f.write(json.dumps(descriptor))
+            f.close()
+        f = open(os.path.join(self.directory,"invalid.json"),"w")
+        f.write("{")
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_import(self):
+        call_command('import_packages',self.directory,processes=2,batch_size=1,stdout=StringIO(),stderr=StringIO())
+        self.assertEqual(sorted(Package.objects.values_list('name',flat=True)),["app","lib"])
+        app = Package.objects.get(name="app")
+        lib = Package.objects.get(name="lib")
+        self.assertEqual(app.requirements_id,lib.requirements_id)
+        self.assertEqual(Contact.objects.count(),2)
+        self.assertEqual(Contact.objects.filter(email_key="ann@example.com").values_list('maintained_count','contributed_count')[0],(1,1))
+        self.assertEqual(License.objects.count(),2)
+
+        data = json.loads(app.versions.get(number="1.0.0").document)
+        self.assertEqual(data['keywords'],["web","app"])
+        self.assertEqual(data['dependencies'],{"lib": "2.0.0"})
+        self.assertEqual(len(data['contributors']),2)
+        self.assertEqual(data['directories'],{"doc": "docs","lib": "lib"})
+        self.assertEqual(data['engine'],["node"])
+
+        results,has_next = search.search("library")
+        self.assertEqual(results[0][0],lib.pk)
+
+    def test_titles(self):
+        """A package without a title of its own whose name is the title of
+        another gets a title no other package has.
+        """
+        importer = Importer()
+        importer.import_batch([("a",{"name": "one","version": "1.0.0","title": "two"}),("b",{"name": "two","version": "1.0.0"})])
+        importer.import_batch([("c",{"name": "three","version": "1.0.0","title": "two"})])
+        self.assertEqual(importer.errors,[])
+        self.assertEqual(sorted(Package.objects.values_list('name','title')),[("one","two"),("three","three"),("two","two (2)")])
+
+    def test_scripts(self):
+        """Packages keep their own paths for scripts of the same name, and a
+        specification may be named by its title.
+        """
+        Specification.objects.create(title="Modules/1.1",name="http://wiki.commonjs.org/wiki/Modules/1.1")
+        importer = Importer()
+        importer.import_batch([("a",{"name": "one","version": "1.0.0","scripts": {"test": "test/one.js"},"implements": ["Modules/1.1"]})])
+        importer.import_batch([("b",{"name": "two","version": "1.0.0","scripts": {"test": "test/two.js"},"implements": ["Modules/1.1"]})])
+        self.assertEqual(importer.errors,[])
+        for name in ("one","two"):
+            package = Package.objects.get(name=name)
+            self.assertEqual(list(package.scripts.values_list('name','path')),[("test","test/%s.js" %name)])
+            self.assertEqual(json.loads(package.versions.get().document)['scripts'],{"test": "test/%s.js" %name})
+            self.assertEqual(list(package.implements.values_list('title',flat=True)),["Modules/1.1"])
+        self.assertEqual(Specification.objects.count(),1)
+
+class ImportRollbackTest(TransactionTestCase):
+    def test_rolled_back(self):
+        """A batch the database refuses is recorded and forgotten, and the
+        import goes on.
+        """
+        importer = Importer()
+        make_package("clash")
+        carl = {"name": "Carl Marx","email": "carl@example.com"}
+        self.assertEqual(importer.import_batch([
+            ("a",{"name": "fine","version": "1.0.0","maintainers": [carl],"os": ["plan9"]}),
+            ("b",{"name": "clash","version": "1.0.0"}),
+            ("c",{"name": "bad"}),
+        ]),0)
+        self.assertEqual([path for path,error in importer.errors],["c","a","b"])
+        self.assertTrue(importer.errors[1][1].startswith("Not imported"))
+        self.assertEqual(Contact.objects.count(),0)
+
+        self.assertEqual(importer.import_batch([("d",{"name": "three","version": "1.0.0","maintainers": [carl],"os": ["plan9"]}),("e",{"name": "fine","version": "1.0.0"})]),2)
+        three = Package.objects.get(name="three")
+        self.assertEqual(list(three.maintainers.values_list('email',flat=True)),["carl@example.com"])
+        self.assertEqual(list(three.requirements.os.values_list('name',flat=True)),["plan9"])
+        self.assertEqual([person['name'] for person in json.loads(three.versions.get().document)['maintainers']],["Carl Marx"])
+        self.assertEqual(importer.imported,2)
+
+class PlatformTest(TestCase):
+    def setUp(self):
+        self.linux = Operating_System.objects.create(title="Linux",name="linux")
+        self.windows = Operating_System.objects.create(title="Windows",name="windows")
+        self.arm = Cpu.objects.create(title="ARM",name="arm")
+        self.node = JavaScript_Engine.objects.create(title="Node",name="node")
+        self.anywhere = make_package("anywhere")
+        self.unix = make_package("unix")
+        self.unix.requirements.os.add(self.linux)
+        self.unix.requirements.engines.add(self.node)
+        self.desktop = make_package("desktop")
+        self.desktop.requirements.os.add(self.windows,self.linux)
+        self.desktop.requirements.cpu.add(self.arm)
+
+    def names(self,**platform):
+        return list(platforms.compatible(Package.objects.order_by('name'),**platform).values_list('name',flat=True))
+
+    def test_bits(self):
+        self.assertEqual((self.linux.bit,self.windows.bit),(0,1))
+        self.assertEqual(self.arm.mask,1)
+
+    def test_masks(self):
+        desktop = Package.objects.get(pk=self.desktop.pk)
+        self.assertEqual((desktop.os_mask,desktop.cpu_mask,desktop.engine_mask),(3,1,0))
+        self.desktop.requirements.os.remove(self.linux)
+        self.assertEqual(Package.objects.get(pk=self.desktop.pk).os_mask,2)
+
+    def test_compatible(self):
+        self.assertEqual(self.names(os=["linux"]),["anywhere","desktop","unix"])
+        self.assertEqual(self.names(os=["windows"]),["anywhere","desktop"])
+        self.assertEqual(self.names(os=["linux"],engine=["rhino"]),["anywhere","desktop"])
+        self.assertEqual(self.names(os=["solaris"],cpu=["arm"]),["anywhere"])
+        with QueryCounter() as counter:
+            self.names(os=["linux"],cpu=["arm"],engine=["node"])
+        self.assertEqual(counter.count,1)
+
+    def test_view(self):
+        data = json.loads(self.client.get('/registry/-/compatible/',{'os': 'linux,windows','cpu': 'x86','limit': 1}).content)
+        self.assertEqual([row['name'] for row in data['results']],["anywhere"])
+        data = json.loads(self.client.get('/registry/-/compatible/',{'os': 'linux,windows','cpu': 'x86','after': data['next']}).content)
+        self.assertEqual([row['name'] for row in data['results']],["unix"])
+        self.assertEqual(data['next'],None)
+
+class BrowseTest(TestCase):
+    def setUp(self):
+        mit = License.objects.create(title="MIT License",abbreviation="MIT",url="http://example.com/mit")
+        self.packages = {}
+        for i,name in enumerate(("delta","alpha","echo","bravo","charlie")):
+            package = self.packages[name] = make_package(name)
+            if i % 2 == 0: package.licenses.add(mit)
+        # alpha and echo were updated at the same time.
+        for name,day in (("delta",1),("alpha",3),("echo",3),("bravo",4),("charlie",2)):
+            Package.objects.filter(name=name).update(updated=datetime(2010,1,day,12,0,0,500))
+
+    def pages(self,**params):
+        """Follow the cursors from the first page to the last."""
+        pages = []
+        params.setdefault('limit',2)
+        while True:
+            data = json.loads(self.client.get("/registry/-/browse/",params).content)
+            pages.append([row['name'] for row in data['results']])
+            if not data['next']: return pages
+            params['cursor'] = data['next']
+
+    def test_by_name(self):
+        self.assertEqual(self.pages(),[["alpha","bravo"],["charlie","delta"],["echo"]])
+
+    def test_newest_first(self):
+        self.assertEqual(self.pages(sort="updated"),[["bravo","echo"],["alpha","charlie"],["delta"]])
+        data = json.loads(self.client.get("/registry/-/browse/",{"sort": "updated","limit": 1}).content)
+        self.assertEqual(data['results'][0]['updated'],"2010-01-04T12:00:00.000500")
+
+    def test_relation_change_updates(self):
+        """A change to a relation of a package, which does not save it,
+        moves it to the front of the newest first order.
+        """
+        self.packages['delta'].maintainers.add(Contact.objects.create(first_name="Ann",last_name="Smith"))
+        self.assertEqual(self.pages(sort="updated",limit=5),[["delta","bravo","echo","alpha","charlie"]])
+        Dependency.objects.create(from_package=self.packages['charlie'],to_package=self.packages['delta'])
+        self.assertEqual(self.pages(sort="updated",limit=2)[0],["charlie","delta"])
+
+    def test_filters(self):
+        self.assertEqual(self.pages(license="MIT",sort="updated"),[["echo","charlie"],["delta"]])
+        self.assertEqual(self.pages(license="GPL"),[[]])
+        linux = Operating_System.objects.create(title="Linux",name="linux")
+        windows = Operating_System.objects.create(title="Windows",name="windows")
+        self.packages['echo'].requirements.os.add(windows)
+        self.assertEqual(self.pages(os="linux",license="MIT",limit=5),[["charlie","delta"]])
+
+    def test_cursor_keeps_its_sort(self):
+        cursor = browse.encode_cursor("updated",(datetime(2010,1,3,12,0,0,500),self.packages['echo'].pk))
+        self.assertEqual(browse.decode_cursor(cursor),("updated",(datetime(2010,1,3,12,0,0,500),self.packages['echo'].pk)))
+        data = json.loads(self.client.get("/registry/-/browse/",{"sort": "name","cursor": cursor}).content)
+        self.assertEqual([row['name'] for row in data['results']],["alpha","charlie","delta"])
+        self.assertEqual(self.client.get("/registry/-/browse/",{"cursor": "bogus"}).status_code,400)
+        self.assertEqual(self.client.get("/registry/-/browse/",{"sort": "size"}).status_code,400)
+
+class ArchiveTest(TestCase):
+    content = "".join([chr(i % 256) for i in range(200000)])
+
+    def setUp(self):
+        self.root = settings.PACKAGE_ARCHIVE_ROOT
+        settings.PACKAGE_ARCHIVE_ROOT = tempfile.mkdtemp()
+        self.package = make_package("packed","1.0.0")
+        self.url = '/registry/packed/1.0.0/archive/'
+        make_publisher()
+
+    def tearDown(self):
+        shutil.rmtree(settings.PACKAGE_ARCHIVE_ROOT)
+        settings.PACKAGE_ARCHIVE_ROOT = self.root
+
+    def upload(self,url=None,content=None,**credentials):
+        return self.client.put(url or self.url,content or self.content,content_type="application/octet-stream",**(credentials or basic_credentials()))
+
+    def test_permission(self):
+        response = self.client.put(self.url,self.content,content_type="application/octet-stream")
+        self.assertEqual(response.status_code,401)
+        self.assertTrue(response['WWW-Authenticate'].startswith("Basic"))
+        self.assertEqual(self.upload(**basic_credentials("publisher","wrong")).status_code,401)
+        User.objects.create_user("reader","reader@example.com","secret")
+        self.assertEqual(self.upload(**basic_credentials("reader")).status_code,403)
+        self.client.login(username="reader",password="secret")
+        self.assertEqual(self.upload(**basic_credentials("reader")).status_code,403)
+        self.assertEqual(Archive.objects.count(),0)
+        self.client.logout()
+        self.client.login(username="publisher",password="secret")
+        self.assertEqual(self.client.put(self.url,self.content,content_type="application/octet-stream").status_code,201)
+
+    def test_not_replaced(self):
+        checksums = json.loads(self.upload().content)['checksums']
+        response = self.upload(content="replaced")
+        self.assertEqual(response.status_code,409)
+        self.assertEqual(Archive.objects.count(),1)
+        document = json.loads(self.client.get('/registry/packed/').content)
+        self.assertEqual(document['checksums'],checksums)
+
+    def test_upload(self):
+        response = self.upload()
+        self.assertEqual(response.status_code,201)
+        data = json.loads(response.content)
+        self.assertEqual(data['checksums']['sha256'],hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(data['checksums']['md5'],hashlib.md5(self.content).hexdigest())
+        archive = Archive.objects.get()
+        self.assertEqual(open(archives.path(archive),'rb').read(),self.content)
+        document = json.loads(self.package.versions.get(number="1.0.0").document)
+        self.assertEqual(document['checksums'],data['checksums'])
+
+    def test_deduplicated(self):
+        self.upload()
+        self.package.version = "1.1.0"
+        self.package.save()
+        self.upload('/registry/packed/1.1.0/archive/')
+        self.assertEqual(Archive.objects.count(),1)
+        document = json.loads(self.package.versions.get(number="1.0.0").document)
+        self.assertEqual(document['version'],"1.0.0")
+        self.assertTrue('checksums' in document)
+
+    def test_download(self):
+        self.upload()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code,200)
+        self.assertEqual(response.content,self.content)
+        self.assertEqual(response['Accept-Ranges'],'bytes')
+        response = self.client.get(self.url,HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code,304)
+
+    def test_range(self):
+        self.upload()
+        response = self.client.get(self.url,HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code,206)
+        self.assertEqual(response.content,self.content[100:200])
+        self.assertEqual(response['Content-Range'],'bytes 100-199/%s' %len(self.content))
+        self.assertEqual(self.client.get(self.url,HTTP_RANGE='bytes=-10').content,self.content[-10:])
+        self.assertEqual(self.client.get(self.url,HTTP_RANGE='bytes=%s-' %len(self.content)).status_code,416)
+
+    def test_sendfile(self):
+        self.upload()
+        settings.PACKAGE_ARCHIVE_SENDFILE = 'X-Sendfile'
+        try:
+            response = self.client.get(self.url)
+        finally:
+            settings.PACKAGE_ARCHIVE_SENDFILE = None
+        self.assertEqual(response['X-Sendfile'],archives.path(Archive.objects.get()))
+        self.assertEqual(response.content,"")
+
+class SyntheticRegistryTest(TestCase):
+    def test_repeatable(self):
+        first = list(benchmarks.synthetic_descriptors(50,seed=1))
+        self.assertEqual(first,list(benchmarks.synthetic_descriptors(50,seed=1)))
+        for i,descriptor in enumerate(first):
+            earlier = set([d['name'] for d in first[:i]])
+            self.assertTrue(set(descriptor['dependencies']) <= earlier)
+
+    def test_registry(self):
+        names = benchmarks.synthetic_registry(30,history=3)
+        self.assertEqual(len(names),30)
+        for name in names[:5]:
+            self.assertEqual(Package_Version.objects.latest_version(name).number,Package.objects.get(name=name).version)
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        make_related_package("timed",1)
+        instrumentation.reset()
+
+    def test_server_timing(self):
+        response = self.client.get('/registry/timed/versions/')
+        timing = response['Server-Timing']
+        self.assertTrue(timing.startswith('db;dur='))
+        self.assertTrue('desc="1 queries"' in timing)
+        self.assertTrue('total;dur=' in timing)
+
+    def test_phases(self):
+        stats = instrumentation.start()
+        try:
+            bulk_to_commonjs(Package.objects.all())
+        finally:
+            instrumentation.stop()
+        self.assertEqual(list(stats.phases),['serialize'])
+        self.assertEqual(stats.queries,13)
+
+    def test_metrics(self):
+        self.client.get('/registry/timed/versions/')
+        self.client.get('/registry/timed/versions/')
+        text = self.client.get('/metrics').content
+        view = 'fwp.packageserver.views.versions'
+        self.assertTrue('registry_request_duration_seconds_bucket{view="%s",le="+Inf"} 2' %view in text)
+        self.assertTrue('registry_request_duration_seconds_count{view="%s"} 2' %view in text)
+        self.assertTrue('registry_db_queries_total{view="%s"} 2' %view in text)
+
+    def test_streamed(self):
+        """The queries of a streamed body, read after the view returns, are
+        recorded once the body has been read.
+        """
+        response = self.client.get('/registry/')
+        self.assertFalse(response.has_header('Server-Timing'))
+        view = 'fwp.packageserver.views.catalog'
+        self.assertFalse(view in instrumentation.render())
+        self.assertTrue("timed" in json.loads(response.content))
+        text = instrumentation.render()
+        self.assertTrue('registry_request_duration_seconds_count{view="%s"} 1' %view in text)
+        self.assertFalse('registry_db_queries_total{view="%s"} 0' %view in text)
+        self.assertEqual(instrumentation.current(),None)
+
+class AdminTest(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        User.objects.create_superuser("admin","admin@example.com","secret")
+        self.client.login(username="admin",password="secret")
+        linux = Operating_System.objects.create(title="Linux",name="linux")
+        for i in range(5):
+            package = make_related_package("listed%s" %i,i)
+            if i % 2: package.requirements.os.add(linux)
+
+    def test_changelist_queries_are_fixed(self):
+        with QueryCounter() as few:
+            response = self.client.get('/admin/packageserver/package/')
+        self.assertEqual(response.status_code,200)
+        for i in range(5,10): make_related_package("listed%s" %i,i)
+        with QueryCounter() as many:
+            response = self.client.get('/admin/packageserver/package/')
+        self.assertEqual(len(response.context['cl'].result_list),10)
+        self.assertEqual(few.count,many.count)
+        self.assertContains(response,"First1 Last")
+
+    def test_platform_filter(self):
+        response = self.client.get('/admin/packageserver/package/',{'os': 'linux'})
+        self.assertEqual([p.name for p in response.context['cl'].result_list],["listed1","listed3"])
+        self.assertContains(response,"Operating System compatibility")
+
+    def test_search(self):
+        """Searches match the start of the case folded keys with a range
+        that SQLite answers from their indexes.
+        """
+        response = self.client.get('/admin/packageserver/package/',{'q': 'LISTED3'})
+        self.assertEqual([p.name for p in response.context['cl'].result_list],["listed3"])
+        response = self.client.get('/admin/packageserver/contact/',{'q': 'first2 LAST'})
+        self.assertEqual([c.first_name for c in response.context['cl'].result_list],["First2"])
+        response = self.client.get('/admin/packageserver/contact/',{'q': 'irst'})
+        self.assertEqual(list(response.context['cl'].result_list),[])
+        for model,fields in ((Package,('name_key','title_key')),(Contact,('last_name_key','first_name_key','email_key'))):
+            sql,params = admin.prefix_search(model.objects.all(),fields,"X").query.get_compiler('default').as_sql()
+            self.assertFalse("LIKE" in sql,sql)
+            self.assertEqual(sorted(params),sorted(["x","x" + admin.PREFIX_END] * len(fields)))
+            for field in fields:
+                self.assertTrue(model._meta.get_field(field).db_index or model._meta.get_field(field).unique)
+
+    def test_estimated_count(self):
+        paginator = admin.EstimatedCountPaginator(Package.objects.all(),10)
+        self.assertEqual(paginator.count,5)
+        self.assertEqual(admin.estimated_count(Package),Package.objects.order_by('-pk')[0].pk)
+
+    def test_change_form(self):
+        package = Package.objects.get(name="listed1")
+        response = self.client.get('/admin/packageserver/package/%s/' %package.pk)
+        self.assertEqual(response.status_code,200)
+        self.assertContains(response,'vManyToManyRawIdAdminField')
+
+class DatabaseTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.replica = connections['replica']
+        self.name = self.replica.settings_dict['NAME']
+        self.replicas = getattr(settings,'REPLICA_DATABASES',())
+        settings.REPLICA_DATABASES = ('replica',)
+
+    def tearDown(self):
+        self.replica.settings_dict['NAME'] = self.name
+        settings.REPLICA_DATABASES = self.replicas
+        shutil.rmtree(self.directory)
+
+    def test_mirror_is_not_used(self):
+        with routers.replica():
+            self.assertEqual(Package.objects.all().db,'default')
+
+    def test_reads_go_to_replica(self):
+        self.replica.settings_dict['NAME'] = os.path.join(self.directory,"replica.db")
+        with routers.replica():
+            # Not synced yet.
+            self.assertEqual(Package.objects.all().db,'default')
+        open(self.replica.settings_dict['NAME'],'w').close()
+        with routers.replica():
+            self.assertEqual(Package.objects.all().db,'replica')
+            self.assertEqual(routers.ReplicaRouter().db_for_write(Package),'default')
+        self.assertEqual(Package.objects.all().db,'default')
+
+    def test_stale_replica_is_not_used(self):
+        primary = connections['default'].settings_dict
+        name = primary['NAME']
+        primary['NAME'] = os.path.join(self.directory,"primary.db")
+        self.replica.settings_dict['NAME'] = os.path.join(self.directory,"replica.db")
+        try:
+            open(primary['NAME'],'w').close()
+            open(self.replica.settings_dict['NAME'],'w').close()
+            os.utime(primary['NAME'],(time.time() - 60,time.time() - 60))
+            self.assertEqual(routers.replica_aliases(),['replica'])
+            # A write to the primary after the sync.
+            open(primary['NAME'] + '-wal','w').close()
+            self.assertEqual(routers.replica_aliases(),[])
+            with routers.replica():
+                self.assertEqual(Package.objects.all().db,'default')
+        finally:
+            primary['NAME'] = name
+
+    def test_pragmas(self):
+        settings_dict = dict(self.replica.settings_dict,NAME=os.path.join(self.directory,"replica.db"))
+        replica = self.replica.__class__(settings_dict,alias='replica')
+        try:
+            cursor = replica.cursor()
+            self.assertEqual(cursor.execute("PRAGMA journal_mode").fetchone()[0],'wal')
+            self.assertEqual(cursor.execute("PRAGMA query_only").fetchone()[0],1)
+            self.assertRaises(DatabaseError,cursor.execute,"CREATE TABLE t (id integer)")
+        finally:
+            replica.close()
+
+class ServerTest(TestCase):
+    def test_thread_pool(self):
+        """Slow requests are handled at the same time by the pool."""
+        def application(environ,start_response):
+            time.sleep(0.2)
+            start_response('200 OK',[('Content-Type','text/plain')])
+            return [environ['PATH_INFO']]
+        pool = server.make_server('127.0.0.1',0,4,application)
+        serving = threading.Thread(target=pool.serve_forever)
+        serving.start()
+        try:
+            port = pool.server_address[1]
+            responses = []
+            def fetch(path):
+                http = httplib.HTTPConnection('127.0.0.1',port,timeout=10)
+                http.request('GET',path)
+                responses.append(http.getresponse().read())
+            clients = [threading.Thread(target=fetch,args=("/%s" %i,)) for i in range(4)]
+            start = time.time()
+            for client in clients: client.start()
+            for client in clients: client.join()
+            self.assertTrue(time.time() - start < 0.6)
+            self.assertEqual(sorted(responses),["/0","/1","/2","/3"])
+        finally:
+            pool.stop()
+            serving.join()
+
+    def test_percentile(self):
+        self.assertEqual(benchmarks.percentile(range(100),0.99),99)
+        self.assertEqual(benchmarks.percentile(range(100),0.5),50)
+        self.assertEqual(benchmarks.percentile([],0.5),None)
+
+    def test_mixed_load(self):
+        """Every kind of request in a mix reaches the server, bodies
+        included, and is reported.
+        """
+        def application(environ,start_response):
+            body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+            status = environ['PATH_INFO'] == '/missing' and '404 NOT FOUND' or '200 OK'
+            start_response(status,[('Content-Type','text/plain')])
+            return ["%s %s" %(environ['REQUEST_METHOD'],len(body))]
+        pool = server.make_server('127.0.0.1',0,4,application)
+        serving = threading.Thread(target=pool.serve_forever)
+        serving.start()
+        try:
+            traffic = [
+                ('fetch',3,[('GET',u"/package",None,None)]),
+                ('publish',1,[('PUT',u"/archive",64,None),('PUT',u"/missing",64,None)]),
+            ]
+            elapsed,results = benchmarks.mixed_load('127.0.0.1',pool.server_address[1],traffic,clients=4,requests=25,processes=2)
+        finally:
+            pool.stop()
+            serving.join()
+        self.assertEqual(len(results),100)
+        report = dict([(row[0],row) for row in benchmarks.load_report(elapsed,results)])
+        self.assertEqual(report['all'][1],100)
+        self.assertEqual(report['fetch'][6],0.0)
+        self.assertTrue(0 < report['publish'][6] < 1)
+        self.assertEqual(report['fetch'][1] + report['publish'][1],100)
+
+    def test_parse_mix(self):
+        self.assertEqual(benchmarks.parse_mix("fetch=90, search ,publish=0"),[('fetch',90),('search',10)])
+        self.assertRaises(ValueError,benchmarks.parse_mix,"fetch=many")
+        self.assertRaises(ValueError,benchmarks.parse_mix,"download=1")
+        self.assertRaises(ValueError,benchmarks.parse_mix,"publish=0")
+
+    def test_traffic(self):
+        """The requests built for a load test all succeed on the registry."""
+        names = benchmarks.synthetic_registry(10,history=0)
+        built = benchmarks.traffic(names,count=5)
+        self.assertEqual([kind for kind,weight,requests in built],[kind for kind,weight in benchmarks.TRAFFIC_MIX])
+        self.assertEqual(len(built[-1][2]),Package_Version.objects.count())
+        directory = tempfile.mkdtemp()
+        settings.PACKAGE_ARCHIVE_ROOT,root = directory,settings.PACKAGE_ARCHIVE_ROOT
+        try:
+            for kind,weight,requests in built:
+                for method,path,body,headers in requests[:5]:
+                    headers = dict([('HTTP_' + key.upper(),value) for key,value in (headers or {}).items()])
+                    if method == 'GET': response = self.client.get(path,**headers)
+                    elif method == 'POST': response = self.client.post(path,body,content_type="application/json",**headers)
+                    else: response = self.client.put(path,os.urandom(body),content_type="application/octet-stream",**headers)
+                    self.assertTrue(response.status_code in benchmarks.SUCCESS,(path,response.status_code))
+        finally:
+            settings.PACKAGE_ARCHIVE_ROOT = root
+            shutil.rmtree(directory)
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -20,4 +1333,3 @@ Another way to test that 1 + 1 is equal to 2.
 >>> 1 + 1 == 2
 True
 """}
-
@@ -0,0 +1,29 @@
+"""
+URLs of the CommonJS package registry.
+
+See http://wiki.commonjs.org/wiki/Packages/Registry
+"""
+
+# Imports #
+
+from django.conf.urls.defaults import *
+
+# Patterns #
+
+urlpatterns = patterns('fwp.packageserver.views',
+    (r'^$', 'catalog'),
+    (r'^-/search/$', 'search'),
+    (r'^-/changes/$', 'changes'),
+    (r'^-/compatible/$', 'compatible'),
+    (r'^-/batch/$', 'batch'),
+    (r'^-/browse/$', 'browse'),
+    (r'^-/maintainers/$', 'maintainers'),
+    (r'^-/maintainers/(?P<email>[^/]+)/$', 'maintainer'),
+    (r'^(?P<package_name>[\w.-]+)/$', 'package'),
+    (r'^(?P<package_name>[\w.-]+)/versions/$', 'versions'),
+    (r'^(?P<package_name>[\w.-]+)/dependencies/$', 'dependencies'),
+    (r'^(?P<package_name>[\w.-]+)/dependents/$', 'dependents'),
+    (r'^(?P<package_name>[\w.-]+)/stats/$', 'package_stats'),
+    (r'^(?P<package_name>[\w.-]+)/(?P<version_number>[\w.+-]+)/$', 'package'),
+    (r'^(?P<package_name>[\w.-]+)/(?P<version_number>[\w.+-]+)/archive/$', 'archive'),
+)
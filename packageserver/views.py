@@ -6,16 +6,616 @@ See http://wiki.commonjs.org/wiki/Packages/Registry
 """
 
 # Imports #
+import base64
+import re
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from django.contrib.auth import authenticate
 from django.shortcuts import get_object_or_404, render_to_response
-from django.http import HttpResponse
+from django.core.servers.basehttp import FileWrapper
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, HttpResponseNotFound
 from django.template import Context, RequestContext
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
+
+from django.db import DEFAULT_DB_ALIAS
 
 from models import *
+from documents import refresh_documents
+from changes import changes_since
+from dependents import dependents_page
+from platforms import compatible as compatible_packages
+from routers import reads_from_replica, replica
+import archives
+import batches
+import contacts
+import browse as browse_index
+import instrumentation
+from resolver import Resolver
+import search as search_index
+import semver
+import stats
+
+# Constants #
+
+ACCEPTS_NDJSON = re.compile(r'\bapplication/x-ndjson\b')
+
+# Packages read per query when streaming the catalog.
+CATALOG_CHUNK = 500
+
+# Default and greatest number of packages in a page of compatible packages.
+COMPATIBLE_LIMIT = 100
+MAX_COMPATIBLE_LIMIT = 1000
+
+# Default and greatest number of packages in a page of dependents.
+DEPENDENTS_LIMIT = 100
+MAX_DEPENDENTS_LIMIT = 1000
+
+# Default and greatest number of contacts or packages in a page of the 
+# maintainer directory.
+CONTACTS_LIMIT = 100
+MAX_CONTACTS_LIMIT = 1000
+
+# Default and greatest number of days of statistics.
+STATS_DAYS = 30
+MAX_STATS_DAYS = 366
+
+# Helpers #
+
+def accepts_gzip(request):
+    """Indicates the client accepts gzip encoded responses: its 
+    Accept-Encoding lists gzip or x-gzip, or failing those *, with a q-value 
+    above zero. A q-value of zero refuses the encoding.
+    """
+    qualities = {}
+    for entry in request.META.get('HTTP_ACCEPT_ENCODING','').split(','):
+        parameters = entry.split(';')
+        coding = parameters[0].strip().lower()
+        quality = 1.0
+        for parameter in parameters[1:]:
+            name,equals,value = parameter.partition('=')
+            if name.strip().lower() != 'q': continue
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = max(quality,qualities.get(coding,0.0))
+    for coding in ('gzip','x-gzip'):
+        if coding in qualities: return max(qualities.get('gzip',0.0),qualities.get('x-gzip',0.0)) > 0
+    return qualities.get('*',0.0) > 0
+
+def bad_request(reason):
+    """Respond with a JSON error for a malformed request."""
+    return HttpResponseBadRequest(json.dumps({"error": "bad_request","reason": reason}),content_type="application/json")
+
+def not_found(reason):
+    """Respond with a JSON error rather than the HTML 404 page."""
+    return HttpResponseNotFound(json.dumps({"error": "not_found","reason": reason}),content_type="application/json")
+
+def unauthorized(reason):
+    """Respond with a JSON error asking for HTTP basic credentials."""
+    response = HttpResponse(json.dumps({"error": "unauthorized","reason": reason}),status=401,content_type="application/json")
+    response['WWW-Authenticate'] = 'Basic realm="registry"'
+    return response
+
+def forbidden(reason):
+    """Respond with a JSON error for a user without permission."""
+    return HttpResponse(json.dumps({"error": "forbidden","reason": reason}),status=403,content_type="application/json")
+
+def conflict(reason):
+    """Respond with a JSON error for a change to something that is fixed."""
+    return HttpResponse(json.dumps({"error": "conflict","reason": reason}),status=409,content_type="application/json")
+
+def publisher(request):
+    """Get the user a request is made by: the one logged in, or the one 
+    named by HTTP basic credentials, as publishing tools send. Returns None 
+    if neither authenticates.
+    """
+    if request.user.is_authenticated(): return request.user
+    scheme,space,credentials = request.META.get('HTTP_AUTHORIZATION','').partition(' ')
+    if scheme.lower() != 'basic': return None
+    try:
+        username,colon,password = base64.b64decode(credentials.strip()).partition(':')
+    except TypeError:
+        return None
+    if not colon: return None
+    return authenticate(username=username,password=password)
+
+def _catalog_fragments():
+    """Generate the catalog document piece by piece. Packages are read in 
+    chunks ordered by name, each chunk starting after the last name of the 
+    previous one, so memory use is the same however large the registry is. 
+    (QuerySet.iterator() would still read every row at once under SQLite.)
+    """
+    yield '{'
+    last = None
+    first = True
+    # The response is read after the view returns, so the replica is chosen 
+    # here rather than by decorating the view.
+    with replica():
+        while True:
+            rows = Package.objects.order_by('name')
+            if last is not None: rows = rows.filter(name__gt=last)
+            rows = list(rows.values_list('name','version','title','description')[:CATALOG_CHUNK])
+            if not rows: break
+            fragments = []
+            for name,version,title,description in rows:
+                entry = {"name": name,"version": version,"title": title,"description": description}
+                fragments.append('%s%s: %s' %(not first and ',' or '',json.dumps(name),json.dumps(entry)))
+                first = False
+            yield ''.join(fragments)
+            last = rows[-1][0]
+            if len(rows) < CATALOG_CHUNK: break
+    yield '}'
+
+def _batch_fragments(specs,lines=False):
+    """Generate the response to a batch request piece by piece, a chunk of 
+    packages at a time: a JSON object of the documents by spec and a list of 
+    the specs not found, or with lines a document per line, or an error 
+    object for a spec not found. See batches.py.
+    """
+    missing = []
+    first = True
+    # The response is read after the view returns, so the replica is chosen 
+    # here rather than by decorating the view.
+    with replica():
+        if not lines: yield '{"packages": {'
+        for spec,name,version,document in batches.fetch_documents(specs):
+            if document is None:
+                missing.append(spec)
+                if lines: yield json.dumps({"error": "not_found","package": spec}) + '\n'
+                continue
+            stats.count_fetch(name,version)
+            if lines:
+                yield document + '\n'
+            else:
+                yield '%s%s: %s' %(not first and ',' or '',json.dumps(spec),document)
+                first = False
+    if not lines: yield '},"missing": %s}' %json.dumps(missing)
 
 # Views #
 
+def catalog(request):
+    """Respond with the root catalog of the registry at registry/: a JSON 
+    object with an entry for every package, keyed by name. The response is 
+    streamed as the packages are read. See _catalog_fragments().
+    """
+    return HttpResponse(_catalog_fragments(),content_type="application/json")
+
+def _package_validators(request,package_name,version_number=None):
+    """Get the id, ETag and modification time of a package document without 
+    loading the document itself. Without a version number the latest version 
+    is used. The lookup is made once per request, since both of the 
+    condition() callables and the view need it.
+    """
+    if not hasattr(request,'_package_validators'):
+        if version_number: versions = Package_Version.objects.by_number(package_name,version_number)
+        else: versions = Package_Version.objects.newest_first(package_name)
+        fields = ('pk','package','document_etag','document_modified','number')
+        rows = versions.values_list(*fields)[:1]
+        row = rows and rows[0] or None
+        request._package_database = versions.db
+        if row and row[2] is None:
+            refresh_documents([row[1]])
+            request._package_database = DEFAULT_DB_ALIAS
+            # The new document is only on the primary until it reaches the 
+            # replicas.
+            row = Package_Version.objects.using(request._package_database).filter(pk=row[0]).values_list(*fields)[0]
+            if row[2] is None: row = None
+        request._package_validators = row
+    return request._package_validators
+
+def package_etag(request,package_name,version_number=None):
+    """The ETag of the representation of a package document that will be 
+    served. Gzip encoded and plain responses get different tags.
+    """
+    row = _package_validators(request,package_name,version_number)
+    if row is None: return None
+    if accepts_gzip(request): return "%s-gzip" %row[2]
+    return row[2]
+
+def package_last_modified(request,package_name,version_number=None):
+    """The time a package document was last rendered."""
+    row = _package_validators(request,package_name,version_number)
+    if row is None: return None
+    return row[3]
+
+@reads_from_replica
+@condition(etag_func=package_etag,last_modified_func=package_last_modified)
 def package(request,package_name,version_number=None):
-    """Respond to a package root URL in the form of registry/<package_name>."""
-    pass
+    """Respond to a package root URL in the form of registry/<package_name>, 
+    or to a specific version at registry/<package_name>/<version_number>. 
+    The package root serves the latest version.
+
+    The stored package.json document is served as is; the relations of the 
+    package are never loaded here. See documents.py. Clients that send 
+    matching If-None-Match or If-Modified-Since headers get a 304, and 
+    clients that accept gzip get the copy compressed when it was stored.
+    """
+    row = _package_validators(request,package_name,version_number)
+    if row is None:
+        if version_number and Package.objects.filter(name=package_name).exists():
+            return not_found("Version %s of %s does not exist." %(version_number,package_name))
+        return not_found("Package %s does not exist." %package_name)
+
+    gzipped = accepts_gzip(request)
+    documents = Package_Version.objects.using(request._package_database).filter(pk=row[0])
+    if gzipped: content = base64.b64decode(documents.values_list('document_gzip',flat=True)[0])
+    else: content = documents.values_list('document',flat=True)[0]
+
+    if request.method == 'GET': stats.count_fetch(package_name,row[4])
+    response = HttpResponse(content,content_type="application/json")
+    response['Content-Length'] = str(len(content))
+    if gzipped: response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response,('Accept-Encoding',))
+    return response
+
+def batch(request):
+    """Respond with the documents of many packages at once, at 
+    registry/-/batch. The packages are given as "name" or "name@version" 
+    specs, either as a JSON list in the body of a POST or as the comma 
+    separated packages parameter of a GET. With format=ndjson, or an Accept 
+    header of application/x-ndjson, the documents are written one per line. 
+    Either way the response is streamed as the packages are read. See 
+    _batch_fragments().
+    """
+    if request.method == 'POST':
+        try:
+            specs = json.loads(request.raw_post_data)
+        except ValueError:
+            return bad_request("The body must be a JSON list of packages.")
+        if isinstance(specs,dict): specs = specs.get('packages')
+        if not isinstance(specs,list): return bad_request("The body must be a JSON list of packages.")
+    elif request.method in ('GET','HEAD'):
+        specs = [spec for spec in request.GET.get('packages','').split(',') if spec.strip()]
+    else:
+        return HttpResponseNotAllowed(['GET','HEAD','POST'])
+    try:
+        specs = batches.parse_specs(specs)
+    except ValueError as e:
+        return bad_request(str(e))
+
+    if request.GET.get('format') == 'ndjson' or ACCEPTS_NDJSON.search(request.META.get('HTTP_ACCEPT','')):
+        return HttpResponse(_batch_fragments(specs,lines=True),content_type="application/x-ndjson")
+    return HttpResponse(_batch_fragments(specs),content_type="application/json")
+
+@reads_from_replica
+def versions(request,package_name):
+    """List the versions of a package, oldest first, at 
+    registry/<package_name>/versions. With range=<range>, only the versions 
+    that satisfy the range are listed, along with the best of them, the one 
+    an installer would pick. See semver.py.
+    """
+    text = request.GET.get('range')
+    if text is None:
+        numbers = list(Package_Version.objects.for_package(package_name).values_list('number',flat=True))
+        if not numbers: return not_found("Package %s does not exist." %package_name)
+        return HttpResponse(json.dumps({"name": package_name,"versions": numbers}),content_type="application/json")
+
+    try:
+        version_range = semver.compile_range(text)
+    except semver.RangeError as e:
+        return bad_request(str(e))
+    rows = list(Package_Version.objects.for_package(package_name).values_list('number','major','minor','patch','prerelease'))
+    if not rows: return not_found("Package %s does not exist." %package_name)
+    # The rows are in the order of the keys, so the keys can be bisected.
+    keys = [semver.key(major,minor,patch,prerelease) for number,major,minor,patch,prerelease in rows]
+    best = version_range.best(keys)
+    return HttpResponse(json.dumps({
+        "name": package_name,
+        "range": text,
+        "versions": [rows[i][0] for i in version_range.select(keys)],
+        "best": best is not None and rows[best][0] or None,
+    }),content_type="application/json")
+
+@reads_from_replica
+def dependencies(request,package_name):
+    """Respond with the complete, transitive dependency graph of a package at 
+    registry/<package_name>/dependencies. See resolver.py.
+    """
+    try:
+        package = Package.objects.get(name=package_name)
+    except Package.DoesNotExist:
+        return not_found("Package %s does not exist." %package_name)
+    graph = Resolver().resolve(package)
+    return HttpResponse(json.dumps(graph),content_type="application/json")
+
+@reads_from_replica
+def dependents(request,package_name):
+    """Respond with the packages that depend on a package directly at 
+    registry/<package_name>/dependents, with the number of its direct and 
+    transitive dependents. Pages follow on with after=<next>&limit=<number>. 
+    See dependents.py.
+    """
+    try:
+        after = int(request.GET.get('after',0))
+        limit = max(1,min(int(request.GET.get('limit',DEPENDENTS_LIMIT)),MAX_DEPENDENTS_LIMIT))
+    except ValueError:
+        return bad_request("The after and limit parameters must be numbers.")
+    rows = Package.objects.filter(name=package_name).values_list('pk','dependent_count','transitive_dependent_count')[:1]
+    if not rows: return not_found("Package %s does not exist." %package_name)
+    pk,count,transitive = rows[0]
+
+    results,more = dependents_page(pk,after,limit)
+    data = {
+        "name": package_name,
+        "dependents": count,
+        "transitive_dependents": transitive,
+        "results": [{"name": name,"version": version} for id,name,version in results],
+        "next": more and results[-1][0] or None,
+    }
+    return HttpResponse(json.dumps(data),content_type="application/json")
+
+def _contact_data(contact):
+    """The directory entry of a contact."""
+    return {
+        "name": (u"%s %s" %(contact.first_name,contact.last_name)).strip(),
+        "email": contact.email,
+        "web": contact.website,
+        "maintains": contact.maintained_count,
+        "contributes": contact.contributed_count,
+    }
+
+@reads_from_replica
+def maintainers(request):
+    """Respond with a page of the maintainer directory at 
+    registry/-/maintainers: the contacts with an email address, in order of 
+    address, with how many packages each maintains and contributes to. 
+    Pages follow on with after=<next>&limit=<number>. See contacts.py.
+    """
+    try:
+        limit = max(1,min(int(request.GET.get('limit',CONTACTS_LIMIT)),MAX_CONTACTS_LIMIT))
+    except ValueError:
+        return bad_request("The limit must be a number.")
+    results,more = contacts.contacts_page(request.GET.get('after'),limit)
+    data = {
+        "results": [_contact_data(contact) for contact in results],
+        "next": more and results[-1].email_key or None,
+    }
+    return HttpResponse(json.dumps(data),content_type="application/json")
+
+@reads_from_replica
+def maintainer(request,email):
+    """Respond with a contact and the packages they maintain at 
+    registry/-/maintainers/<email>, or contribute to with 
+    role=contributor. The email address may be written in any case. Pages 
+    follow on with after=<next>&limit=<number>. See contacts.py.
+    """
+    try:
+        after = int(request.GET.get('after',0))
+        limit = max(1,min(int(request.GET.get('limit',CONTACTS_LIMIT)),MAX_CONTACTS_LIMIT))
+    except ValueError:
+        return bad_request("The after and limit parameters must be numbers.")
+    role = request.GET.get('role','maintainer')
+    if role not in ('maintainer','contributor'): return bad_request("The role must be maintainer or contributor.")
+    contact = contacts.get_contact(email)
+    if contact is None: return not_found("No contact has the email address %s." %email)
+
+    results,more = contacts.packages_page(contact,role + 's',after,limit)
+    data = _contact_data(contact)
+    data.update({
+        "role": role,
+        "results": [{"name": name,"version": version} for id,name,version in results],
+        "next": more and results[-1][0] or None,
+    })
+    return HttpResponse(json.dumps(data),content_type="application/json")
+
+@reads_from_replica
+def package_stats(request,package_name):
+    """Respond with how many times the document and the archives of a 
+    package were fetched over the last days, by day and by version, at 
+    registry/<package_name>/stats?days=<number>. Counts reach the rollups 
+    read here a few seconds after the requests they count. See stats.py.
+    """
+    try:
+        days = max(1,min(int(request.GET.get('days',STATS_DAYS)),MAX_STATS_DAYS))
+    except ValueError:
+        return bad_request("The days must be a number.")
+    if not Package.objects.filter(name=package_name).exists():
+        return not_found("Package %s does not exist." %package_name)
+
+    (fetches,downloads),daily,versions = stats.package_stats(package_name,days)
+    data = {
+        "name": package_name,
+        "days": days,
+        "fetches": fetches,
+        "downloads": downloads,
+        "daily": [{"day": day.isoformat(),"fetches": f,"downloads": d} for day,f,d in daily],
+        "versions": dict([(version,{"fetches": f,"downloads": d}) for version,(f,d) in versions.items()]),
+    }
+    return HttpResponse(json.dumps(data),content_type="application/json")
+
+@reads_from_replica
+def search(request):
+    """Respond with a page of packages matching the q parameter, best match 
+    first, at registry/-/search?q=<terms>&page=<number>. See search.py.
+    """
+    query = request.GET.get('q','')
+    try:
+        page = max(int(request.GET.get('page',1)),1)
+    except ValueError:
+        return bad_request("The page must be a number.")
+
+    results,has_next = search_index.search(query,page)
+    rows = Package.objects.filter(pk__in=[pk for pk,score in results]).values('pk','name','version','title','description')
+    rows = dict([(row['pk'],row) for row in rows])
+
+    data = {
+        "query": query,
+        "page": page,
+        "next": has_next and page + 1 or None,
+        "results": [],
+    }
+    for pk,score in results:
+        if pk not in rows: continue
+        row = rows[pk]
+        del row['pk']
+        row['score'] = score
+        data['results'].append(row)
+    return HttpResponse(json.dumps(data),content_type="application/json")
+
+@reads_from_replica
+def changes(request):
+    """Respond with the changes made after a sequence number, at 
+    registry/-/changes?since=<seq>&limit=<number>. Mirrors keep the last_seq 
+    of each response and pass it as since on their next poll. See changes.py.
+    """
+    try:
+        since = int(request.GET.get('since',0))
+        limit = int(request.GET.get('limit',100))
+    except ValueError:
+        return bad_request("since and limit must be numbers.")
+
+    rows,more = changes_since(since,limit)
+    data = {
+        "results": [{"seq": seq,"name": name,"version": version,"deleted": deleted} for seq,name,version,deleted in rows],
+        "last_seq": rows and rows[-1][0] or since,
+        "more": more,
+    }
+    return HttpResponse(json.dumps(data),content_type="application/json")
+
+@reads_from_replica
+def browse(request):
+    """Respond with a page of packages, by name or newest first, at 
+    registry/-/browse?sort=<name|updated>&limit=<number>. The os, cpu and 
+    engine parameters filter as for compatible, and license is a comma 
+    separated list of license abbreviations, any of which may match. Pages 
+    follow on with cursor=<next>. Every page costs the same however far 
+    along it is. See browse.py.
+    """
+    try:
+        limit = max(1,min(int(request.GET.get('limit',browse_index.DEFAULT_LIMIT)),browse_index.MAX_LIMIT))
+    except ValueError:
+        return bad_request("The limit must be a number.")
+    platform = {}
+    for kind in ('os','cpu','engine'):
+        platform[kind] = [name.strip() for name in request.GET.get(kind,'').split(',') if name.strip()]
+    licenses = [name.strip() for name in request.GET.get('license','').split(',') if name.strip()]
+
+    try:
+        rows,following = browse_index.browse(request.GET.get('sort','name'),request.GET.get('cursor'),limit,platform,licenses)
+    except browse_index.CursorError as e:
+        return bad_request(str(e))
+    data = {
+        "results": [
+            {"name": name,"version": version,"title": title,"description": description,"updated": updated.isoformat()}
+            for name,version,title,description,updated in rows
+        ],
+        "next": following,
+    }
+    return HttpResponse(json.dumps(data),content_type="application/json")
+
+@reads_from_replica
+def compatible(request):
+    """Respond with the packages that run on a platform, by name, at 
+    registry/-/compatible?os=<names>&cpu=<names>&engine=<names>. Each 
+    parameter is a comma separated list of names, any of which may match. 
+    Pages follow on with after=<last name>&limit=<number>. See platforms.py.
+    """
+    try:
+        limit = max(1,min(int(request.GET.get('limit',COMPATIBLE_LIMIT)),MAX_COMPATIBLE_LIMIT))
+    except ValueError:
+        return bad_request("The limit must be a number.")
+    platform = {}
+    for kind in ('os','cpu','engine'):
+        platform[kind] = [name.strip() for name in request.GET.get(kind,'').split(',') if name.strip()]
+
+    packages = compatible_packages(Package.objects.order_by('name'),**platform)
+    after = request.GET.get('after')
+    if after: packages = packages.filter(name__gt=after)
+    rows = list(packages.values_list('name','version')[:limit + 1])
+
+    data = {
+        "platform": platform,
+        "results": [{"name": name,"version": version} for name,version in rows[:limit]],
+        "next": len(rows) > limit and rows[limit - 1][0] or None,
+    }
+    return HttpResponse(json.dumps(data),content_type="application/json")
+
+def _archive_version(request,package_name,version_number):
+    """Get the Package_Version of an archive URL, or None. The lookup is made 
+    once per request.
+    """
+    if not hasattr(request,'_archive_version'):
+        rows = Package_Version.objects.by_number(package_name,version_number).select_related('package','archive')[:1]
+        request._archive_version = rows and rows[0] or None
+    return request._archive_version
+
+def archive_etag(request,package_name,version_number):
+    """Archives never change, so the sha256 of the content is its ETag."""
+    if request.method not in ('GET','HEAD'): return None
+    version = _archive_version(request,package_name,version_number)
+    return version and version.archive_id and version.archive.sha256 or None
+
+@condition(etag_func=archive_etag)
+def archive(request,package_name,version_number):
+    """Download the archive of a package version with GET, or upload it with 
+    PUT, at registry/<package_name>/<version_number>/archive. Uploads are 
+    the raw archive as the request body, made by a user with permission to 
+    change packages, and a version's archive is never replaced, so that its 
+    checksums can be trusted. See archives.py.
+
+    Downloads honor a single byte range, and are handed to the web server 
+    when a sendfile header is configured.
+    """
+    version = _archive_version(request,package_name,version_number)
+    if version is None: return not_found("Version %s of %s does not exist." %(version_number,package_name))
+
+    if request.method == 'PUT':
+        user = publisher(request)
+        if user is None: return unauthorized("Uploading an archive requires credentials.")
+        if not user.has_perm('packageserver.change_package'): return forbidden("%s may not upload archives." %user.username)
+        if version.archive_id: return conflict("Version %s of %s already has an archive." %(version_number,package_name))
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return bad_request("The Content-Length must be a number.")
+        if length <= 0: return bad_request("The archive is empty.")
+        try:
+            archive = archives.store(request.environ['wsgi.input'],length)
+        except archives.IncompleteUpload as e:
+            return bad_request(str(e))
+        if not archives.attach(version,archive): return conflict("Version %s of %s already has an archive." %(version_number,package_name))
+        data = {"name": package_name,"version": version_number,"size": archive.size,"checksums": archive.checksums()}
+        return HttpResponse(json.dumps(data),status=201,content_type="application/json")
+
+    if request.method not in ('GET','HEAD'): return HttpResponseNotAllowed(['GET','HEAD','PUT'])
+    if not version.archive_id: return not_found("Version %s of %s has no archive." %(version_number,package_name))
+
+    archive = version.archive
+    filename = archives.path(archive)
+    byte_range = archives.parse_range(request.META.get('HTTP_RANGE',''),archive.size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = "bytes */%s" %archive.size
+        return response
 
+    if byte_range:
+        first,last = byte_range
+        response = HttpResponse(archives.read_range(filename,first,last),status=206,content_type="application/x-gzip")
+        response['Content-Range'] = "bytes %s-%s/%s" %(first,last,archive.size)
+        response['Content-Length'] = str(last - first + 1)
+    else:
+        sendfile = archives.sendfile(archive)
+        if sendfile:
+            response = HttpResponse(content_type="application/x-gzip")
+            response[sendfile[0]] = sendfile[1]
+        else:
+            response = HttpResponse(FileWrapper(open(filename,'rb'),archives.CHUNK_SIZE),content_type="application/x-gzip")
+            response['Content-Length'] = str(archive.size)
+    # A download resumed with a range was counted when it started.
+    if request.method == 'GET' and (not byte_range or byte_range[0] == 0): stats.count_download(package_name,version_number)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = 'attachment; filename=%s-%s.tgz' %(package_name,version_number)
+    return response
 
+def metrics(request):
+    """Respond with the request latency histograms and query counters of 
+    this process, in the Prometheus text format, at /metrics. See 
+    instrumentation.py.
+    """
+    return HttpResponse(instrumentation.render(),content_type="text/plain; version=0.0.4")
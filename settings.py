@@ -11,13 +11,36 @@ ADMINS = (
 
 MANAGERS = ADMINS
 
-DATABASE_ENGINE = 'sqlite3'           # 'postgresql_psycopg2', 'postgresql', 'mysql', 'sqlite3' or 'oracle'.
-# Or path to database file if using sqlite3.
-DATABASE_NAME = '%s/data/server.db' %THIS_PATH
-DATABASE_USER = ''             # Not used with sqlite3.
-DATABASE_PASSWORD = ''         # Not used with sqlite3.
-DATABASE_HOST = ''             # Set to empty string for localhost. Not used with sqlite3.
-DATABASE_PORT = ''             # Set to empty string for default. Not used with sqlite3.
+# The primary database takes every write. Registry reads go to the replicas 
+# in REPLICA_DATABASES, if any; see packageserver/routers.py. The 'replica' 
+# below is an example: a second SQLite file refreshed by hand with 
+# ./manage.py sync_replicas, and only read until the primary is next written.
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': '%s/data/server.db' %THIS_PATH,
+        # Seconds a writer waits for the lock before giving up.
+        'OPTIONS': {'timeout': 20},
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': '%s/data/replica.db' %THIS_PATH,
+        'OPTIONS': {'timeout': 20},
+        'TEST_MIRROR': 'default',
+        # Django 1.2 only works this out for the test databases it creates, 
+        # not for mirrors of them.
+        'SUPPORTS_TRANSACTIONS': True,
+    },
+}
+
+DATABASE_ROUTERS = ['fwp.packageserver.routers.ReplicaRouter']
+
+# Add 'replica' to read from the example replica above.
+REPLICA_DATABASES = ()
+
+# Keep database connections open between requests. See 
+# packageserver/databases.py, which also sets the SQLite pragmas.
+PERSISTENT_DATABASE_CONNECTIONS = True
 
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
@@ -61,6 +84,7 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'fwp.packageserver.middleware.TimingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -82,3 +106,19 @@ INSTALLED_APPS = (
     'django.contrib.admin',
     'fwp.packageserver',
 )
+
+# Directory that holds uploaded package archives, stored under their sha256.
+PACKAGE_ARCHIVE_ROOT = '%s/data/archives' %THIS_PATH
+
+# Header used to hand archive downloads off to the web server, e.g.
+# 'X-Sendfile' (Apache, lighttpd) or 'X-Accel-Redirect' (nginx). When None
+# the archive is streamed by Django. With X-Accel-Redirect, set the prefix
+# to the internal location that maps to PACKAGE_ARCHIVE_ROOT.
+PACKAGE_ARCHIVE_SENDFILE = None
+PACKAGE_ARCHIVE_SENDFILE_PREFIX = None
+
+# Fetch and download counts are kept in memory by each process and added to 
+# the daily rollups every STATS_FLUSH_INTERVAL seconds, or sooner once counts 
+# for STATS_MAX_PENDING rollup rows are waiting. See packageserver/stats.py.
+STATS_FLUSH_INTERVAL = 10
+STATS_MAX_PENDING = 1000
@@ -18,4 +18,10 @@ urlpatterns = patterns('',
 
     # Uncomment the next line to enable the admin:
     (r'^admin/', include(admin.site.urls)),
+
+    # The CommonJS package registry.
+    (r'^registry/', include('fwp.packageserver.urls')),
+
+    # Request metrics in the Prometheus text format.
+    (r'^metrics$', 'fwp.packageserver.views.metrics'),
 )